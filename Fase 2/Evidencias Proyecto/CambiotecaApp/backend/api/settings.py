@@ -127,6 +127,10 @@ DATABASES = {
     }
 }
 
+# Tablas no administradas + SQL de MySQL en migraciones: la BD de test se arma
+# desde los modelos (ver api/test_runner.py)
+TEST_RUNNER = "api.test_runner.CambiotecaTestRunner"
+
 
 
 
@@ -149,6 +153,26 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Hashing de contraseñas: PASSWORD_HASHER = argon2 | bcrypt | pbkdf2.
+# argon2 requiere `argon2-cffi` y bcrypt requiere `bcrypt`. Los hashes de los
+# otros algoritmos se siguen aceptando y se re-hashean al iniciar sesión
+# (python manage.py bench_login compara el throughput de cada opción).
+PASSWORD_HASHER_OPCIONES = {
+    "argon2": "core.hashers.Argon2Hasher",
+    "bcrypt": "core.hashers.BCryptHasher",
+    "pbkdf2": "core.hashers.PBKDF2Hasher",
+}
+PASSWORD_HASHER = os.getenv("PASSWORD_HASHER", "pbkdf2").lower()
+PASSWORD_HASHERS = [PASSWORD_HASHER_OPCIONES.get(PASSWORD_HASHER, PASSWORD_HASHER_OPCIONES["pbkdf2"])] + [
+    h for k, h in PASSWORD_HASHER_OPCIONES.items() if k != PASSWORD_HASHER
+] + ["django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher"]
+
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", "1000000"))
+PASSWORD_ARGON2_TIME_COST = int(os.getenv("PASSWORD_ARGON2_TIME_COST", "2"))
+PASSWORD_ARGON2_MEMORY_COST = int(os.getenv("PASSWORD_ARGON2_MEMORY_COST", "102400"))  # KiB
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -187,13 +211,77 @@ CORS_ALLOWED_ORIGINS = [
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "core.authentication.UsuarioJWTAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
+    "DEFAULT_THROTTLE_CLASSES": [
+        "core.throttles.IPThrottle",
+        "core.throttles.CuentaThrottle",
+    ],
+    # Proxies de confianza delante de la app (balanceador = 1). Con 0 la IP del
+    # cliente es REMOTE_ADDR y X-Forwarded-For se ignora: si no, cualquiera
+    # podría inventarse una IP por request y saltarse el throttle por IP.
+    "NUM_PROXIES": int(os.getenv("NUM_PROXIES", "0")),
+}
+
+# Caché: Redis compartido si hay REDIS_URL; si no, memoria local del proceso
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Límites por vista (core/throttles.py): "N/periodo" = a lo más N intentos en cualquier periodo
+THROTTLE_CACHE = "default"
+THROTTLE_BUCKETS = {
+    "login_view":           {"ip": "30/min", "cuenta": "5/min"},
+    "forgot_password":      {"ip": "10/hour", "cuenta": "3/hour"},
+    "reset_password":       {"ip": "10/hour", "cuenta": "5/hour"},
+    "change_password_view": {"ip": "30/min", "cuenta": "5/min"},
 }
 
+# TTL de respaldo del feed de inicio (market/feed.py); se refresca al escribir
+FEED_LATEST_TTL = int(os.getenv("FEED_LATEST_TTL", "300"))
+
+# Segundos que se cachean los conteos por faceta del catálogo (market/facetas.py)
+FACETAS_TTL = int(os.getenv("FACETAS_TTL", "60"))
+
+# Índice en memoria del autocompletado (market/sugerencias.py)
+SUGERENCIAS_MAX_TERMINOS = int(os.getenv("SUGERENCIAS_MAX_TERMINOS", "50000"))
+SUGERENCIAS_REFRESCO = int(os.getenv("SUGERENCIAS_REFRESCO", "600"))  # segundos
+
+# Reconstrucción completa del grafo de coincidencias (market/coincidencias.py); entre
+# medio se actualiza con los eventos publicados en el caché. Sin REDIS_URL cada
+# proceso solo ve sus propios eventos y lo de los demás llega con este refresco
+COINCIDENCIAS_REFRESCO = int(os.getenv("COINCIDENCIAS_REFRESCO", "1800"))
+
+# Segundos que se cachea el conjunto de favoritos de cada usuario (market/favoritos.py)
+FAVORITOS_TTL = int(os.getenv("FAVORITOS_TTL", "600"))
+
+# Bitácora de actividad (core/actividad.py): se escribe en lotes de N eventos
+# o cada T segundos; sobre ACTIVIDAD_COLA_MAX pendientes por proceso se descarta
+ACTIVIDAD_LOTE = int(os.getenv("ACTIVIDAD_LOTE", "100"))
+ACTIVIDAD_INTERVALO = int(os.getenv("ACTIVIDAD_INTERVALO", "5"))
+ACTIVIDAD_COLA_MAX = int(os.getenv("ACTIVIDAD_COLA_MAX", "10000"))
+# False: sin hilo ni atexit, la cola se escribe al terminar cada request
+ACTIVIDAD_EN_SEGUNDO_PLANO = os.getenv("ACTIVIDAD_EN_SEGUNDO_PLANO", "True") == "True"
+
+# Cada cuántos segundos un proceso trae las sesiones revocadas (core/sesiones.py)
+SESIONES_REFRESCO = int(os.getenv("SESIONES_REFRESCO", "5"))
+
+# Segundos que se cachea el Usuario del token en cada proceso
+AUTH_USUARIO_CACHE_TTL = int(os.getenv("AUTH_USUARIO_CACHE_TTL", "60"))
+
 # SimpleJWT (opcional: ajustar expiraciones)
 
 SIMPLE_JWT = {
@@ -230,6 +318,16 @@ EMAIL_HOST_PASSWORD = "".replace(" ", "")   # p.ej. ****abb8
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER  # en sandbox vale cualquiera
 FRONTEND_RESET_URL = "http://localhost:8100/auth/reset"
 
+# Cola de tareas (python manage.py procesar_tareas). En True se ejecutan al
+# confirmar la transacción, sin worker (solo desarrollo).
+TAREAS_EAGER = os.getenv("TAREAS_EAGER", "False") == "True"
+
+# Chats de intercambios cerrados hace más de N días pasan al archivo frío
+# (python manage.py archivar_chats)
+CHAT_ARCHIVO_DIAS = int(os.getenv("CHAT_ARCHIVO_DIAS", "90"))
+# Segundos que queda en caché un archivo ya descomprimido
+CHAT_ARCHIVO_CACHE_TTL = int(os.getenv("CHAT_ARCHIVO_CACHE_TTL", "600"))
+
 
 
 
@@ -0,0 +1,97 @@
+# api/test_runner.py
+"""
+Runner de `python manage.py test` (settings.TEST_RUNNER).
+
+Las tablas de core y market vienen del dump de MySQL (`managed = False`) y sus
+migraciones las alteran con SQL directo, así que la BD de test no se puede
+armar con `migrate`. Este runner:
+
+- crea las tablas de core y market desde los modelos (sin sus migraciones),
+  tratando los modelos no administrados como administrados;
+- deja la bitácora de actividad sin hilo en segundo plano (core/actividad.py);
+- agrega las restricciones de la BD real de las que depende el código: la PK
+  compuesta de conversacion_participante y los índices únicos de las
+  migraciones market 0006/0009/0010/0013 y core 0007;
+- agrega conversacion.titulo, que existe en el dump pero no en el modelo
+  (lo lee el SQL de lista_conversaciones).
+"""
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.test.runner import DiscoverRunner
+
+APPS = ("core", "market")
+
+INDICES = {
+    "mysql": [
+        "ALTER TABLE conversacion ADD COLUMN titulo VARCHAR(255) NULL",
+        "ALTER TABLE conversacion_participante DROP PRIMARY KEY, "
+        "ADD PRIMARY KEY (id_conversacion, id_usuario)",
+        "ALTER TABLE intercambio ADD COLUMN libro_aceptado_activo INT "
+        "GENERATED ALWAYS AS (IF(estado_intercambio = 'Aceptado', id_libro_ofrecido_aceptado, NULL)) VIRTUAL",
+        "CREATE UNIQUE INDEX ux_intercambio_libro_activo ON intercambio (libro_aceptado_activo)",
+        "CREATE UNIQUE INDEX ux_intercambio_solicitud ON intercambio (id_solicitud)",
+        "CREATE UNIQUE INDEX ux_conversacion_intercambio ON conversacion (id_intercambio)",
+        "CREATE UNIQUE INDEX ux_favorito_usuario_libro ON favorito (id_usuario, id_libro)",
+        "CREATE UNIQUE INDEX ux_cm_emisor_clave "
+        "ON conversacion_mensaje (id_conversacion, id_usuario_emisor, clave_idempotencia)",
+        "ALTER TABLE notificacion ADD COLUMN grupo_abierto VARCHAR(45) AS ("
+        "IF(leido = 0 AND tipo IS NOT NULL, CONCAT(tipo, ':', IFNULL(referencia, 0)), NULL)) STORED",
+        "CREATE UNIQUE INDEX ux_notificacion_grupo ON notificacion (id_usuario, grupo_abierto)",
+    ],
+    "sqlite": [
+        "ALTER TABLE conversacion ADD COLUMN titulo VARCHAR(255) NULL",
+        "CREATE UNIQUE INDEX ux_intercambio_libro_activo ON intercambio (id_libro_ofrecido_aceptado) "
+        "WHERE estado_intercambio = 'Aceptado'",
+        "CREATE UNIQUE INDEX ux_intercambio_solicitud ON intercambio (id_solicitud)",
+        "CREATE UNIQUE INDEX ux_conversacion_intercambio ON conversacion (id_intercambio)",
+        "CREATE UNIQUE INDEX ux_favorito_usuario_libro ON favorito (id_usuario, id_libro)",
+        "CREATE UNIQUE INDEX ux_cm_emisor_clave "
+        "ON conversacion_mensaje (id_conversacion, id_usuario_emisor, clave_idempotencia)",
+        "CREATE UNIQUE INDEX ux_notificacion_grupo ON notificacion (id_usuario, tipo, IFNULL(referencia, 0)) "
+        "WHERE leido = 0 AND tipo IS NOT NULL",
+    ],
+}
+
+
+def _pk_compuesta_sqlite(cur):
+    # SQLite no tiene ALTER ... PRIMARY KEY: se recrea la tabla (está vacía)
+    cur.execute("SELECT sql FROM sqlite_master WHERE name = 'conversacion_participante'")
+    sql = cur.fetchone()[0]
+    sql = sql.replace('"id_conversacion" integer NOT NULL PRIMARY KEY', '"id_conversacion" integer NOT NULL')
+    sql = sql[:sql.rindex(")")] + ', PRIMARY KEY ("id_conversacion", "id_usuario"))'
+    cur.execute("DROP TABLE conversacion_participante")
+    cur.execute(sql)
+
+
+class CambiotecaTestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        # la bitácora de actividad se escribe al final de cada request, dentro
+        # del test (sin hilo que escriba fuera de la transacción ni atexit
+        # que escriba en la BD real cuando la de test ya no existe)
+        settings.ACTIVIDAD_EN_SEGUNDO_PLANO = False
+
+    def setup_databases(self, **kwargs):
+        self._no_administrados = [
+            m for m in apps.get_models()
+            if m._meta.app_label in APPS and not m._meta.managed
+        ]
+        for m in self._no_administrados:
+            m._meta.managed = True
+        settings.MIGRATION_MODULES = {**settings.MIGRATION_MODULES, **{a: None for a in APPS}}
+
+        config = super().setup_databases(**kwargs)
+        for alias in connections:
+            conn = connections[alias]
+            with conn.cursor() as cur:
+                if conn.vendor == "sqlite":
+                    _pk_compuesta_sqlite(cur)
+                for sql in INDICES.get(conn.vendor, ()):
+                    cur.execute(sql)
+        return config
+
+    def teardown_databases(self, old_config, **kwargs):
+        super().teardown_databases(old_config, **kwargs)
+        for m in self._no_administrados:
+            m._meta.managed = False
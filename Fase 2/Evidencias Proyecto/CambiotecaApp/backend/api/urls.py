@@ -6,6 +6,7 @@ from django.conf.urls.static import static
 
 from core.views import (
     login_view,
+    logout_view,
     register_usuario,
     regiones_view,
     comunas_view,
@@ -17,7 +18,9 @@ from core.views import (
     user_summary,
     update_user_profile,
     update_user_avatar,
-    user_books_view
+    user_books_view,
+    notificaciones_view,
+    notificaciones_leer,
 )
 
 urlpatterns = [
@@ -25,6 +28,7 @@ urlpatterns = [
 
     # Auth
     path('api/auth/login/', login_view),
+    path('api/auth/logout/', logout_view),
     path('api/auth/register/', register_usuario),
     path('api/auth/forgot/', forgot_password),
     path('api/auth/reset/', reset_password),
@@ -39,6 +43,8 @@ urlpatterns = [
     path('api/users/<int:id>/', update_user_profile),
     path('api/users/<int:id>/avatar/', update_user_avatar),
     path('api/users/<int:user_id>/books/', user_books_view),
+    path('api/users/<int:user_id>/notificaciones/', notificaciones_view),
+    path('api/users/<int:user_id>/notificaciones/leer/', notificaciones_leer),
 
     # Market (libros, my_books, etc.)
     path('api/', include('market.urls')),
@@ -0,0 +1,175 @@
+# core/actividad.py
+"""
+Bitácora de actividad (tabla `seguimiento_actividad`): logins, cambios de
+contraseña, altas/ediciones/bajas de libros y transiciones de intercambio.
+
+No se escribe en el request: `registrar(...)` deja el evento en una cola
+acotada en memoria del proceso y un hilo la vacía con un solo bulk_create
+cada ACTIVIDAD_LOTE eventos o ACTIVIDAD_INTERVALO segundos (lo que pase
+primero). Es una bitácora, no una transacción:
+
+- Cola llena (BD lenta o caída): el evento se descarta y se cuenta.
+- Falla el INSERT: el lote se descarta, se cuenta y se registra en el log.
+- Al terminar el proceso (atexit) se escribe lo pendiente.
+
+Con ACTIVIDAD_EN_SEGUNDO_PLANO = False (los tests lo apagan: api/test_runner.py)
+no hay hilo ni atexit: la cola se vacía al terminar cada request
+(request_finished, conectado en CoreConfig.ready()), en la BD y la
+transacción de ese momento.
+
+`estadisticas()` expone los contadores del proceso.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils import timezone
+from rest_framework.throttling import BaseThrottle
+
+from .models import SeguimientoActividad
+
+logger = logging.getLogger(__name__)
+
+AVISO_DESCARTES_CADA = 60  # segundos entre avisos de descarte en el log
+_IDENTIDAD = BaseThrottle()  # solo por get_ident()
+
+
+def ip_de(request) -> str:
+    # la misma IP que usa el throttle por IP: X-Forwarded-For solo cuenta
+    # según REST_FRAMEWORK["NUM_PROXIES"] (el primer salto lo escribe el cliente)
+    return (_IDENTIDAD.get_ident(request) or "")[:45]
+
+
+def dispositivo_de(request) -> str:
+    return (request.headers.get("X-Dispositivo") or request.headers.get("User-Agent") or "")[:50]
+
+
+class RegistroActividad:
+    def __init__(self, lote: int, intervalo: float, cola_max: int):
+        self.lote = lote
+        self.intervalo = intervalo
+        self._cola = queue.Queue(maxsize=cola_max)
+        self._lleno = threading.Event()     # hay un lote completo esperando
+        self._vaciando = threading.Lock()
+        self._arrancando = threading.Lock()
+        self._hilo = None
+        self._pid = None
+        self._avisado_en = 0.0
+        self.contadores = {"encolados": 0, "escritos": 0, "descartados": 0, "fallidos": 0}
+
+    # ---------- productor (requests) ----------
+    def registrar(self, usuario_id, accion: str, ip: str = "", dispositivo: str = "", ubicacion=None) -> bool:
+        self._asegurar_hilo()
+        fila = SeguimientoActividad(
+            id_usuario_id=usuario_id, accion=accion[:255], fecha_hora=timezone.now(),
+            ip_origen=ip, dispositivo=dispositivo, ubicacion=ubicacion,
+        )
+        try:
+            self._cola.put_nowait(fila)
+        except queue.Full:
+            self.contadores["descartados"] += 1
+            ahora = time.monotonic()
+            if ahora - self._avisado_en > AVISO_DESCARTES_CADA:
+                self._avisado_en = ahora
+                logger.warning("Cola de actividad llena: %s eventos descartados",
+                               self.contadores["descartados"])
+            return False
+        self.contadores["encolados"] += 1
+        if self._cola.qsize() >= self.lote:
+            self._lleno.set()
+        return True
+
+    # ---------- consumidor (hilo) ----------
+    def _asegurar_hilo(self):
+        # tras un fork (gunicorn --preload) el hilo del padre no existe en el hijo
+        if self._pid == os.getpid() or not en_segundo_plano():
+            return
+        with self._arrancando:
+            if self._pid != os.getpid():
+                if self._pid is None:
+                    atexit.register(_vaciar_al_salir)
+                self._pid = os.getpid()
+                self._hilo = threading.Thread(target=self._bucle, name="actividad", daemon=True)
+                self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            self._lleno.wait(self.intervalo)
+            self._lleno.clear()
+            try:
+                close_old_connections()
+                self.vaciar()
+            except Exception:
+                logger.exception("Error vaciando la cola de actividad")
+
+    def vaciar(self) -> int:
+        """Escribe todo lo pendiente (de a `lote` filas por INSERT)."""
+        escritos = 0
+        with self._vaciando:
+            while True:
+                filas = []
+                while len(filas) < self.lote:
+                    try:
+                        filas.append(self._cola.get_nowait())
+                    except queue.Empty:
+                        break
+                if not filas:
+                    return escritos
+                try:
+                    SeguimientoActividad.objects.bulk_create(filas)
+                except Exception:
+                    self.contadores["fallidos"] += len(filas)
+                    logger.exception("No se pudieron guardar %s eventos de actividad", len(filas))
+                    return escritos
+                self.contadores["escritos"] += len(filas)
+                escritos += len(filas)
+
+    def pendientes(self) -> int:
+        return self._cola.qsize()
+
+
+bitacora = RegistroActividad(
+    lote=getattr(settings, "ACTIVIDAD_LOTE", 100),
+    intervalo=getattr(settings, "ACTIVIDAD_INTERVALO", 5),
+    cola_max=getattr(settings, "ACTIVIDAD_COLA_MAX", 10_000),
+)
+
+
+def en_segundo_plano() -> bool:
+    return getattr(settings, "ACTIVIDAD_EN_SEGUNDO_PLANO", True)
+
+
+def _vaciar_al_salir():
+    if bitacora.pendientes():
+        try:
+            bitacora.vaciar()
+            connection.close()
+        except Exception:
+            logger.exception("No se pudo vaciar la cola de actividad al salir")
+
+
+def vaciar_al_terminar_request(**kwargs) -> None:
+    """Receptor de request_finished: sin hilo, lo del request se escribe aquí."""
+    if not en_segundo_plano() and bitacora.pendientes():
+        try:
+            bitacora.vaciar()
+        except Exception:
+            logger.exception("No se pudo vaciar la cola de actividad")
+
+
+def registrar(request, usuario_id, accion: str, ref=None) -> None:
+    """accion: 'libro_editado', 'login', ...; ref: id del objeto (queda como 'accion:ref')."""
+    if not usuario_id:
+        return
+    if ref is not None:
+        accion = f"{accion}:{ref}"
+    bitacora.registrar(int(usuario_id), accion, ip_de(request), dispositivo_de(request))
+
+
+def estadisticas() -> dict:
+    return {**bitacora.contadores, "pendientes": bitacora.pendientes()}
@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.core.signals import request_finished
+
+        from . import actividad
+
+        # registra las tareas de la cola (<app>/tareas.py)
+        autodiscover_modules('tareas')
+        # bitácora sin hilo (ACTIVIDAD_EN_SEGUNDO_PLANO = False): se vacía por request
+        request_finished.connect(actividad.vaciar_al_terminar_request,
+                                 dispatch_uid="actividad_vaciar")
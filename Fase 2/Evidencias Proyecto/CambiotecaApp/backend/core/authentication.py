@@ -0,0 +1,121 @@
+# core/authentication.py
+"""
+Autenticación JWT para `core.Usuario` (no usa django.contrib.auth).
+
+- `emitir_token(user)`: el token que entrega login_view (HS256, 24 h), con un
+  `jti` registrado en la tabla `sesion` (ver core/sesiones.py).
+- `UsuarioJWTAuthentication`: valida firma, expiración y que la sesión no esté
+  revocada (en memoria) del header `Authorization: Bearer <token>` y deja el
+  Usuario en `request.user`.
+- El Usuario se lee de un caché en memoria con TTL corto (por proceso), así
+  un endpoint protegido no agrega una consulta a la BD por request.
+"""
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
+
+from . import sesiones
+from .models import Usuario
+
+TOKEN_HORAS = 24
+TOKEN_ALGORITMO = "HS256"
+
+USUARIO_CACHE_TTL = getattr(settings, "AUTH_USUARIO_CACHE_TTL", 60)  # segundos
+USUARIO_CACHE_MAX = 10_000
+
+
+def emitir_token(user: Usuario, dispositivo: str = "") -> str:
+    ahora = timezone.now()
+    expira = ahora + datetime.timedelta(hours=TOKEN_HORAS)
+    payload = {
+        "id": user.id_usuario,
+        "email": user.email,
+        "exp": int(expira.timestamp()),
+        "iat": int(ahora.timestamp()),
+        "jti": sesiones.abrir(user.id_usuario, expira, dispositivo),
+    }
+    return jwt.encode(payload, settings.SECRET_KEY, algorithm=TOKEN_ALGORITMO)
+
+
+# =========================
+# Caché de usuarios (TTL)
+# =========================
+_cache = OrderedDict()  # id -> (expira_en, Usuario | None)
+_cache_lock = threading.Lock()
+
+
+def usuario_cacheado(user_id: int):
+    ahora = time.monotonic()
+    with _cache_lock:
+        hit = _cache.get(user_id)
+        if hit and hit[0] > ahora:
+            return hit[1]
+
+    user = Usuario.objects.filter(pk=user_id, activo=True).first()
+    with _cache_lock:
+        _cache[user_id] = (ahora + USUARIO_CACHE_TTL, user)
+        _cache.move_to_end(user_id)
+        while len(_cache) > USUARIO_CACHE_MAX:
+            _cache.popitem(last=False)
+    return user
+
+
+def invalidar_usuario(user_id: int) -> None:
+    """Llamar al cambiar datos que afectan la sesión (contraseña, activo)."""
+    with _cache_lock:
+        _cache.pop(user_id, None)
+
+
+# =========================
+# DRF
+# =========================
+class UsuarioJWTAuthentication(BaseAuthentication):
+    keyword = b"bearer"
+
+    def authenticate(self, request):
+        partes = get_authorization_header(request).split()
+        if not partes or partes[0].lower() != self.keyword:
+            return None  # sin token: la vista decide (AllowAny / IsAuthenticated)
+        if len(partes) != 2:
+            raise AuthenticationFailed("Header Authorization inválido.")
+
+        try:
+            payload = jwt.decode(
+                partes[1], settings.SECRET_KEY, algorithms=[TOKEN_ALGORITMO],
+                options={"require": ["exp", "id"]},
+            )
+        except jwt.ExpiredSignatureError:
+            raise AuthenticationFailed("Token expirado.")
+        except jwt.InvalidTokenError:
+            raise AuthenticationFailed("Token inválido.")
+        if sesiones.revocada(payload.get("jti")):
+            raise AuthenticationFailed("Sesión cerrada.")
+
+        user = usuario_cacheado(payload["id"])
+        if user is None:
+            raise AuthenticationFailed("Usuario no encontrado o inactivo.")
+        return (user, payload)
+
+    def authenticate_header(self, request):
+        return 'Bearer realm="api"'
+
+
+def usuario_id(request, valor=None):
+    """
+    Id del usuario que actúa. Con token válido manda el token (y un `valor`
+    distinto del body se rechaza); sin token se usa `valor` como hasta ahora,
+    por compatibilidad con las versiones de la app que aún no mandan token.
+    """
+    user = getattr(request, "user", None)
+    if isinstance(user, Usuario):
+        if valor not in (None, "") and str(valor) != str(user.id_usuario):
+            raise PermissionDenied("El usuario no coincide con el token.")
+        return user.id_usuario
+    return valor
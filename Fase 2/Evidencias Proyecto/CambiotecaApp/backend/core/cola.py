@@ -0,0 +1,162 @@
+# core/cola.py
+"""
+Cola de tareas simple respaldada en la BD (tablas `tarea` y `tarea_fallida`).
+
+- Registrar:   @tarea("core.enviar_correo_reset")
+- Encolar:     enviar_correo_reset.encolar(to=..., reset_link=...)
+               (se inserta en la misma transacción de la vista: si ésta hace
+               rollback, la tarea tampoco existe)
+- Procesar:    python manage.py procesar_tareas [--procesos N]
+- En lote:     @tarea("...", lote=True) recibe la lista de payloads del lote y
+               devuelve, por cada uno, None (ok) o el error (p.ej. varios
+               correos por una misma conexión SMTP).
+
+Cada worker toma lotes con SELECT ... FOR UPDATE SKIP LOCKED. Si una tarea
+falla se reintenta con backoff exponencial; al agotar `max_intentos` pasa a
+`tarea_fallida`. Los módulos `<app>/tareas.py` se cargan en CoreConfig.ready().
+"""
+import logging
+import os
+import random
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Tarea, TareaFallida
+
+logger = logging.getLogger(__name__)
+
+REGISTRO = {}
+EN_LOTE = set()  # tareas cuya función recibe una lista de payloads
+
+BACKOFF_BASE = 30          # segundos: 30, 60, 120, ...
+BACKOFF_MAX = 60 * 60      # tope 1 h
+TOMADA_TIMEOUT = timedelta(minutes=10)  # worker caído -> la tarea vuelve a la cola
+
+
+def tarea(nombre: str, max_intentos: int = 5, lote: bool = False):
+    """Registra la función como tarea y le agrega `.encolar(**payload)`."""
+    def deco(fn):
+        REGISTRO[nombre] = fn
+        if lote:
+            EN_LOTE.add(nombre)
+        fn.nombre_tarea = nombre
+        fn.encolar = lambda demora=0, **payload: encolar(
+            nombre, payload, demora=demora, max_intentos=max_intentos)
+        return fn
+    return deco
+
+
+def encolar(nombre: str, payload: dict | None = None, demora: int = 0, max_intentos: int = 5):
+    payload = payload or {}
+    if getattr(settings, "TAREAS_EAGER", False):
+        # modo desarrollo sin worker: se ejecuta al confirmar la transacción
+        transaction.on_commit(lambda: _ejecutar_directo(nombre, payload))
+        return None
+    return Tarea.objects.create(
+        nombre=nombre,
+        payload=payload,
+        max_intentos=max_intentos,
+        ejecutar_en=timezone.now() + timedelta(seconds=demora),
+    )
+
+
+def _ejecutar_directo(nombre: str, payload: dict):
+    if nombre in EN_LOTE:
+        error = REGISTRO[nombre]([payload])[0]
+        if error is not None:
+            raise error
+    else:
+        REGISTRO[nombre](**payload)
+
+
+def _backoff(intentos: int) -> timedelta:
+    segundos = min(BACKOFF_BASE * 2 ** max(intentos - 1, 0), BACKOFF_MAX)
+    return timedelta(seconds=segundos + random.uniform(0, segundos / 4))
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"[:64]
+
+
+def tomar_lote(limite: int = 10, worker: str | None = None) -> list:
+    """Reserva hasta `limite` tareas vencidas sin bloquear a otros workers."""
+    ahora = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Tarea.objects
+            .select_for_update(skip_locked=True)
+            .filter(Q(estado=Tarea.PENDIENTE, ejecutar_en__lte=ahora) |
+                    Q(estado=Tarea.EN_CURSO, tomada_en__lt=ahora - TOMADA_TIMEOUT))
+            .order_by('ejecutar_en')
+            .values_list('id', flat=True)[:limite]
+        )
+        if ids:
+            Tarea.objects.filter(id__in=ids).update(
+                estado=Tarea.EN_CURSO, tomada_en=ahora, tomada_por=worker or worker_id(),
+            )
+    return list(Tarea.objects.filter(id__in=ids).order_by('ejecutar_en')) if ids else []
+
+
+def ejecutar(t: Tarea) -> bool:
+    fn = REGISTRO.get(t.nombre)
+    try:
+        if fn is None:
+            raise LookupError(f"Tarea no registrada: {t.nombre}")
+        fn(**(t.payload or {}))
+    except Exception:
+        _registrar_fallo(t, traceback.format_exc())
+        return False
+    t.delete()
+    return True
+
+
+def ejecutar_grupo(nombre: str, tareas: list):
+    """Ejecuta varias tareas `lote=True` de un mismo nombre en una sola llamada."""
+    try:
+        errores = REGISTRO[nombre]([t.payload or {} for t in tareas])
+    except Exception:
+        errores = [traceback.format_exc()] * len(tareas)
+    ok = [t.pk for t, e in zip(tareas, errores) if e is None]
+    if ok:
+        Tarea.objects.filter(pk__in=ok).delete()
+    for t, e in zip(tareas, errores):
+        if e is not None:
+            _registrar_fallo(t, e if isinstance(e, str) else repr(e))
+
+
+def _registrar_fallo(t: Tarea, error: str):
+    intentos = t.intentos + 1
+    if intentos >= t.max_intentos:
+        logger.error("Tarea %s #%s agotó %s intentos", t.nombre, t.pk, intentos)
+        with transaction.atomic():
+            TareaFallida.objects.create(
+                nombre=t.nombre, payload=t.payload, intentos=intentos,
+                ultimo_error=error, creada_en=t.creada_en,
+            )
+            t.delete()
+        return
+    logger.warning("Tarea %s #%s falló (intento %s), se reintenta", t.nombre, t.pk, intentos)
+    Tarea.objects.filter(pk=t.pk).update(
+        estado=Tarea.PENDIENTE, intentos=intentos, ultimo_error=error,
+        ejecutar_en=timezone.now() + _backoff(intentos), tomada_en=None, tomada_por='',
+    )
+
+
+def procesar_lote(limite: int = 10, worker: str | None = None) -> int:
+    """Toma y ejecuta un lote. Devuelve cuántas tareas se procesaron."""
+    lote = tomar_lote(limite, worker)
+    grupos = {}
+    for t in lote:
+        if t.nombre in EN_LOTE:
+            grupos.setdefault(t.nombre, []).append(t)
+        else:
+            ejecutar(t)
+    for nombre, tareas in grupos.items():
+        ejecutar_grupo(nombre, tareas)
+    return len(lote)
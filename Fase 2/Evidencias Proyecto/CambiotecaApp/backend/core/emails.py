@@ -0,0 +1,140 @@
+# core/emails.py
+"""
+Correos transaccionales de Cambioteca (se envían desde la cola: core/tareas.py).
+
+- Las plantillas (templates/emails/) se compilan una sola vez por proceso.
+- El logo se lee de disco una sola vez.
+- `despachador` mantiene abierta la conexión SMTP entre envíos: una ráfaga de
+  correos cuesta un solo handshake TLS. Si el servidor corta la conexión se
+  reabre y se reintenta el mensaje.
+"""
+import logging
+import os
+import smtplib
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template
+from django.utils import timezone
+from email.mime.image import MIMEImage
+
+logger = logging.getLogger(__name__)
+
+SMTP_INACTIVIDAD = 60  # segundos: pasado esto se cierra la conexión (el servidor la cortaría igual)
+
+# errores de transporte: vale la pena reconectar y reintentar
+ERRORES_CONEXION = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+# =========================
+# Plantillas y logo (cacheados)
+# =========================
+@lru_cache(maxsize=None)
+def _plantilla(nombre: str):
+    return get_template(nombre)
+
+
+@lru_cache(maxsize=1)
+def _logo_bytes() -> bytes | None:
+    try:
+        logo_path = settings.MEDIA_ROOT / "app" / "cambioteca.png"
+    except TypeError:
+        logo_path = os.path.join(settings.MEDIA_ROOT, "app", "cambioteca.png")
+
+    try:
+        with open(logo_path, "rb") as f:
+            return f.read()
+    except Exception as e:
+        logger.warning("No se pudo adjuntar el logo: %s", e)
+        return None
+
+
+def correo_reset(email: str, nombres: str, reset_link: str) -> EmailMultiAlternatives:
+    """Arma el correo de restablecimiento de contraseña (texto + HTML + logo inline)."""
+    subject = "Restablece tu contraseña - Cambioteca"
+    from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@cambioteca.local')
+    logo = _logo_bytes()
+    ctx = {
+        "nombres": nombres,
+        "reset_link": reset_link,
+        "anio": timezone.now().year,
+        "con_logo": logo is not None,
+    }
+
+    msg = EmailMultiAlternatives(
+        subject, _plantilla("emails/reset_password.txt").render(ctx), from_email, [email],
+    )
+    msg.attach_alternative(_plantilla("emails/reset_password.html").render(ctx), "text/html")
+
+    if logo is not None:
+        img = MIMEImage(logo)
+        img.add_header("Content-ID", "<cambioteca_logo>")
+        img.add_header("Content-Disposition", "inline", filename="cambioteca.png")
+        msg.attach(img)
+
+    return msg
+
+
+# =========================
+# Despachador SMTP
+# =========================
+class Despachador:
+    """Conexión de correo reutilizable (una por proceso worker)."""
+
+    def __init__(self, inactividad: int = SMTP_INACTIVIDAD):
+        self.inactividad = inactividad
+        self._conn = None
+        self._ultimo_uso = 0.0
+        self._lock = threading.Lock()
+
+    def _conexion(self):
+        if self._conn is not None and time.monotonic() - self._ultimo_uso > self.inactividad:
+            self._cerrar()
+        if self._conn is None:
+            conn = get_connection(fail_silently=False)
+            conn.open()
+            self._conn = conn
+        return self._conn
+
+    def _enviar_uno(self, msg) -> Exception | None:
+        for intento in (1, 2):
+            try:
+                msg.connection = self._conexion()
+                msg.send(fail_silently=False)
+                return None
+            except ERRORES_CONEXION as e:
+                # conexión caída (timeout del servidor, red): reabrir y reintentar una vez
+                logger.warning("SMTP desconectado (intento %s): %s", intento, e)
+                self._cerrar()
+                if intento == 2:
+                    return e
+            except Exception as e:
+                # destinatario rechazado, etc.: la conexión sigue sirviendo
+                return e
+            finally:
+                msg.connection = None
+                self._ultimo_uso = time.monotonic()
+
+    def enviar(self, mensajes) -> list:
+        """Envía por la misma conexión. Devuelve, por mensaje, None o la excepción."""
+        with self._lock:
+            return [self._enviar_uno(m) for m in mensajes]
+
+    def _cerrar(self):
+        if self._conn is None:
+            return
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def cerrar(self):
+        with self._lock:
+            self._cerrar()
+
+
+despachador = Despachador()
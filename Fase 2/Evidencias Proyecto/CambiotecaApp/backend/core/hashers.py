@@ -0,0 +1,34 @@
+# core/hashers.py
+"""
+Hashers de contraseña con costo configurable desde settings.
+
+Mismo algoritmo que los de Django (los hashes existentes siguen validando);
+si se cambia el costo, `must_update` lo detecta y la contraseña se re-hashea
+en el siguiente login (ver core/passwords.py).
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher, BCryptSHA256PasswordHasher, PBKDF2PasswordHasher,
+)
+
+
+class PBKDF2Hasher(PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return getattr(settings, "PASSWORD_PBKDF2_ITERATIONS", PBKDF2PasswordHasher.iterations)
+
+
+class Argon2Hasher(Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return getattr(settings, "PASSWORD_ARGON2_TIME_COST", Argon2PasswordHasher.time_cost)
+
+    @property
+    def memory_cost(self):
+        return getattr(settings, "PASSWORD_ARGON2_MEMORY_COST", Argon2PasswordHasher.memory_cost)
+
+
+class BCryptHasher(BCryptSHA256PasswordHasher):
+    @property
+    def rounds(self):
+        return getattr(settings, "PASSWORD_BCRYPT_ROUNDS", BCryptSHA256PasswordHasher.rounds)
@@ -0,0 +1,42 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+
+class Command(BaseCommand):
+    help = "Mide verificaciones de contraseña por segundo (el costo de CPU de un login) por hasher."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--n", type=int, default=20, help="Verificaciones por hasher.")
+        parser.add_argument("--hilos", type=int, default=1)
+        parser.add_argument("--hasher", action="append",
+                            help="argon2 | bcrypt | pbkdf2 (repetible). Por defecto todos.")
+
+    def handle(self, *args, **opts):
+        opciones = settings.PASSWORD_HASHER_OPCIONES
+        nombres = opts["hasher"] or list(opciones)
+        pwd = "Cambioteca-bench-123"
+
+        self.stdout.write(f"{'hasher':<8} {'ms/login':>9} {'logins/s':>9}  (hilos={opts['hilos']})")
+        for nombre in nombres:
+            if nombre not in opciones:
+                self.stderr.write(f"{nombre}: hasher desconocido")
+                continue
+            hasher = import_string(opciones[nombre])()
+            try:
+                encoded = hasher.encode(pwd, hasher.salt())
+            except ValueError as e:  # librería opcional no instalada
+                self.stdout.write(f"{nombre:<8} no disponible ({e})")
+                continue
+
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=max(1, opts["hilos"])) as ex:
+                ok = all(ex.map(lambda _: hasher.verify(pwd, encoded), range(opts["n"])))
+            dt = time.perf_counter() - t0
+            assert ok
+            self.stdout.write(
+                f"{nombre:<8} {dt * 1000 * opts['hilos'] / opts['n']:>9.1f} {opts['n'] / dt:>9.1f}"
+            )
@@ -0,0 +1,23 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.cola import REGISTRO, encolar
+
+
+class Command(BaseCommand):
+    help = "Encola una tarea registrada (p.ej. desde cron: market.reconciliar_no_leidos)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("nombre")
+        parser.add_argument("--payload", default="{}", help="JSON con los argumentos de la tarea.")
+
+    def handle(self, *args, **opts):
+        if opts["nombre"] not in REGISTRO:
+            raise CommandError(f"Tarea desconocida. Registradas: {', '.join(sorted(REGISTRO))}")
+        try:
+            payload = json.loads(opts["payload"])
+        except ValueError as e:
+            raise CommandError(f"payload inválido: {e}")
+        t = encolar(opts["nombre"], payload)
+        self.stdout.write(self.style.SUCCESS(f"Encolada {opts['nombre']} (#{getattr(t, 'pk', '-')})"))
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import Sesion
+from core.sesiones import limpiar_expiradas
+
+
+class Command(BaseCommand):
+    help = ("Borra de la tabla `sesion` las sesiones expiradas (sus JWT ya no sirven), "
+            "en lotes chicos. Pensado para cron diario.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lote", type=int, default=1000, help="Filas por DELETE.")
+        parser.add_argument("--dias", type=int, default=0,
+                            help="Conservar las expiradas hace menos de N días (auditoría).")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        hasta = timezone.now() - timedelta(days=opts["dias"])
+        if opts["dry_run"]:
+            n = Sesion.objects.filter(fecha_expiracion__lte=hasta).count()
+            self.stdout.write(f"{n} sesiones expiradas.")
+            return
+        n = limpiar_expiradas(opts["lote"], hasta)
+        self.stdout.write(self.style.SUCCESS(f"Borradas {n} sesiones."))
@@ -0,0 +1,44 @@
+from django.contrib.auth.hashers import get_hasher, identify_hasher, make_password
+from django.core.management.base import BaseCommand
+
+from core.models import Usuario
+
+
+class Command(BaseCommand):
+    help = ("Hashea las contraseñas que siguen en texto plano y reporta los hashes "
+            "desactualizados (esos se actualizan solos en el próximo login).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lote", type=int, default=500)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        preferido = get_hasher("default")
+        planos, desactualizados, vigentes = [], 0, 0
+
+        qs = Usuario.objects.only("id_usuario", "contrasena").order_by("id_usuario")
+        for u in qs.iterator(chunk_size=opts["lote"]):
+            try:
+                hasher = identify_hasher(u.contrasena or "")
+            except ValueError:
+                if u.contrasena:
+                    planos.append(u)
+                continue
+            if hasher.algorithm != preferido.algorithm or hasher.must_update(u.contrasena):
+                desactualizados += 1
+            else:
+                vigentes += 1
+
+        self.stdout.write(
+            f"Texto plano: {len(planos)} · desactualizados: {desactualizados} · "
+            f"vigentes ({preferido.algorithm}): {vigentes}"
+        )
+        if opts["dry_run"] or not planos:
+            return
+
+        for i in range(0, len(planos), opts["lote"]):
+            bloque = planos[i:i + opts["lote"]]
+            for u in bloque:
+                u.contrasena = make_password(u.contrasena)
+            Usuario.objects.bulk_update(bloque, ["contrasena"])
+        self.stdout.write(self.style.SUCCESS(f"Hasheadas {len(planos)} contraseñas en texto plano."))
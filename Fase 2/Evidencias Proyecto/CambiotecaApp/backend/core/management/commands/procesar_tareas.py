@@ -0,0 +1,54 @@
+import multiprocessing
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.cola import procesar_lote, worker_id
+from core.emails import despachador
+
+
+class Command(BaseCommand):
+    help = "Worker de la cola de tareas (correo, imágenes, contadores)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--procesos", type=int, default=1)
+        parser.add_argument("--lote", type=int, default=10)
+        parser.add_argument("--intervalo", type=float, default=2.0,
+                            help="Segundos de espera cuando la cola está vacía.")
+        parser.add_argument("--una-vez", action="store_true",
+                            help="Vacía la cola y termina (útil en cron/tests).")
+
+    def handle(self, *args, **opts):
+        n = max(1, opts["procesos"])
+        if n == 1:
+            return self._loop(opts)
+
+        # cada proceso abre su propia conexión a la BD
+        connections.close_all()
+        procs = [multiprocessing.Process(target=self._loop, args=(opts,)) for _ in range(n)]
+        for p in procs:
+            p.start()
+        try:
+            for p in procs:
+                p.join()
+        except KeyboardInterrupt:
+            for p in procs:
+                p.terminate()
+
+    def _loop(self, opts):
+        self._parar = False
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "_parar", True))
+        wid = worker_id()
+        self.stdout.write(f"Worker {wid} iniciado.")
+        while not self._parar:
+            n = procesar_lote(opts["lote"], wid)
+            if n:
+                continue
+            despachador.cerrar()  # cola vacía: no mantener el SMTP ocioso
+            if opts["una_vez"]:
+                break
+            time.sleep(opts["intervalo"])
+        despachador.cerrar()
+        connections.close_all()
@@ -0,0 +1,47 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_alter_passwordresettoken_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tarea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100)),
+                ('payload', models.JSONField(default=dict)),
+                ('estado', models.CharField(choices=[('pendiente', 'pendiente'), ('en_curso', 'en_curso')], default='pendiente', max_length=12)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('max_intentos', models.PositiveSmallIntegerField(default=5)),
+                ('ejecutar_en', models.DateTimeField(default=django.utils.timezone.now)),
+                ('tomada_en', models.DateTimeField(blank=True, null=True)),
+                ('tomada_por', models.CharField(blank=True, default='', max_length=64)),
+                ('ultimo_error', models.TextField(blank=True, default='')),
+                ('creada_en', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'tarea',
+                'indexes': [models.Index(fields=['estado', 'ejecutar_en'], name='ix_tarea_estado_ejecutar')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TareaFallida',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100)),
+                ('payload', models.JSONField(default=dict)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('ultimo_error', models.TextField(blank=True, default='')),
+                ('creada_en', models.DateTimeField()),
+                ('fallida_en', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'tarea_fallida',
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Tabla no administrada por Django: columnas e índices con SQL directo (MySQL).
+# Las notificaciones no leídas del mismo (usuario, tipo, referencia) se agrupan
+# en una sola fila (cantidad += n): `grupo_abierto` es NULL una vez leída, así
+# el índice único solo aplica a las no leídas y el próximo evento abre otra.
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_tarea_tareafallida'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """
+                ALTER TABLE notificacion
+                    ADD COLUMN tipo VARCHAR(30) NULL,
+                    ADD COLUMN referencia INT NULL,
+                    ADD COLUMN cantidad INT NOT NULL DEFAULT 1,
+                    ADD COLUMN grupo_abierto VARCHAR(45) AS (
+                        IF(leido = 0 AND tipo IS NOT NULL,
+                           CONCAT(tipo, ':', IFNULL(referencia, 0)), NULL)
+                    ) STORED
+                """,
+                "UPDATE notificacion SET fecha_envio = NOW() WHERE fecha_envio IS NULL",
+                "CREATE UNIQUE INDEX ux_notificacion_grupo ON notificacion (id_usuario, grupo_abierto)",
+                # feed: WHERE id_usuario = ? ORDER BY fecha_envio DESC, id_notificacion DESC
+                "CREATE INDEX ix_notificacion_feed ON notificacion (id_usuario, fecha_envio, id_notificacion)",
+            ],
+            reverse_sql=[
+                "DROP INDEX ix_notificacion_feed ON notificacion",
+                "DROP INDEX ux_notificacion_grupo ON notificacion",
+                """
+                ALTER TABLE notificacion
+                    DROP COLUMN grupo_abierto,
+                    DROP COLUMN cantidad,
+                    DROP COLUMN referencia,
+                    DROP COLUMN tipo
+                """,
+            ],
+        ),
+    ]
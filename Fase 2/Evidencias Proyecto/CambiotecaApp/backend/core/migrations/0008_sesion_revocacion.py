@@ -0,0 +1,32 @@
+# Tabla no administrada por Django: columna e índices con SQL directo (MySQL).
+# `sesion.token` guarda el jti del JWT (no el token completo).
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_notificacion_eventos'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE sesion ADD COLUMN revocada_en DATETIME(6) NULL",
+                "CREATE UNIQUE INDEX ux_sesion_token ON sesion (token)",
+                # refresco incremental de revocadas: WHERE revocada_en >= ?
+                "CREATE INDEX ix_sesion_revocada ON sesion (revocada_en)",
+                # revocar todas las de un usuario / limpieza de expiradas
+                "CREATE INDEX ix_sesion_usuario_exp ON sesion (id_usuario, fecha_expiracion)",
+                "CREATE INDEX ix_sesion_expiracion ON sesion (fecha_expiracion)",
+            ],
+            reverse_sql=[
+                "DROP INDEX ix_sesion_expiracion ON sesion",
+                "DROP INDEX ix_sesion_usuario_exp ON sesion",
+                "DROP INDEX ix_sesion_revocada ON sesion",
+                "DROP INDEX ux_sesion_token ON sesion",
+                "ALTER TABLE sesion DROP COLUMN revocada_en",
+            ],
+        ),
+    ]
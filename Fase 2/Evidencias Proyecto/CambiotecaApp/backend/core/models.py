@@ -83,6 +83,10 @@ class Usuario(models.Model):
     activo = models.BooleanField(default=False)
     verificado = models.BooleanField(default=False)
 
+    # request.user de DRF (core.authentication.UsuarioJWTAuthentication)
+    is_authenticated = True
+    is_anonymous = False
+
     class Meta:
         db_table = 'usuario'
         managed = False
@@ -97,6 +101,11 @@ class Notificacion(models.Model):
     leido = models.BooleanField(default=False)
     # En el dump puede venir NULL
     fecha_envio = models.DateTimeField(null=True, blank=True)
+    # evento que la originó (core/notificaciones.py); las no leídas del mismo
+    # tipo + referencia se agrupan en una fila con `cantidad`
+    tipo = models.CharField(max_length=30, null=True, blank=True)
+    referencia = models.IntegerField(null=True, blank=True)
+    cantidad = models.IntegerField(default=1)
 
     id_usuario = models.ForeignKey(
         'core.Usuario',
@@ -138,10 +147,11 @@ class SeguimientoActividad(models.Model):
 
 class Sesion(models.Model):
     id_sesion = models.AutoField(primary_key=True)
-    token = models.CharField(max_length=255)
+    token = models.CharField(max_length=255)  # jti del JWT (core/sesiones.py)
     fecha_inicio = models.DateTimeField()
     fecha_expiracion = models.DateTimeField()
     dispositivo = models.CharField(max_length=50)
+    revocada_en = models.DateTimeField(null=True, blank=True)
 
     id_usuario = models.ForeignKey(
         'core.Usuario',
@@ -176,4 +186,48 @@ class VerificacionUsuario(models.Model):
         managed = False
 
     def __str__(self):
-        return f"Verificación #{self.id_verificacion} de Usuario {self.id_usuario_id}"
\ No newline at end of file
+        return f"Verificación #{self.id_verificacion} de Usuario {self.id_usuario_id}"
+
+# =========================
+# Cola de tareas en BD (ver core/cola.py)
+# =========================
+class Tarea(models.Model):
+    PENDIENTE = 'pendiente'
+    EN_CURSO = 'en_curso'
+
+    nombre = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    estado = models.CharField(
+        max_length=12, default=PENDIENTE,
+        choices=[(PENDIENTE, PENDIENTE), (EN_CURSO, EN_CURSO)],
+    )
+    intentos = models.PositiveSmallIntegerField(default=0)
+    max_intentos = models.PositiveSmallIntegerField(default=5)
+    ejecutar_en = models.DateTimeField(default=timezone.now)
+    tomada_en = models.DateTimeField(null=True, blank=True)
+    tomada_por = models.CharField(max_length=64, blank=True, default='')
+    ultimo_error = models.TextField(blank=True, default='')
+    creada_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'tarea'
+        indexes = [models.Index(fields=['estado', 'ejecutar_en'], name='ix_tarea_estado_ejecutar')]
+
+    def __str__(self):
+        return f"Tarea #{self.pk} {self.nombre} ({self.estado}, intento {self.intentos})"
+
+
+class TareaFallida(models.Model):
+    # "dead letter": tareas que agotaron sus reintentos
+    nombre = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    ultimo_error = models.TextField(blank=True, default='')
+    creada_en = models.DateTimeField()
+    fallida_en = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'tarea_fallida'
+
+    def __str__(self):
+        return f"Fallida #{self.pk} {self.nombre}"
@@ -0,0 +1,190 @@
+# core/notificaciones.py
+"""
+Notificaciones in-app (tabla `notificacion`) a partir de eventos de dominio:
+solicitud nueva / aceptada / rechazada, mensaje de chat, código generado e
+intercambio completado. La app las lee de un solo feed
+(`GET users/<id>/notificaciones/`) en vez de consultar cada endpoint.
+
+- Las vistas llaman `notificar(...)` dentro de su transacción: los eventos
+  de esa llamada viajan juntos como una tarea de la cola (core.notificar), o
+  sea un INSERT en `tarea` por llamada en vez de leer y escribir `notificacion`
+  en el request; si hay rollback, no se notifica nada.
+- El worker recibe las tareas en lote y escribe todo junto: agrupa por
+  (usuario, tipo, referencia), suma a las no leídas que ya existen con un solo
+  UPDATE (bulk_update) e inserta las demás con un solo INSERT (bulk_create).
+  10 mensajes en una conversación = una notificación "10 mensajes nuevos".
+  Si otro worker abre el mismo grupo entre la lectura y el INSERT, el índice
+  único lo rechaza y se vuelve a leer: ese grupo pasa a sumarse a la fila del
+  otro (bloqueada), sin perder el conteo.
+- Una vez leída, la fila deja de agrupar (índice único sobre `grupo_abierto`,
+  migración core 0007) y el siguiente evento abre otra.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from market.models import Libro
+
+from .models import Notificacion
+
+# tipo -> (texto para 1, texto para n)
+TIPOS = {
+    "solicitud_nueva": ("Recibiste una solicitud por «{titulo}».",
+                        "Recibiste {n} solicitudes por «{titulo}»."),
+    "solicitud_aceptada": ("Aceptaron tu solicitud por «{titulo}». Ya puedes coordinar por el chat.",) * 2,
+    "solicitud_rechazada": ("Tu solicitud por «{titulo}» fue rechazada.",) * 2,
+    "mensaje": ("Tienes un mensaje nuevo.", "Tienes {n} mensajes nuevos."),
+    "codigo": ("Ya está el código para completar tu intercambio por «{titulo}».",) * 2,
+    "intercambio_completado": ("Se completó tu intercambio por «{titulo}».",) * 2,
+}
+TITULO_DEFAULT = "tu libro"
+FEED_LIMIT_DEFAULT = 20
+FEED_LIMIT_MAX = 100
+LEER_LOTE_MAX = 200   # ids por POST .../notificaciones/leer/
+GUARDAR_INTENTOS = 3  # carreras por el mismo grupo antes de dejar que la cola reintente
+
+
+def evento(usuario_id, tipo: str, referencia=None, libro_id=None, n: int = 1) -> dict:
+    """
+    referencia: id al que lleva la notificación (libro, solicitud, conversación,
+    intercambio); libro_id: para el título en el texto; n: eventos iguales juntos.
+    """
+    ev = {"u": int(usuario_id), "tipo": tipo, "ref": referencia, "libro": libro_id}
+    if n != 1:
+        ev["n"] = n
+    return ev
+
+
+def notificar(eventos) -> None:
+    """Encola los eventos (llamar dentro de la transacción de la vista)."""
+    from .tareas import notificar as tarea_notificar
+
+    eventos = [e for e in eventos if e and e["tipo"] in TIPOS]
+    if eventos:
+        tarea_notificar.encolar(eventos=eventos)
+
+
+def _mensaje(tipo: str, n: int, titulo) -> str:
+    uno, varios = TIPOS[tipo]
+    return (uno if n == 1 else varios).format(n=n, titulo=titulo or TITULO_DEFAULT)
+
+
+def _abiertas(grupos) -> dict:
+    """No leídas de esos grupos, bloqueadas: (usuario, tipo, referencia) -> Notificacion."""
+    return {
+        (n.id_usuario_id, n.tipo, n.referencia): n
+        for n in (Notificacion.objects
+                  .select_for_update()
+                  .filter(leido=False,
+                          id_usuario_id__in={u for u, _, _ in grupos},
+                          tipo__in={t for _, t, _ in grupos}))
+    }
+
+
+def _agrupar(grupos, abiertas, titulos, ahora):
+    """-> (existentes a actualizar, nuevas a insertar), con cantidad y texto ya sumados."""
+    actualizar, nuevas = [], []
+    for clave, (n_eventos, libro_id) in grupos.items():
+        n = abiertas.get(clave)
+        if n is None:
+            n = Notificacion(id_usuario_id=clave[0], tipo=clave[1], referencia=clave[2],
+                             cantidad=0, leido=False)
+            nuevas.append(n)
+        else:
+            actualizar.append(n)
+        n.cantidad += n_eventos
+        n.mensaje = _mensaje(clave[1], n.cantidad, titulos.get(libro_id))
+        n.fecha_envio = ahora
+    return actualizar, nuevas
+
+
+def guardar(eventos) -> int:
+    """Escribe un lote de eventos agrupados. Devuelve cuántas notificaciones tocó."""
+    grupos = {}  # (usuario, tipo, referencia) -> [n eventos, libro]
+    for ev in eventos:
+        if ev.get("tipo") not in TIPOS:
+            continue
+        g = grupos.setdefault((int(ev["u"]), ev["tipo"], ev.get("ref")), [0, None])
+        g[0] += int(ev.get("n", 1))
+        g[1] = ev.get("libro") or g[1]
+    if not grupos:
+        return 0
+
+    libros = {lid for _, lid in grupos.values() if lid}
+    titulos = dict(Libro.todos.filter(pk__in=libros).values_list("pk", "titulo")) if libros else {}
+    ahora = timezone.now()
+
+    with transaction.atomic():
+        for intento in range(GUARDAR_INTENTOS):
+            actualizar, nuevas = _agrupar(grupos, _abiertas(grupos), titulos, ahora)
+            if not nuevas:
+                break
+            try:
+                with transaction.atomic():
+                    Notificacion.objects.bulk_create(nuevas)
+                break
+            except IntegrityError:
+                # otro worker abrió alguno de estos grupos (ux_notificacion_grupo):
+                # al releer ya existe y se le suma; al final, reintenta la cola
+                if intento == GUARDAR_INTENTOS - 1:
+                    raise
+        if actualizar:
+            Notificacion.objects.bulk_update(actualizar, ["cantidad", "mensaje", "fecha_envio"])
+    return len(actualizar) + len(nuevas)
+
+
+# =========================
+# Lectura
+# =========================
+CAMPOS = ("id_notificacion", "tipo", "referencia", "cantidad", "mensaje", "leido", "fecha_envio")
+_EPOCA = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _cursor(fila: dict) -> str:
+    """'<microsegundos desde 1970>_<id>': opaco y sin caracteres a escapar en la URL."""
+    us = (fila["fecha_envio"] - _EPOCA) // timedelta(microseconds=1)
+    return f"{us}_{fila['id_notificacion']}"
+
+
+def leer_cursor(raw):
+    """-> (datetime, id); ValueError si no es válido."""
+    us, _, pk = str(raw).partition("_")
+    pk = int(pk)
+    if not 0 <= pk < 2 ** 63:
+        raise ValueError(f"cursor fuera de rango: {raw}")
+    try:
+        return _EPOCA + timedelta(microseconds=int(us)), pk
+    except OverflowError:  # fuera del rango de datetime
+        raise ValueError(f"cursor fuera de rango: {raw}") from None
+
+
+def feed(usuario_id: int, cursor=None, limite: int = FEED_LIMIT_DEFAULT, solo_no_leidas=False) -> dict:
+    """
+    Más recientes primero (fecha_envio, id); `siguiente` se pasa como ?cursor=
+    para la página anterior. Una notificación agrupada que recibe eventos nuevos
+    sube al comienzo: el cliente la reemplaza por id.
+    """
+    qs = Notificacion.objects.filter(id_usuario_id=usuario_id, fecha_envio__isnull=False)
+    if solo_no_leidas:
+        qs = qs.filter(leido=False)
+    if cursor is not None:
+        fecha, pk = cursor
+        qs = qs.filter(fecha_envio__lte=fecha).exclude(fecha_envio=fecha, id_notificacion__gte=pk)
+
+    filas = list(qs.order_by("-fecha_envio", "-id_notificacion").values(*CAMPOS)[:limite + 1])
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    return {
+        "results": filas,
+        "siguiente": _cursor(filas[-1]) if hay_mas else None,
+        "no_leidas": Notificacion.objects.filter(id_usuario_id=usuario_id, leido=False).count(),
+    }
+
+
+def marcar_leidas(usuario_id: int, ids=None) -> int:
+    """ids=None -> todas las del usuario."""
+    qs = Notificacion.objects.filter(id_usuario_id=usuario_id, leido=False)
+    if ids is not None:
+        qs = qs.filter(pk__in=ids)
+    return qs.update(leido=True)
@@ -0,0 +1,45 @@
+# core/passwords.py
+"""
+Verificación de contraseñas de Usuario (login, cambio de contraseña).
+
+- Usa el hasher preferido de settings.PASSWORD_HASHERS.
+- Si el hash guardado está desactualizado (otro algoritmo u otro costo) o la
+  fila aún tiene la contraseña en texto plano, se re-hashea al validar.
+- El texto plano solo se acepta si lo guardado NO es un hash reconocible
+  (antes bastaba con enviar el hash mismo como contraseña).
+"""
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from django.utils.crypto import constant_time_compare
+
+from .models import Usuario
+
+
+def es_hash(valor: str) -> bool:
+    try:
+        identify_hasher(valor)
+        return True
+    except ValueError:
+        return False
+
+
+def guardar_contrasena(user: Usuario, raw: str) -> None:
+    user.contrasena = make_password(raw)
+    Usuario.objects.filter(pk=user.pk).update(contrasena=user.contrasena)
+
+
+def verificar_contrasena(user: Usuario, raw: str) -> bool:
+    guardada = user.contrasena or ""
+    if not raw or not guardada:
+        return False
+
+    if es_hash(guardada):
+        try:
+            return check_password(raw, guardada, setter=lambda r: guardar_contrasena(user, r))
+        except Exception:
+            return False  # hasher no disponible (p.ej. falta argon2-cffi)
+
+    # fila legada en texto plano: se valida y se migra a hash en el acto
+    if constant_time_compare(guardada, raw):
+        guardar_contrasena(user, raw)
+        return True
+    return False
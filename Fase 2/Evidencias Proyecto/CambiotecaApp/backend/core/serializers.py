@@ -1,11 +1,12 @@
 # core/serializers.py
-from django.contrib.auth.hashers import check_password, make_password
+from django.contrib.auth.hashers import make_password
 from .models import Usuario, PasswordResetToken
 from django.db.models import Q
 from django.utils import timezone
 from rest_framework import serializers
 
 from .models import Usuario, Region, Comuna, PasswordResetToken
+from .passwords import verificar_contrasena
 
 
 class UsuarioLiteSerializer(serializers.ModelSerializer):
@@ -44,15 +45,7 @@ class LoginSerializer(serializers.Serializer):
         if not user:
             raise serializers.ValidationError("Usuario no encontrado.")
 
-        ok = False
-        try:
-            ok = check_password(password, user.contrasena)  # por si está hasheada
-        except Exception:
-            ok = False
-        if not ok and user.contrasena == password:          # o en texto plano
-            ok = True
-
-        if not ok:
+        if not verificar_contrasena(user, password):  # hash o texto plano legado
             raise serializers.ValidationError("Credenciales inválidas.")
 
         if not user.activo:
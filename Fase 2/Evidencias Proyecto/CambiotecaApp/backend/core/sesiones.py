@@ -0,0 +1,146 @@
+# core/sesiones.py
+"""
+Registro de sesiones (tabla `sesion`) para poder revocar JWT antes de sus 24 h.
+
+- Cada login crea una fila con el `jti` del token (columna `token`), el
+  dispositivo y la expiración. Cambiar o restablecer la contraseña (y el
+  logout) marcan `revocada_en`.
+- Verificar un token no consulta la BD: cada proceso tiene en memoria el
+  conjunto de jti revocados que aún no expiran (mientras no expiren son
+  pocos: solo las revocaciones de las últimas 24 h). Cada SESIONES_REFRESCO
+  segundos un hilo de fondo trae solo lo revocado desde la última vez (índice
+  en revocada_en), con un margen por transacciones que confirman tarde; el
+  request que lo dispara responde con el conjunto actual. Solo la primera
+  carga del proceso es en el request: sin ella no se sabe qué rechazar.
+  Una revocación hecha en este proceso se aplica al tiro; en los demás, a
+  más tardar en SESIONES_REFRESCO segundos (más lo que tarde el refresco).
+- Las filas expiradas se borran con `python manage.py limpiar_sesiones`.
+"""
+import datetime
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import Sesion
+
+logger = logging.getLogger(__name__)
+
+MARGEN = datetime.timedelta(seconds=30)  # revocaciones que confirman tarde
+
+_revocadas = {}            # jti -> expiración (datetime)
+_leido_hasta = None        # revocada_en más reciente ya considerado
+_refrescado_en = None      # time.monotonic()
+_lock = threading.Lock()
+_refrescando = threading.Lock()
+
+
+def _refresco() -> float:
+    return getattr(settings, "SESIONES_REFRESCO", 5)
+
+
+def abrir(user_id: int, expira: datetime.datetime, dispositivo: str = "") -> str:
+    """Registra la sesión de un token nuevo y devuelve su jti."""
+    jti = uuid.uuid4().hex
+    Sesion.objects.create(
+        token=jti, id_usuario_id=user_id, fecha_inicio=timezone.now(),
+        fecha_expiracion=expira, dispositivo=(dispositivo or "")[:50],
+    )
+    return jti
+
+
+# =========================
+# Revocación
+# =========================
+def _marcar(qs) -> int:
+    ahora = timezone.now()
+    filas = list(qs.filter(revocada_en__isnull=True, fecha_expiracion__gt=ahora)
+                   .values_list("id_sesion", "token", "fecha_expiracion"))
+    if not filas:
+        return 0
+    Sesion.objects.filter(pk__in=[pk for pk, _, _ in filas]).update(revocada_en=ahora)
+    with _lock:
+        _revocadas.update({jti: exp for _, jti, exp in filas})
+    return len(filas)
+
+
+def revocar(jti: str) -> int:
+    return _marcar(Sesion.objects.filter(token=jti)) if jti else 0
+
+
+def revocar_usuario(user_id: int, excepto: str | None = None) -> int:
+    """Todas las sesiones vigentes del usuario (menos `excepto`, la actual)."""
+    from .authentication import invalidar_usuario
+
+    qs = Sesion.objects.filter(id_usuario_id=user_id)
+    if excepto:
+        qs = qs.exclude(token=excepto)
+    invalidar_usuario(user_id)
+    return _marcar(qs)
+
+
+# =========================
+# Conjunto de revocadas (por proceso)
+# =========================
+def _refrescar() -> None:
+    global _leido_hasta, _refrescado_en
+    ahora = timezone.now()
+    qs = Sesion.objects.filter(revocada_en__isnull=False, fecha_expiracion__gt=ahora)
+    if _leido_hasta is not None:
+        qs = qs.filter(revocada_en__gte=_leido_hasta - MARGEN)
+    nuevas = list(qs.values_list("token", "fecha_expiracion", "revocada_en"))
+
+    with _lock:
+        for jti, exp, _ in nuevas:
+            _revocadas[jti] = exp
+        for jti in [j for j, exp in _revocadas.items() if exp <= ahora]:
+            del _revocadas[jti]  # el JWT ya expiró solo: no hace falta recordarlo
+        if nuevas:
+            ultima = max(r for _, _, r in nuevas)
+            _leido_hasta = max(_leido_hasta, ultima) if _leido_hasta else ultima
+        elif _leido_hasta is None:
+            _leido_hasta = ahora
+        _refrescado_en = time.monotonic()
+
+
+def _refrescar_fondo():
+    try:
+        _refrescar()
+    except Exception:
+        logger.exception("No se pudieron refrescar las sesiones revocadas")
+    finally:
+        connection.close()
+        _refrescando.release()
+
+
+def _lanzar_refresco() -> None:
+    if _refrescando.acquire(blocking=False):  # uno a la vez por proceso
+        threading.Thread(target=_refrescar_fondo, daemon=True).start()
+
+
+def revocada(jti) -> bool:
+    if not jti:
+        return False  # tokens emitidos antes del registro: valen hasta expirar
+    if _refrescado_en is None:
+        with _refrescando:  # primera carga: los demás hilos la esperan
+            if _refrescado_en is None:
+                _refrescar()
+    elif time.monotonic() - _refrescado_en > _refresco():
+        _lanzar_refresco()
+    return jti in _revocadas
+
+
+def limpiar_expiradas(lote: int = 1000, hasta=None) -> int:
+    """Borra sesiones expiradas en lotes chicos. Devuelve cuántas borró."""
+    hasta = hasta or timezone.now()
+    total = 0
+    while True:
+        ids = list(Sesion.objects.filter(fecha_expiracion__lte=hasta)
+                   .order_by("fecha_expiracion").values_list("pk", flat=True)[:lote])
+        if not ids:
+            return total
+        total += Sesion.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,19 @@
+# core/tareas.py
+from .cola import tarea
+from . import notificaciones
+from .emails import correo_reset, despachador
+
+
+@tarea("core.enviar_correo_reset", max_intentos=6, lote=True)
+def enviar_correo_reset(payloads: list) -> list:
+    # sin acceso a la BD: cada payload trae email, nombres y reset_link.
+    # Todo el lote sale por la misma conexión SMTP.
+    return despachador.enviar([correo_reset(**p) for p in payloads])
+
+
+@tarea("core.notificar", max_intentos=8, lote=True)
+def notificar(payloads: list) -> list:
+    # los eventos de todo el lote se agrupan y se escriben juntos (una
+    # transacción); si falla, el lote completo se reintenta sin duplicar.
+    notificaciones.guardar([ev for p in payloads for ev in p.get("eventos", ())])
+    return [None] * len(payloads)
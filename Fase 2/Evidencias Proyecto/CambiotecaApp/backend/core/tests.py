@@ -1,3 +1,584 @@
-from django.test import TestCase
+import smtplib
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2SHA1PasswordHasher, identify_hasher
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import actividad, authentication, cola, notificaciones, sesiones, throttles
+from .authentication import emitir_token
+from .emails import Despachador, despachador
+from .hashers import PBKDF2Hasher
+from .models import (
+    Comuna, Notificacion, Region, SeguimientoActividad, Sesion, Tarea, TareaFallida, Usuario,
+)
+from .passwords import verificar_contrasena
+from .tareas import enviar_correo_reset
+
+from market.models import Genero, Libro
+
+
+@cola.tarea("tests.falla", max_intentos=2)
+def _tarea_que_falla(**payload):
+    raise RuntimeError("falla a propósito")
+
+
+@override_settings(EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend", TAREAS_EAGER=False)
+class ColaCorreoTests(TestCase):
+    def setUp(self):
+        despachador.cerrar()  # que tome el backend locmem
+        self.addCleanup(despachador.cerrar)
+
+    def _encolar_reset(self, email="ana@example.com"):
+        return enviar_correo_reset.encolar(
+            email=email, nombres="Ana", reset_link="https://cambioteca.cl/reset?token=abc",
+        )
+
+    def _vencer(self):
+        # simula que pasó el backoff
+        Tarea.objects.update(ejecutar_en=timezone.now() - timedelta(seconds=1))
+
+    def test_worker_envia_correo_encolado(self):
+        self._encolar_reset()
+        self._encolar_reset("beto@example.com")
+        self.assertEqual(len(mail.outbox), 0)  # encolar no envía
+
+        # el worker cierra sus conexiones al terminar; el TestCase necesita la suya
+        with mock.patch.object(connections, "close_all"):
+            call_command("procesar_tareas", "--una-vez", stdout=StringIO())
+
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ["ana@example.com", "beto@example.com"])
+        self.assertIn("https://cambioteca.cl/reset?token=abc", mail.outbox[0].body)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], "text/html")
+        self.assertFalse(Tarea.objects.exists())
+
+    def test_fallo_de_envio_se_reintenta_con_backoff(self):
+        t = self._encolar_reset()
+        antes = timezone.now()
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages",
+                        side_effect=ConnectionError("smtp caído")):
+            self.assertEqual(cola.procesar_lote(), 1)
+
+        t.refresh_from_db()
+        self.assertEqual(t.intentos, 1)
+        self.assertEqual(t.estado, Tarea.PENDIENTE)
+        self.assertIn("smtp caído", t.ultimo_error)
+        self.assertGreaterEqual(t.ejecutar_en, antes + timedelta(seconds=cola.BACKOFF_BASE))
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(cola.procesar_lote(), 0)  # aún no vence el backoff
+        self._vencer()
+        self.assertEqual(cola.procesar_lote(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(Tarea.objects.exists())
+
+    def test_backoff_crece_exponencial_con_tope(self):
+        for intentos, base in ((1, 30), (2, 60), (3, 120)):
+            segundos = cola._backoff(intentos).total_seconds()
+            self.assertTrue(base <= segundos <= base * 1.25, (intentos, segundos))
+        self.assertLessEqual(cola._backoff(50).total_seconds(), cola.BACKOFF_MAX * 1.25)
+
+    def test_solo_se_reintenta_el_payload_que_fallo(self):
+        self._encolar_reset("ok@example.com")
+        self._encolar_reset("malo@example.com")
+        envio_real = despachador._enviar_uno
+
+        def enviar_uno(msg):
+            if msg.to == ["malo@example.com"]:
+                return ValueError("destinatario rechazado")
+            return envio_real(msg)
+
+        with mock.patch.object(despachador, "_enviar_uno", side_effect=enviar_uno):
+            cola.procesar_lote()
+
+        self.assertEqual([m.to for m in mail.outbox], [["ok@example.com"]])
+        pendiente = Tarea.objects.get()
+        self.assertEqual(pendiente.payload["email"], "malo@example.com")
+        self.assertEqual(pendiente.intentos, 1)
+
+    def test_agotar_intentos_pasa_a_tarea_fallida(self):
+        _tarea_que_falla.encolar(x=1)
+
+        cola.procesar_lote()
+        self.assertEqual(Tarea.objects.get().intentos, 1)
+        self.assertFalse(TareaFallida.objects.exists())
+
+        self._vencer()
+        cola.procesar_lote()
+        self.assertFalse(Tarea.objects.exists())
+        fallida = TareaFallida.objects.get()
+        self.assertEqual(fallida.nombre, "tests.falla")
+        self.assertEqual(fallida.payload, {"x": 1})
+        self.assertEqual(fallida.intentos, 2)
+        self.assertIn("falla a propósito", fallida.ultimo_error)
+
+    def test_tarea_no_registrada_no_bloquea_la_cola(self):
+        cola.encolar("tests.no_existe", {}, max_intentos=1)
+        self._encolar_reset()
+        cola.procesar_lote()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(TareaFallida.objects.get().nombre, "tests.no_existe")
+
+
+class DespachadorTests(TestCase):
+    def setUp(self):
+        self.d = Despachador(inactividad=60)
+        self.conexiones = []
+
+        def nueva(**kw):
+            self.conexiones.append(mock.Mock(name=f"smtp{len(self.conexiones)}"))
+            return self.conexiones[-1]
+
+        p = mock.patch("core.emails.get_connection", side_effect=nueva)
+        p.start()
+        self.addCleanup(p.stop)
+
+    def _msg(self, *efectos):
+        msg = mock.Mock()
+        msg.send.side_effect = list(efectos) or None
+        return msg
+
+    def test_una_conexion_para_varios_envios(self):
+        self.assertEqual(self.d.enviar([self._msg(), self._msg()]), [None, None])
+        self.assertEqual(self.d.enviar([self._msg()]), [None])
+        self.assertEqual(len(self.conexiones), 1)
+        self.conexiones[0].open.assert_called_once_with()
+        self.conexiones[0].close.assert_not_called()
+
+    def test_desconexion_reabre_y_reintenta(self):
+        msg = self._msg(smtplib.SMTPServerDisconnected("cortó"), None)
+        with self.assertLogs("core.emails", "WARNING"):
+            self.assertEqual(self.d.enviar([msg, self._msg()]), [None, None])
+        self.assertEqual(msg.send.call_count, 2)
+        self.assertEqual(len(self.conexiones), 2)
+        self.conexiones[0].close.assert_called_once_with()
+        self.assertIsNone(msg.connection)
+
+    def test_dos_desconexiones_devuelven_el_error_y_la_siguiente_reabre(self):
+        error = ConnectionError("red caída")
+        with self.assertLogs("core.emails", "WARNING") as logs:
+            self.assertEqual(self.d.enviar([self._msg(error, error)]), [error])
+        self.assertEqual(len(logs.records), 2)
+        self.assertIsNone(self.d._conn)
+        self.assertEqual(self.d.enviar([self._msg()]), [None])
+        self.assertEqual(len(self.conexiones), 3)
+
+    def test_destinatario_rechazado_no_cierra_la_conexion(self):
+        rechazo = smtplib.SMTPRecipientsRefused({"x@example.com": (550, b"no")})
+        self.assertEqual(self.d.enviar([self._msg(rechazo), self._msg()]), [rechazo, None])
+        self.assertEqual(len(self.conexiones), 1)
+        self.conexiones[0].close.assert_not_called()
+
+    def test_inactividad_cierra_y_reabre(self):
+        with mock.patch("core.emails.time.monotonic", return_value=1000.0):
+            self.d.enviar([self._msg()])
+        with mock.patch("core.emails.time.monotonic", return_value=1000.0 + 61):
+            self.d.enviar([self._msg()])
+        self.assertEqual(len(self.conexiones), 2)
+        self.conexiones[0].close.assert_called_once_with()
+
+
+def crear_usuario(n: int = 1, **campos) -> Usuario:
+    comuna = Comuna.objects.first() or Comuna.objects.create(
+        nombre="Santiago", id_region=Region.objects.create(nombre="RM"))
+    datos = dict(
+        rut=f"{n}-K", nombres="Ana", apellido_paterno="Pérez", apellido_materno="Soto",
+        nombre_usuario=f"ana{n}", email=f"ana{n}@example.com", telefono="", direccion="",
+        numeracion="", comuna=comuna, contrasena="", fecha_registro=timezone.localdate(),
+        activo=True, verificado=True,
+    )
+    datos.update(campos)
+    return Usuario.objects.create(**datos)
+
+
+# costo bajo para que los tests no tarden; el re-hash se detecta igual
+@override_settings(
+    PASSWORD_HASHERS=["core.hashers.PBKDF2Hasher", "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher"],
+    PASSWORD_PBKDF2_ITERATIONS=1000,
+)
+class VerificarContrasenaTests(TestCase):
+    PWD = "Cambioteca-123"
+
+    def _guardada(self, user):
+        return Usuario.objects.values_list("contrasena", flat=True).get(pk=user.pk)
+
+    def _assert_hash_actual(self, encoded):
+        hasher = identify_hasher(encoded)
+        self.assertEqual(hasher.algorithm, "pbkdf2_sha256")
+        self.assertFalse(hasher.must_update(encoded))
+
+    def test_texto_plano_se_migra_a_hash(self):
+        user = crear_usuario(contrasena=self.PWD)
+
+        self.assertTrue(verificar_contrasena(user, self.PWD))
+        guardada = self._guardada(user)
+        self.assertNotEqual(guardada, self.PWD)
+        self._assert_hash_actual(guardada)
+        # la contraseña de siempre sigue entrando, ahora contra el hash
+        self.assertTrue(verificar_contrasena(Usuario.objects.get(pk=user.pk), self.PWD))
+
+    def test_otro_algoritmo_se_rehashea(self):
+        viejo = PBKDF2SHA1PasswordHasher().encode(self.PWD, "salobre12345", iterations=1000)
+        user = crear_usuario(contrasena=viejo)
+
+        self.assertTrue(verificar_contrasena(user, self.PWD))
+        self._assert_hash_actual(self._guardada(user))
+        self.assertTrue(verificar_contrasena(Usuario.objects.get(pk=user.pk), self.PWD))
+
+    def test_costo_menor_se_rehashea(self):
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=500):
+            viejo = PBKDF2Hasher().encode(self.PWD, "salobre12345")
+        user = crear_usuario(contrasena=viejo)
+
+        self.assertTrue(verificar_contrasena(user, self.PWD))
+        guardada = self._guardada(user)
+        self.assertNotEqual(guardada, viejo)
+        self.assertIn("$1000$", guardada)
+        self.assertTrue(verificar_contrasena(Usuario.objects.get(pk=user.pk), self.PWD))
+
+    def test_contrasena_incorrecta_no_toca_el_hash(self):
+        viejo = PBKDF2SHA1PasswordHasher().encode(self.PWD, "salobre12345", iterations=1000)
+        legado = crear_usuario(1, contrasena=viejo)
+        plano = crear_usuario(2, contrasena=self.PWD)
+
+        self.assertFalse(verificar_contrasena(legado, "otra"))
+        self.assertFalse(verificar_contrasena(plano, "otra"))
+        self.assertEqual(self._guardada(legado), viejo)
+        self.assertEqual(self._guardada(plano), self.PWD)
+
+    def test_el_hash_no_sirve_como_contrasena(self):
+        user = crear_usuario(contrasena=PBKDF2Hasher().encode(self.PWD, "salobre12345"))
+        self.assertFalse(verificar_contrasena(user, user.contrasena))
+
+
+class ConsumirTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_workers_en_paralelo_no_superan_la_capacidad(self):
+        # cada hilo hace de un worker distinto: no comparten ningún lock de
+        # proceso, solo el caché (como varios gunicorn contra Redis)
+        hilos, resultados = 16, []
+        barrera = threading.Barrier(hilos)
+
+        def worker():
+            barrera.wait()
+            resultados.append(throttles.consumir("tb:test", 5, 60))
+
+        ts = [threading.Thread(target=worker) for _ in range(hilos)]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+        self.assertEqual(resultados.count(0.0), 5)
+        self.assertTrue(all(0 < r <= 60 for r in resultados if r))
+
+    def test_la_ventana_anterior_pesa_segun_lo_que_queda_de_ella(self):
+        with mock.patch("core.throttles.time.time", return_value=1000 * 60 + 59):
+            for _ in range(4):
+                self.assertEqual(throttles.consumir("tb:v", 4, 60), 0.0)
+            self.assertGreater(throttles.consumir("tb:v", 4, 60), 0)
+        # 15 s en la ventana siguiente: la anterior (4) aún pesa 4 * 0.75 = 3
+        with mock.patch("core.throttles.time.time", return_value=1001 * 60 + 15):
+            self.assertEqual(throttles.consumir("tb:v", 4, 60), 0.0)
+            espera = throttles.consumir("tb:v", 4, 60)
+        # el próximo cabe cuando el peso baja a 2: a los 30 s de la ventana
+        self.assertAlmostEqual(espera, 15, delta=0.1)
+
+
+@override_settings(THROTTLE_BUCKETS={"login_view": {"ip": "5/min", "cuenta": "3/min"}})
+class ThrottleLoginTests(TestCase):
+    URL = "/api/auth/login/"
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = Client()
+
+    def _login(self, email="atacada@example.com", ip="10.0.0.1", **extra):
+        return self.client.post(
+            self.URL, {"email": email, "contrasena": "clave-incorrecta"},
+            content_type="application/json", REMOTE_ADDR=ip, **extra,
+        )
+
+    def test_ataque_a_una_cuenta_se_corta_sin_tocar_bd_ni_hash(self):
+        crear_usuario(email="atacada@example.com", contrasena="otra-clave")
+        codigos = [self._login(ip=f"10.0.1.{i}").status_code for i in range(3)]
+        self.assertEqual(codigos, [401] * 3)
+
+        # rechazado en initial(): ni consulta a la BD ni verificación de contraseña
+        with mock.patch("core.views.verificar_contrasena") as verificar, self.assertNumQueries(0):
+            for i in range(50):
+                r = self._login(ip=f"10.0.2.{i}")
+                self.assertEqual(r.status_code, 429)
+        verificar.assert_not_called()
+        self.assertIn("Retry-After", r)
+
+    def test_cubeta_por_ip(self):
+        codigos = [self._login(email=f"u{i}@example.com").status_code for i in range(7)]
+        self.assertEqual(codigos, [401] * 5 + [429] * 2)
+        self.assertEqual(self._login(email="u9@example.com", ip="10.0.0.2").status_code, 401)
+
+    def test_x_forwarded_for_inventado_no_salta_la_cubeta_por_ip(self):
+        codigos = [
+            self._login(email=f"u{i}@example.com", HTTP_X_FORWARDED_FOR=f"203.0.113.{i}").status_code
+            for i in range(7)
+        ]
+        self.assertEqual(codigos, [401] * 5 + [429] * 2)
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "NUM_PROXIES": 1})
+    def test_detras_de_un_proxy_se_usa_el_salto_que_agrego(self):
+        # el proxy agrega la IP real al final; lo anterior lo escribió el cliente
+        def desde(ip_real, i):
+            return self._login(email=f"u{i}@example.com", ip="172.16.0.1",
+                               HTTP_X_FORWARDED_FOR=f"1.2.3.{i}, {ip_real}").status_code
+
+        self.assertEqual([desde("198.51.100.7", i) for i in range(6)], [401] * 5 + [429])
+        self.assertEqual(desde("198.51.100.8", 99), 401)
+
+
+class FeedNotificacionesTests(TestCase):
+    def setUp(self):
+        self.user = crear_usuario()
+        self.url = f"/api/users/{self.user.pk}/notificaciones/"
+
+    def test_eventos_iguales_se_agrupan(self):
+        ev = notificaciones.evento(self.user.pk, "mensaje", referencia=7)
+        notificaciones.guardar([ev] * 3)
+        notificaciones.guardar([ev])
+        n = Notificacion.objects.get()
+        self.assertEqual((n.cantidad, n.mensaje), (4, "Tienes 4 mensajes nuevos."))
+
+    def test_paginacion_por_cursor(self):
+        notificaciones.guardar([notificaciones.evento(self.user.pk, "mensaje", referencia=i)
+                                for i in range(5)])
+        vistos, cursor = [], None
+        while True:
+            r = self.client.get(self.url, {"limit": 2, **({"cursor": cursor} if cursor else {})})
+            self.assertEqual(r.status_code, 200)
+            vistos += [n["id_notificacion"] for n in r.data["results"]]
+            cursor = r.data["siguiente"]
+            if not cursor:
+                break
+        self.assertEqual(sorted(vistos), sorted(Notificacion.objects.values_list("pk", flat=True)))
+        self.assertEqual(len(vistos), 5)
+
+    def test_primer_evento_concurrente_no_pierde_el_conteo(self):
+        ev = notificaciones.evento(self.user.pk, "mensaje", referencia=7)
+        leer, lecturas = notificaciones._abiertas, []
+
+        def otro_worker_inserta_antes(grupos):
+            abiertas = leer(grupos)
+            lecturas.append(len(abiertas))
+            if len(lecturas) == 1:
+                # entre la lectura y el INSERT, otro worker abre el mismo grupo
+                Notificacion.objects.create(id_usuario=self.user, tipo="mensaje", referencia=7,
+                                            cantidad=2, mensaje="Tienes 2 mensajes nuevos.",
+                                            leido=False, fecha_envio=timezone.now())
+            return abiertas
+
+        with mock.patch.object(notificaciones, "_abiertas", side_effect=otro_worker_inserta_antes):
+            notificaciones.guardar([ev] * 3)
+        n = Notificacion.objects.get()
+        self.assertEqual((n.cantidad, n.mensaje), (5, "Tienes 5 mensajes nuevos."))
+        self.assertEqual(lecturas, [0, 1])
+
+    def test_leer_ids_acotado(self):
+        url = self.url + "leer/"
+        ids = list(range(notificaciones.LEER_LOTE_MAX + 1))
+        self.assertEqual(self.client.post(url, {"ids": ids}, content_type="application/json").status_code, 400)
+        notificaciones.guardar([notificaciones.evento(self.user.pk, "mensaje", referencia=1)])
+        pk = Notificacion.objects.get().pk
+        r = self.client.post(url, {"ids": [pk] * notificaciones.LEER_LOTE_MAX}, content_type="application/json")
+        self.assertEqual(r.data, {"marcadas": 1})
+
+    def test_cursor_invalido_es_400(self):
+        for cursor in ("x", "99999999999999999999_1", "-99999999999999999999_1",
+                       "1_99999999999999999999", "1_"):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(self.url, {"cursor": cursor}).status_code, 400)
+
+
+class SesionesTests(TransactionTestCase):
+    """TransactionTestCase: el refresco de fondo lee con su propia conexión."""
+
+    def setUp(self):
+        cache.clear()
+        self._reiniciar()
+        self.addCleanup(self._reiniciar)
+        self.user = crear_usuario()
+        self.token = emitir_token(self.user)
+        self.jti = Sesion.objects.get().token
+
+    def _reiniciar(self):
+        with sesiones._refrescando:  # que no quede un refresco en curso
+            sesiones._revocadas.clear()
+            sesiones._leido_hasta = sesiones._refrescado_en = None
+
+    def _get(self):
+        return self.client.get(f"/api/users/{self.user.pk}/notificaciones/",
+                               HTTP_AUTHORIZATION=f"Bearer {self.token}").status_code
+
+    def _esperar_refresco(self):
+        with sesiones._refrescando:
+            pass
+
+    def test_revocada_en_otro_proceso_es_401_dentro_del_refresco(self):
+        self.assertEqual(self._get(), 200)  # primera carga, en el request
+        Sesion.objects.filter(token=self.jti).update(revocada_en=timezone.now())  # otro worker
+        self.assertEqual(self._get(), 200)  # dentro de la ventana: conjunto en memoria
+
+        with mock.patch.object(sesiones.time, "monotonic",
+                               return_value=sesiones._refrescado_en + settings.SESIONES_REFRESCO + 1):
+            self._get()  # dispara el refresco de fondo y responde sin esperarlo
+        self._esperar_refresco()
+        self.assertEqual(self._get(), 401)
+
+    def test_revocar_en_este_proceso_es_inmediato(self):
+        self.assertEqual(self._get(), 200)
+        sesiones.revocar(self.jti)
+        self.assertEqual(self._get(), 401)
+
+    def test_limpiar_sesiones(self):
+        ahora = timezone.now()
+        for dias in (-3, -2, -1):
+            Sesion.objects.create(token=f"viejo{dias}", id_usuario=self.user, fecha_inicio=ahora,
+                                  fecha_expiracion=ahora + timedelta(days=dias), dispositivo="")
+        out = StringIO()
+        call_command("limpiar_sesiones", "--dry-run", stdout=out)
+        self.assertIn("3 sesiones expiradas", out.getvalue())
+        call_command("limpiar_sesiones", "--lote", "2", "--dias", "2", stdout=StringIO())
+        self.assertEqual(sorted(Sesion.objects.values_list("token", flat=True)),
+                         sorted([self.jti, "viejo-1"]))
+        call_command("limpiar_sesiones", stdout=StringIO())
+        self.assertEqual(list(Sesion.objects.values_list("token", flat=True)), [self.jti])
+
+
+class UsuarioIdTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        authentication._cache.clear()
+        self.user, self.otro = crear_usuario(1), crear_usuario(2)
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {emitir_token(self.user)}"}
+
+    def _visto(self, cuerpo, **headers):
+        return self.client.post("/api/chat/visto/", cuerpo, content_type="application/json", **headers)
+
+    def test_el_token_manda_sobre_el_body(self):
+        self.assertEqual(self._visto({"id_usuario": self.otro.pk}, **self.auth).status_code, 403)
+        self.assertEqual(self._visto({"id_usuario": self.user.pk}, **self.auth).status_code, 200)
+        self.assertEqual(self._visto({}, **self.auth).status_code, 200)  # sin id: el del token
+
+    def test_sin_token_se_usa_el_del_body(self):
+        # compatibilidad: apps que todavía no mandan token
+        self.assertEqual(self._visto({"id_usuario": self.otro.pk}).status_code, 200)
+        self.assertEqual(self._visto({}).status_code, 400)
+
+    def test_el_cache_vence_y_recarga_el_usuario(self):
+        ahora = time.monotonic()
+        self.assertEqual(authentication.usuario_cacheado(self.user.pk), self.user)
+        Usuario.objects.filter(pk=self.user.pk).update(activo=False)
+        self.assertEqual(authentication.usuario_cacheado(self.user.pk), self.user)  # dentro del TTL
+
+        with mock.patch.object(authentication.time, "monotonic",
+                               return_value=ahora + authentication.USUARIO_CACHE_TTL + 1):
+            self.assertIsNone(authentication.usuario_cacheado(self.user.pk))
+        self.assertEqual(self._visto({}, **self.auth).status_code, 401)
+
+    def test_invalidar_usuario_recarga_al_tiro(self):
+        authentication.usuario_cacheado(self.user.pk)
+        Usuario.objects.filter(pk=self.user.pk).update(activo=False)
+        authentication.invalidar_usuario(self.user.pk)
+        self.assertIsNone(authentication.usuario_cacheado(self.user.pk))
+
+
+class IpActividadTests(TestCase):
+    def _ip(self, **meta):
+        return actividad.ip_de(RequestFactory().get("/", REMOTE_ADDR="10.0.0.9", **meta))
+
+    def test_sin_proxies_se_ignora_x_forwarded_for(self):
+        self.assertEqual(self._ip(HTTP_X_FORWARDED_FOR="1.2.3.4"), "10.0.0.9")
+        self.assertEqual(self._ip(), "10.0.0.9")
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "NUM_PROXIES": 1})
+    def test_detras_de_un_proxy_se_usa_el_salto_que_agrego(self):
+        self.assertEqual(self._ip(HTTP_X_FORWARDED_FOR="1.2.3.4, 198.51.100.7"), "198.51.100.7")
+
+
+class BitacoraTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_sin_hilo_se_escribe_al_terminar_el_request(self):
+        user = crear_usuario(email="bita@example.com", contrasena="otra-clave")
+        r = self.client.post("/api/auth/login/", {"email": "bita@example.com", "contrasena": "mala"},
+                             content_type="application/json")
+        self.assertEqual(r.status_code, 401)
+        # escrito en esta transacción de test, sin hilo ni atexit de por medio
+        self.assertEqual(list(SeguimientoActividad.objects.values_list("id_usuario_id", "accion")),
+                         [(user.pk, "login_fallido")])
+        self.assertEqual(actividad.bitacora.pendientes(), 0)
+        self.assertIsNone(actividad.bitacora._hilo)
+
+
+class PerfilComunaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = crear_usuario()
+        self.origen = self.user.comuna
+        self.destino = Comuna.objects.create(nombre="Valparaíso", id_region=Region.objects.create(nombre="V"))
+        genero = Genero.objects.create(nombre="Novela")
+        self.libros = [
+            Libro.objects.create(
+                titulo=f"Libro {i}", isbn="0", anio_publicacion=2000, autor="-", estado="Nuevo",
+                descripcion="-", editorial="-", tipo_tapa="Blanda", disponible=True,
+                fecha_subida=timezone.now(), id_usuario=self.user, id_genero=genero,
+                id_comuna=self.origen, id_region=self.origen.id_region,
+            )
+            for i in range(2)
+        ]
+        # eliminado (soft-delete): también se resincroniza, por si se restaura
+        Libro.objects.filter(pk=self.libros[1].pk).update(eliminado_en=timezone.now())
+
+    def _patch(self, **datos):
+        return self.client.patch(f"/api/users/{self.user.pk}/", datos, content_type="application/json")
+
+    def _zonas(self):
+        return set(Libro.todos.filter(id_usuario=self.user).values_list("id_comuna_id", "id_region_id"))
+
+    def _catalogo(self, **params):
+        r = self.client.get("/api/libros/", params)
+        self.assertEqual(r.status_code, 200)
+        return [l["id_libro"] for l in r.json()]
+
+    def test_cambio_de_comuna_mueve_sus_libros(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            r = self._patch(comuna=self.destino.pk)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()["comuna_id"], self.destino.pk)
+        self.assertEqual(self._zonas(), {(self.destino.pk, self.destino.id_region_id)})
+        self.assertEqual(self._catalogo(comuna=self.destino.pk), [self.libros[0].pk])
+        self.assertEqual(self._catalogo(region=self.origen.id_region_id), [])
+
+    def test_sin_cambio_de_comuna_no_toca_los_libros(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self._patch(comuna=self.origen.pk, telefono="123").status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if q["sql"].startswith('UPDATE "libro"')])
+        self.assertEqual(self._zonas(), {(self.origen.pk, self.origen.id_region_id)})
+
+    def test_comuna_invalida_no_guarda_nada(self):
+        for comuna in ("abc", 999999):
+            self.assertEqual(self._patch(comuna=comuna, telefono="123").status_code, 400, comuna)
+        self.assertEqual(Usuario.objects.get(pk=self.user.pk).comuna_id, self.origen.pk)
+        self.assertEqual(self._zonas(), {(self.origen.pk, self.origen.id_region_id)})
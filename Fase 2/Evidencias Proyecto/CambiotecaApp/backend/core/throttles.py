@@ -0,0 +1,116 @@
+# core/throttles.py
+"""
+Throttling de los endpoints sensibles (login, forgot, reset) con ventana
+deslizante aproximada: contador de la ventana actual + el de la anterior
+ponderado por cuánto de ella sigue dentro del periodo.
+
+- Dos cubetas por vista: por IP y por cuenta (email/login del body, o el token
+  de reset). Se configuran en settings.THROTTLE_BUCKETS con tasas estilo DRF:
+      {"login_view": {"ip": "20/min", "cuenta": "5/min"}}
+  A lo más N intentos en cualquier periodo (salvo el error de la aproximación).
+- El estado vive en el caché de Django (`THROTTLE_CACHE`): Redis compartido
+  entre workers en producción, LocMem (por proceso) como reemplazo local.
+  Solo se usan operaciones atómicas del caché (add / incr / decr): no hay
+  leer-y-escribir, así que varios workers en paralelo no pueden pasar más
+  intentos de los permitidos.
+- DRF corre los throttles en `initial()`, antes del cuerpo de la vista: un
+  intento rechazado no llega a consultar la BD ni a hashear la contraseña.
+- Las vistas sin entrada en THROTTLE_BUCKETS no tocan el caché.
+- La IP sale de REST_FRAMEWORK["NUM_PROXIES"] (get_ident de DRF): un
+  X-Forwarded-For inventado por el cliente no abre una cubeta nueva.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+PERIODOS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+CAMPOS_CUENTA = ("email", "login", "token")
+
+
+def parse_tasa(tasa: str) -> tuple[int, int]:
+    """'20/min' -> (capacidad=20, periodo=60 segundos)."""
+    n, periodo = tasa.split("/")
+    return int(n), PERIODOS[periodo.strip()[0]]
+
+
+def _incr(cache, clave: str, ttl: int) -> int:
+    cache.add(clave, 0, ttl)
+    try:
+        return cache.incr(clave)
+    except ValueError:  # expiró entre add e incr
+        cache.add(clave, 0, ttl)
+        return cache.incr(clave)
+
+
+def consumir(clave: str, capacidad: int, periodo: int) -> float:
+    """Cuenta un intento. Devuelve 0 si pasa, o los segundos a esperar."""
+    cache = caches[getattr(settings, "THROTTLE_CACHE", "default")]
+    ahora = time.time()
+    ventana = int(ahora // periodo)
+    transcurrido = (ahora - ventana * periodo) / periodo   # 0..1 de la ventana actual
+
+    actual = f"{clave}:{ventana}"
+    n = _incr(cache, actual, 2 * periodo + 1)  # atómico: cada intento ve su propio n
+    previo = cache.get(f"{clave}:{ventana - 1}") or 0  # ventana cerrada: ya no cambia
+    if previo * (1 - transcurrido) + n <= capacidad:
+        return 0.0
+
+    # rechazado: no cuenta (solo los intentos que pasan consumen cupo)
+    cache.decr(actual)
+    n -= 1
+    if n >= capacidad or not previo:
+        return (1 - transcurrido) * periodo  # hasta la próxima ventana
+    # cuándo el peso de la ventana anterior deja lugar para uno más
+    libre_en = 1 - (capacidad - n - 1) / previo
+    return max(libre_en - transcurrido, 0.0) * periodo + 0.001
+
+
+class TokenBucketThrottle(BaseThrottle):
+    tipo = None  # "ip" | "cuenta"
+
+    def __init__(self):
+        self.espera = None
+
+    def identidad(self, request):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        # en @api_view la clase envoltorio lleva el nombre de la función
+        tasa = getattr(settings, "THROTTLE_BUCKETS", {}).get(type(view).__name__, {}).get(self.tipo)
+        if not tasa:
+            return True
+        ident = self.identidad(request)
+        if not ident:
+            return True
+        capacidad, periodo = parse_tasa(tasa)
+        ident = hashlib.sha1(ident.encode()).hexdigest()  # no guardar emails/tokens en el caché
+        self.espera = consumir(f"tb:{type(view).__name__}:{self.tipo}:{ident}", capacidad, periodo)
+        return self.espera == 0
+
+    def wait(self):
+        return self.espera
+
+
+class IPThrottle(TokenBucketThrottle):
+    tipo = "ip"
+
+    def identidad(self, request):
+        # REST_FRAMEWORK["NUM_PROXIES"]: solo se confía en los saltos de
+        # X-Forwarded-For que agregaron nuestros propios proxies
+        return self.get_ident(request)
+
+
+class CuentaThrottle(TokenBucketThrottle):
+    tipo = "cuenta"
+
+    def identidad(self, request):
+        data = request.data if hasattr(request.data, "get") else {}
+        for campo in CAMPOS_CUENTA:
+            valor = (data.get(campo) or "")
+            if isinstance(valor, str) and valor.strip():
+                return valor.strip().lower()[:200]
+        return None
@@ -1,9 +1,7 @@
 from django.conf import settings
 from django.utils import timezone
 from django.core.files.storage import default_storage
-from django.core.mail import EmailMultiAlternatives
-from email.mime.image import MIMEImage
-from django.contrib.auth.hashers import check_password
+from django.db import transaction
 from django.db.models import Q, Avg, Count
 
 from rest_framework.decorators import api_view, permission_classes, parser_classes
@@ -13,6 +11,10 @@ from rest_framework import status
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 
 from .models import PasswordResetToken, Usuario, Region, Comuna
+from .authentication import emitir_token, usuario_id
+from .passwords import verificar_contrasena, guardar_contrasena
+from . import actividad, notificaciones, sesiones
+from .tareas import enviar_correo_reset
 from .serializers import (
     RegisterSerializer, RegionSerializer, ComunaSerializer,
     ForgotPasswordSerializer, ResetPasswordSerializer,
@@ -20,9 +22,9 @@ from .serializers import (
 )
 
 from market.models import Libro, Intercambio, Calificacion
+from market.publicacion import PUBLICADOS
+from market.ubicacion import sincronizar_usuario
 
-import jwt
-import datetime
 import os
 import uuid
 import secrets
@@ -88,25 +90,13 @@ def login_view(request):
     if not user:
         return Response({"error": "Usuario no encontrado o inactivo."}, status=401)
 
-    ok = False
-    try:
-        ok = check_password(contrasena, user.contrasena)
-    except Exception:
-        ok = False
-    if not ok and user.contrasena == contrasena:
-        ok = True
-
-    if not ok:
+    # re-hashea si el hash está desactualizado o en texto plano
+    if not verificar_contrasena(user, contrasena):
+        actividad.registrar(request, user.id_usuario, "login_fallido")
         return Response({"error": "Contraseña incorrecta."}, status=401)
 
-    exp_dt = timezone.now() + datetime.timedelta(hours=24)
-    payload = {
-        "id": user.id_usuario,
-        "email": user.email,
-        "exp": int(exp_dt.timestamp()),
-        "iat": int(timezone.now().timestamp()),
-    }
-    token = jwt.encode(payload, settings.SECRET_KEY, algorithm="HS256")
+    token = emitir_token(user, actividad.dispositivo_de(request))
+    actividad.registrar(request, user.id_usuario, "login")
 
     default_rel = "avatars/avatardefecto.jpg"
     pic_rel = user.imagen_perfil or default_rel
@@ -127,6 +117,21 @@ def login_view(request):
         }
     })
 
+def _jti(request):
+    return request.auth.get("jti") if isinstance(request.auth, dict) else None
+
+
+@api_view(["POST"])
+@permission_classes([AllowAny])
+def logout_view(request):
+    """Revoca el token del header Authorization (los demás dispositivos siguen)."""
+    jti = _jti(request)
+    if not jti:
+        return Response({"detail": "No hay una sesión que cerrar."}, status=400)
+    sesiones.revocar(jti)
+    actividad.registrar(request, request.user.id_usuario, "logout")
+    return Response({"ok": True})
+
 # =========================
 # REGISTER (archivo o URL)
 # =========================
@@ -188,89 +193,8 @@ def forgot_password(request):
         PasswordResetToken.objects.create(user=user, token=token)
         reset_link = f"{settings.FRONTEND_RESET_URL}/{token}"
 
-        subject = "Restablece tu contraseña - Cambioteca"
-        from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@cambioteca.local')
-        to = [user.email]
-
-        text_body = (
-            f"Buen día, {user.nombres}.\n\n"
-            f"Te contactamos de Cambioteca para que puedas restaurar tu contraseña.\n"
-            f"Enlace: {reset_link}\n\n"
-            f"Correo automático, por favor no responder este email.\n\n"
-            f"Cambioteca\n"
-            f"Creado por Vicente y Nicolas para nuestro proyecto de título :)\n"
-        )
-
-        html_body = f"""
-        <!doctype html>
-        <html lang="es">
-        <head>
-          <meta charset="utf-8">
-          <meta name="viewport" content="width=device-width,initial-scale=1">
-          <title>Cambioteca - Restablecer contraseña</title>
-          <style>
-            body {{
-              margin: 0; padding: 0; background: #f5f5f5; color: #2b2b2b; font-family: Arial, sans-serif;
-            }}
-            .wrap {{
-              max-width: 560px; margin: 24px auto; background: #ffffff; border-radius: 12px;
-              box-shadow: 0 2px 8px rgba(0,0,0,.06); overflow: hidden;
-            }}
-            .head {{
-              background: #aa9797; padding: 18px; text-align: center; color: #fff;
-            }}
-            .logo {{ width: 120px; height: auto; margin: 8px auto 6px; display: block; }}
-            .title {{ margin: 4px 0 0; font-size: 20px; font-weight: 700; }}
-            .content {{ padding: 20px; line-height: 1.55; }}
-            .cta {{
-              display: inline-block; margin: 16px 0; padding: 12px 18px; background: #aa9797; color: #fff;
-              text-decoration: none; border-radius: 8px; font-weight: 600;
-            }}
-            .muted {{ color: #777; font-size: 12px; }}
-            .footer {{ padding: 16px; text-align: center; color: #fff; background: #aa9797; }}
-          </style>
-        </head>
-        <body>
-          <div class="wrap">
-            <div class="head">
-              <img class="logo" src="cid:cambioteca_logo" alt="Cambioteca" />
-              <div class="title">Cambioteca</div>
-            </div>
-            <div class="content">
-              <p><strong>Buen día, {user.nombres}</strong></p>
-              <p>Te contactamos de <strong>Cambioteca</strong> para que puedas restaurar tu contraseña.</p>
-              <p><a class="cta" href="{reset_link}">Restablecer contraseña</a></p>
-              <p>Enlace directo: <a href="{reset_link}">{reset_link}</a></p>
-              <p class="muted">Correo automático — no responder.</p>
-              <hr style="border:none;border-top:1px solid #eee;margin:18px 0;">
-              <p class="muted">Cambioteca · Creado por Vicente y Nicolas para nuestro proyecto de título :)</p>
-            </div>
-            <div class="footer">© {timezone.now().year} Cambioteca</div>
-          </div>
-        </body>
-        </html>
-        """
-
-        msg = EmailMultiAlternatives(subject, text_body, from_email, to)
-        msg.attach_alternative(html_body, "text/html")
-
-        # Adjuntar logo si existe
-        try:
-            logo_path = settings.MEDIA_ROOT / "app" / "cambioteca.png"
-        except TypeError:
-            logo_path = os.path.join(settings.MEDIA_ROOT, "app", "cambioteca.png")
-
-        try:
-            with open(logo_path, "rb") as f:
-                img = MIMEImage(f.read())
-                img.add_header("Content-ID", "<cambioteca_logo>")
-                img.add_header("Content-Disposition", "inline", filename="cambioteca.png")
-                msg.attach(img)
-        except Exception as e:
-            if settings.DEBUG:
-                print("WARNING: No se pudo adjuntar el logo:", e)
-
-        msg.send(fail_silently=False)
+        # el correo (SMTP) se envía desde el worker de la cola, no en el request
+        enviar_correo_reset.encolar(email=user.email, nombres=user.nombres, reset_link=reset_link)
 
         if settings.DEBUG:
             print("==== RESET LINK DEV ====", reset_link)
@@ -282,7 +206,9 @@ def forgot_password(request):
 def reset_password(request):
     ser = ResetPasswordSerializer(data=request.data)
     if ser.is_valid():
-        ser.save()
+        user = ser.save()
+        sesiones.revocar_usuario(user.id_usuario)
+        actividad.registrar(request, user.id_usuario, "contrasena_restablecida")
         return Response({"message": "Contraseña actualizada correctamente."})
     return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -297,7 +223,7 @@ def user_profile_view(request, user_id: int):
         return Response({"detail": "Usuario no encontrado."}, status=404)
 
     # === CAMBIO: sólo libros disponibles del usuario
-    libros_count = Libro.objects.filter(id_usuario_id=user_id, disponible=True).count()
+    libros_count = Libro.objects.filter(id_usuario_id=user_id, estado_publicacion__in=PUBLICADOS).count()
 
     # === CAMBIO: sólo intercambios Completados donde participó
     intercambios_count = Intercambio.objects.filter(
@@ -420,9 +346,7 @@ def change_password_view(request):
     """
     Body: { "user_id": 123, "current": "...", "new": "..." }
     """
-    from django.contrib.auth.hashers import check_password, make_password
-
-    user_id = request.data.get("user_id")
+    user_id = usuario_id(request, request.data.get("user_id"))
     current = request.data.get("current") or ""
     new = request.data.get("new") or ""
 
@@ -433,19 +357,13 @@ def change_password_view(request):
     if not user:
         return Response({"detail": "Usuario no encontrado."}, status=404)
 
-    ok = False
-    try:
-        ok = check_password(current, user.contrasena)
-    except Exception:
-        ok = False
-    if not ok and user.contrasena == current:
-        ok = True
-
-    if not ok:
+    if not verificar_contrasena(user, current):
         return Response({"detail": "Contraseña actual incorrecta."}, status=400)
 
-    user.contrasena = make_password(new)
-    user.save(update_fields=['contrasena'])
+    guardar_contrasena(user, new)
+    # cierra las demás sesiones; la de este request (si vino con token) sigue
+    sesiones.revocar_usuario(user.id_usuario, excepto=_jti(request))
+    actividad.registrar(request, user.id_usuario, "contrasena_cambiada")
     return Response({"message": "Contraseña actualizada."})
 
 @api_view(["GET"])
@@ -459,7 +377,7 @@ def user_summary(request, id: int):
         u.imagen_perfil = u.imagen_perfil.replace("\\", "/")
 
     # === CAMBIO: contar sólo libros disponibles
-    libros = Libro.objects.filter(id_usuario=id, disponible=True).count()
+    libros = Libro.objects.filter(id_usuario=id, estado_publicacion__in=PUBLICADOS).count()
 
     # === CAMBIO: contar sólo intercambios Completados
     inter = Intercambio.objects.filter(
@@ -534,7 +452,23 @@ def update_user_profile(request, id: int):
     for f in updatable:
         if f in request.data:
             setattr(u, f, (request.data.get(f) or "").strip())
-    u.save()
+
+    cambio_comuna = False
+    if request.data.get("comuna") not in (None, ""):
+        try:
+            comuna_id = int(request.data.get("comuna"))
+        except (TypeError, ValueError):
+            return Response({"detail": "comuna inválida."}, status=400)
+        if not Comuna.objects.filter(pk=comuna_id).exists():
+            return Response({"detail": "comuna no existe."}, status=400)
+        cambio_comuna = comuna_id != u.comuna_id
+        u.comuna_id = comuna_id
+
+    with transaction.atomic():
+        u.save()
+        if cambio_comuna:
+            # sus libros guardan la zona para los filtros del catálogo
+            sincronizar_usuario(u.id_usuario)
 
     data = UsuarioSummarySerializer(u).data
     data.update({
@@ -542,6 +476,7 @@ def update_user_profile(request, id: int):
         "direccion": u.direccion,
         "numeracion": u.numeracion,
         "direccion_completa": f"{u.direccion or ''} {u.numeracion or ''}".strip(),
+        "comuna_id": u.comuna_id,
     })
     return Response(data)
 
@@ -578,7 +513,7 @@ def user_books_view(request, user_id: int):
     from market.models import Libro, ImagenLibro
 
     qs = (Libro.objects
-          .filter(id_usuario_id=user_id, disponible=True)
+          .filter(id_usuario_id=user_id, estado_publicacion__in=PUBLICADOS)
           .only("id_libro", "titulo", "autor", "fecha_subida")
           .order_by("-fecha_subida", "-id_libro"))
 
@@ -598,4 +533,53 @@ def user_books_view(request, user_id: int):
         "fecha_subida": b.fecha_subida,
     } for b in qs]
 
-    return Response(out)
\ No newline at end of file
+    return Response(out)
+
+
+# =========================
+# Notificaciones
+# =========================
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def notificaciones_view(request, user_id: int):
+    """
+    GET /api/users/<id>/notificaciones/?cursor=&limit=20&no_leidas=1
+    -> { "results": [...], "siguiente": "<cursor>" | null, "no_leidas": 3 }
+    Un solo feed para solicitudes, chats e intercambios (ver core/notificaciones.py).
+    """
+    user_id = int(usuario_id(request, user_id))
+    params = request.query_params
+    try:
+        limite = int(params.get("limit") or notificaciones.FEED_LIMIT_DEFAULT)
+        cursor = notificaciones.leer_cursor(params["cursor"]) if params.get("cursor") else None
+    except (TypeError, ValueError):
+        return Response({"detail": "cursor o limit inválido."}, status=400)
+    limite = max(1, min(limite, notificaciones.FEED_LIMIT_MAX))
+
+    return Response(notificaciones.feed(
+        user_id, cursor, limite, solo_no_leidas=params.get("no_leidas") in ("1", "true"),
+    ))
+
+
+@api_view(["POST"])
+@permission_classes([AllowAny])
+def notificaciones_leer(request, user_id: int):
+    """
+    POST /api/users/<id>/notificaciones/leer/  { "ids": [5, 6] }  o  { "todas": true }
+    -> { "marcadas": 2 }
+    """
+    user_id = int(usuario_id(request, user_id))
+    if request.data.get("todas") is True:
+        ids = None
+    else:
+        ids = request.data.get("ids")
+        if not isinstance(ids, list) or not ids:
+            return Response({"detail": "ids debe ser una lista no vacía (o todas: true)."}, status=400)
+        if len(ids) > notificaciones.LEER_LOTE_MAX:
+            return Response({"detail": f"Máximo {notificaciones.LEER_LOTE_MAX} ids por llamada (o todas: true)."},
+                            status=400)
+        try:
+            ids = {int(i) for i in ids}
+        except (TypeError, ValueError):
+            return Response({"detail": "ids inválidos."}, status=400)
+    return Response({"marcadas": notificaciones.marcar_leidas(user_id, ids)})
@@ -0,0 +1,158 @@
+# market/chat_archivo.py
+"""
+Archivo frío de chats.
+
+Los mensajes de conversaciones cuyo intercambio quedó Completado/Cancelado hace
+más de N días se mueven de `conversacion_mensaje` (tabla caliente) a una fila
+por conversación en `conversacion_archivo`, como JSON comprimido con zlib.
+`mensajes_de_conversacion` los lee de vuelta de forma transparente; el blob
+ya descomprimido queda en el caché de Django (clave con el último id
+archivado, así un archivado posterior no deja una versión vieja).
+Si se borra la conversación (o su intercambio) se borra también su archivo.
+"""
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .constants import INTERCAMBIO_ESTADO
+from .models import Conversacion, ConversacionArchivo, ConversacionMensaje, ConversacionParticipante
+
+# Mismo orden que las filas que arma mensajes_de_conversacion
+CAMPOS_MENSAJE = ("id_mensaje", "id_usuario_emisor_id", "cuerpo", "enviado_en", "eliminado")
+
+ESTADOS_ARCHIVABLES = [INTERCAMBIO_ESTADO["COMPLETADO"], INTERCAMBIO_ESTADO["CANCELADO"]]
+
+
+def _comprimir(filas) -> bytes:
+    payload = [[f[0], f[1], f[2], f[3].isoformat() if f[3] else None, bool(f[4])] for f in filas]
+    return zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def _descomprimir(blob) -> list:
+    if not blob:
+        return []
+    filas = json.loads(zlib.decompress(bytes(blob)).decode("utf-8"))
+    return [(f[0], f[1], f[2], parse_datetime(f[3]) if f[3] else None, f[4]) for f in filas]
+
+
+def ultimo_id_archivado(conversacion_id: int):
+    """Máximo id archivado, o None si la conversación no tiene archivo (no lee el blob)."""
+    return (ConversacionArchivo.objects
+            .filter(pk=conversacion_id)
+            .values_list("ultimo_id_mensaje", flat=True)
+            .first())
+
+
+def leer_archivo(conversacion_id: int, ultimo_id=None) -> list:
+    """
+    Filas archivadas (CAMPOS_MENSAJE) en orden ASC por id; [] si no hay archivo.
+    Con `ultimo_id` (de ultimo_id_archivado) se usa el caché.
+    """
+    clave = f"chat_archivo:{conversacion_id}:{ultimo_id}"
+    if ultimo_id is not None:
+        filas = cache.get(clave)
+        if filas is not None:
+            return filas
+    blob = (ConversacionArchivo.objects
+            .filter(pk=conversacion_id)
+            .values_list("mensajes", flat=True)
+            .first())
+    filas = _descomprimir(blob)
+    if ultimo_id is not None:
+        cache.set(clave, filas, getattr(settings, "CHAT_ARCHIVO_CACHE_TTL", 600))
+    return filas
+
+
+def no_leidos_archivados(conversacion_ids=None) -> dict:
+    """
+    {(id_conversacion, id_usuario): mensajes archivados de otros con id >
+    ultimo_visto}. Solo descomprime los archivos de participantes que no han
+    visto hasta el final del archivo (lo normal es que no haya ninguno).
+    """
+    archivos = ConversacionArchivo.objects.all()
+    if conversacion_ids is not None:
+        archivos = archivos.filter(pk__in=conversacion_ids)
+    ultimos = dict(archivos.values_list("id_conversacion", "ultimo_id_mensaje"))
+    if not ultimos:
+        return {}
+
+    pendientes = {}
+    for conv_id, user_id, visto in (ConversacionParticipante.objects
+                                    .filter(id_conversacion_id__in=list(ultimos))
+                                    .values_list("id_conversacion_id", "id_usuario_id",
+                                                 "ultimo_visto_id_mensaje")):
+        if (visto or 0) < ultimos[conv_id]:
+            pendientes.setdefault(conv_id, []).append((user_id, visto or 0))
+
+    conteo = {}
+    for conv_id, participantes in pendientes.items():
+        filas = leer_archivo(conv_id, ultimos[conv_id])
+        for user_id, visto in participantes:
+            n = sum(1 for f in filas if f[0] > visto and f[1] != user_id)
+            if n:
+                conteo[(conv_id, user_id)] = n
+    return conteo
+
+
+def borrar_de_intercambios(intercambio_ids) -> int:
+    """Archivos de las conversaciones de esos intercambios (llamar antes de borrarlos)."""
+    conv_ids = Conversacion.objects.filter(id_intercambio_id__in=intercambio_ids).values("pk")
+    return ConversacionArchivo.objects.filter(pk__in=conv_ids).delete()[0]
+
+
+def borrar_huerfanos() -> int:
+    """Archivos cuya conversación ya no existe (p.ej. borrada en cascada por la BD)."""
+    vivas = Conversacion.objects.filter(pk=OuterRef("pk"))
+    return ConversacionArchivo.objects.filter(~Exists(vivas)).delete()[0]
+
+
+def conversaciones_archivables(dias: int):
+    """Conversaciones cerradas hace más de `dias` días que aún tienen mensajes calientes."""
+    corte = timezone.now() - timedelta(days=dias)
+    return (Conversacion.objects
+            .filter(id_intercambio__estado_intercambio__in=ESTADOS_ARCHIVABLES,
+                    actualizado_en__lt=corte)
+            .filter(Q(id_intercambio__fecha_completado__isnull=True) |
+                    Q(id_intercambio__fecha_completado__lt=corte))
+            .filter(Exists(ConversacionMensaje.objects.filter(id_conversacion=OuterRef("pk"))))
+            .order_by("id_conversacion")
+            .values_list("id_conversacion", flat=True))
+
+
+def archivar_conversacion(conversacion_id: int) -> int:
+    """
+    Mueve los mensajes calientes de una conversación a su archivo (se agregan
+    al final si ya existía). Devuelve cuántos mensajes se movieron.
+    """
+    with transaction.atomic():
+        filas = list(ConversacionMensaje.objects
+                     .select_for_update()
+                     .filter(id_conversacion_id=conversacion_id)
+                     .order_by("id_mensaje")
+                     .values_list(*CAMPOS_MENSAJE))
+        if not filas:
+            return 0
+
+        arch = ConversacionArchivo.objects.select_for_update().filter(pk=conversacion_id).first()
+        todas = (_descomprimir(arch.mensajes) if arch else []) + filas
+        if arch is None:
+            arch = ConversacionArchivo(id_conversacion=conversacion_id)
+
+        arch.mensajes = _comprimir(todas)
+        arch.total_mensajes = len(todas)
+        arch.ultimo_id_mensaje = todas[-1][0]
+        arch.ultimo_mensaje = todas[-1][2]
+        arch.archivado_en = timezone.now()
+        arch.save()
+
+        (ConversacionMensaje.objects
+         .filter(id_conversacion_id=conversacion_id, id_mensaje__lte=filas[-1][0])
+         .delete())
+    return len(filas)
@@ -0,0 +1,278 @@
+# market/coincidencias.py
+"""
+Motor de coincidencias de intercambio: a partir de lo que cada usuario quiere
+(Favorito) y lo que tiene publicado (Libro disponible) propone
+
+- intercambios directos: A quiere un libro de B y B quiere uno de A;
+- ciclos de tres: A quiere de B, B quiere de C y C quiere de A.
+
+El grafo (usuario -> usuario, con peso = cuántos libros del otro quiere) vive
+en memoria en cada proceso y se actualiza incrementalmente:
+
+- Cada escritura relevante publica, tras el commit, un lote de eventos en el
+  caché de Django (Redis compartido en producción) con un número de secuencia.
+- Antes de responder, el proceso aplica de una vez todos los lotes que no ha
+  visto (una lectura del caché si no hay nada nuevo). Los eventos fijan estado
+  ("este libro ahora es de X / no está publicado", "U quiere / ya no quiere L"),
+  así que aplicarlos dos veces no cambia nada.
+- Si faltan lotes (expiraron) o pasa COINCIDENCIAS_REFRESCO, se reconstruye
+  desde la BD. La reconstrucción corre siempre en segundo plano: mientras
+  tanto se responde con el grafo anterior (o, en un proceso recién levantado,
+  con uno vacío y `listo: False`), nunca desde el hilo del request.
+
+Sin REDIS_URL el caché es LocMem, propio de cada proceso: un worker solo ve
+sus propios eventos y lo escrito en los demás le llega con la reconstrucción
+periódica (hasta COINCIDENCIAS_REFRESCO segundos tarde). Con un solo proceso
+(desarrollo) no hay diferencia; en producción con varios workers usar Redis.
+"""
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .constants import LIBRO_PUBLICACION
+from .models import Favorito, Libro
+
+logger = logging.getLogger(__name__)
+
+CLAVE_SEQ = "coincidencias:seq"
+CLAVE_LOTE = "coincidencias:lote:{}"
+LOTE_TTL = 3600          # segundos que un lote de eventos queda disponible
+HUECO_MAX = 5            # segundos esperando un lote que falta antes de reconstruir
+LEER_POR_VEZ = 500       # lotes por get_many
+
+
+class GrafoDeseos:
+    def __init__(self):
+        self.dueno = {}                          # libro publicado -> dueño
+        self.libros_de = defaultdict(set)        # dueño -> libros publicados
+        self.favoritos = defaultdict(set)        # usuario -> libros que quiere
+        self.interesados = defaultdict(set)      # libro -> usuarios que lo quieren
+        self.salientes = defaultdict(Counter)    # u -> {v: libros de v que u quiere}
+        self.entrantes = defaultdict(Counter)    # v -> {u: libros de v que u quiere}
+
+    # ---------- cambios ----------
+    def _arista(self, u, v, delta):
+        if u == v:
+            return
+        for idx, a, b in ((self.salientes, u, v), (self.entrantes, v, u)):
+            c = idx[a]
+            c[b] += delta
+            if c[b] <= 0:
+                del c[b]
+                if not c:
+                    del idx[a]
+
+    def libro(self, libro_id, dueno_id):
+        """dueno_id=None: el libro ya no está publicado."""
+        actual = self.dueno.get(libro_id)
+        if actual == dueno_id:
+            return
+        if actual is not None:
+            del self.dueno[libro_id]
+            self.libros_de[actual].discard(libro_id)
+            if not self.libros_de[actual]:
+                del self.libros_de[actual]
+            for u in self.interesados.get(libro_id, ()):
+                self._arista(u, actual, -1)
+        if dueno_id is not None:
+            self.dueno[libro_id] = dueno_id
+            self.libros_de[dueno_id].add(libro_id)
+            for u in self.interesados.get(libro_id, ()):
+                self._arista(u, dueno_id, +1)
+
+    def libro_borrado(self, libro_id):
+        self.libro(libro_id, None)
+        for u in self.interesados.pop(libro_id, ()):
+            self.favoritos[u].discard(libro_id)
+
+    def favorito(self, usuario_id, libro_id, activo):
+        tiene = libro_id in self.favoritos.get(usuario_id, ())
+        if tiene == bool(activo):
+            return
+        delta = 1 if activo else -1
+        if activo:
+            self.favoritos[usuario_id].add(libro_id)
+            self.interesados[libro_id].add(usuario_id)
+        else:
+            self.favoritos[usuario_id].discard(libro_id)
+            self.interesados[libro_id].discard(usuario_id)
+        dueno = self.dueno.get(libro_id)
+        if dueno is not None:
+            self._arista(usuario_id, dueno, delta)
+
+    def aplicar(self, eventos):
+        for ev in eventos:
+            tipo = ev[0]
+            if tipo == "libro":
+                self.libro(ev[1], ev[2])
+            elif tipo == "borrado":
+                self.libro_borrado(ev[1])
+            elif tipo == "fav":
+                self.favorito(ev[1], ev[2], ev[3])
+
+    # ---------- consultas ----------
+    def _quiere_de(self, u, v):
+        return sorted(l for l in self.favoritos.get(u, ()) if self.dueno.get(l) == v)
+
+    def directos(self, u, limite=20):
+        mutuos = self.salientes.get(u, {}).keys() & self.entrantes.get(u, {}).keys()
+        mejores = sorted(mutuos, key=lambda v: (-min(self.salientes[u][v], self.entrantes[u][v]), v))
+        return [{"usuario": v, "recibes": self._quiere_de(u, v), "entregas": self._quiere_de(v, u)}
+                for v in mejores[:limite]]
+
+    def ciclos(self, u, limite=20):
+        """u -> v -> w -> u, con w entre quienes quieren algo de u."""
+        salientes_u = self.salientes.get(u, {})
+        entrantes_u = self.entrantes.get(u, {}).keys()
+        encontrados = []
+        for v in salientes_u:
+            for w in self.salientes.get(v, {}).keys() & entrantes_u:
+                if w != u and w != v and v not in entrantes_u:  # los mutuos ya son directos
+                    peso = min(salientes_u[v], self.salientes[v][w], self.salientes[w][u])
+                    encontrados.append((peso, v, w))
+        encontrados.sort(key=lambda t: (-t[0], t[1], t[2]))
+        return [{"usuarios": [u, v, w],
+                 "pasos": [{"de": a, "a": b, "libros": self._quiere_de(a, b)}
+                           for a, b in ((u, v), (v, w), (w, u))]}
+                for _, v, w in encontrados[:limite]]
+
+
+# =========================
+# Grafo del proceso
+# =========================
+_grafo = None
+_aplicado = 0            # último lote aplicado
+_construido_en = None
+_hueco_desde = None
+_lock = threading.RLock()
+_reconstruyendo = threading.Lock()
+
+
+def _seq() -> int:
+    return int(cache.get(CLAVE_SEQ) or 0)
+
+
+def construir() -> GrafoDeseos:
+    g = GrafoDeseos()
+    publicados = Libro.objects.filter(estado_publicacion=LIBRO_PUBLICACION["DISPONIBLE"])
+    for libro_id, dueno_id in publicados.values_list("pk", "id_usuario_id").iterator(chunk_size=5000):
+        g.libro(libro_id, dueno_id)
+    for u, libro_id in Favorito.objects.values_list("id_usuario_id", "id_libro_id").iterator(chunk_size=5000):
+        g.favorito(u, libro_id, True)
+    return g
+
+
+def _reconstruir():
+    global _grafo, _aplicado, _construido_en, _hueco_desde
+    desde = _seq()  # lo publicado después se vuelve a aplicar (idempotente)
+    g = construir()  # sin _lock: los requests siguen con el grafo anterior
+    with _lock:
+        _grafo, _aplicado, _construido_en, _hueco_desde = g, desde, time.monotonic(), None
+
+
+def _reconstruir_fondo():
+    try:
+        _reconstruir()
+    except Exception:
+        logger.exception("No se pudo reconstruir el grafo de coincidencias")
+    finally:
+        connection.close()
+        _reconstruyendo.release()
+
+
+def _lanzar_reconstruccion() -> None:
+    if _reconstruyendo.acquire(blocking=False):  # una a la vez por proceso
+        threading.Thread(target=_reconstruir_fondo, daemon=True).start()
+
+
+def _ponerse_al_dia():
+    global _aplicado, _hueco_desde
+    hasta = _seq()
+    while _aplicado < hasta:
+        numeros = range(_aplicado + 1, min(hasta, _aplicado + LEER_POR_VEZ) + 1)
+        lotes = cache.get_many([CLAVE_LOTE.format(n) for n in numeros])
+        for n in numeros:
+            lote = lotes.get(CLAVE_LOTE.format(n))
+            if lote is None:
+                # o se está escribiendo (incr antes que set) o ya expiró
+                _hueco_desde = _hueco_desde or time.monotonic()
+                return time.monotonic() - _hueco_desde <= HUECO_MAX
+            _grafo.aplicar(lote)
+            _aplicado, _hueco_desde = n, None
+    return True
+
+
+def grafo() -> GrafoDeseos | None:
+    """El grafo del proceso, o None si todavía se está construyendo por primera vez."""
+    with _lock:
+        if _grafo is None:
+            _lanzar_reconstruccion()
+        elif not _ponerse_al_dia():
+            _lanzar_reconstruccion()  # faltan lotes: se sigue con el actual hasta el cambio
+        elif time.monotonic() - _construido_en > getattr(settings, "COINCIDENCIAS_REFRESCO", 1800):
+            _lanzar_reconstruccion()
+        return _grafo
+
+
+# =========================
+# Eventos (escrituras)
+# =========================
+def publicar(eventos) -> None:
+    if not eventos:
+        return
+    cache.add(CLAVE_SEQ, 0, None)
+    n = cache.incr(CLAVE_SEQ)
+    cache.set(CLAVE_LOTE.format(n), list(eventos), LOTE_TTL)
+
+
+def libros_cambiados(libro_ids) -> None:
+    """Tras el commit: lee el estado actual de esos libros y lo publica."""
+    ids = {int(i) for i in libro_ids if i}
+    if not ids:
+        return
+
+    def enviar():
+        filas = Libro.todos.filter(pk__in=ids).values_list("pk", "id_usuario_id", "estado_publicacion", "eliminado_en")
+        eventos, vistos = [], set()
+        for pk, dueno, estado, eliminado in filas:
+            vistos.add(pk)
+            publicado = estado == LIBRO_PUBLICACION["DISPONIBLE"] and eliminado is None
+            eventos.append(("libro", pk, dueno if publicado else None))
+        eventos += [("borrado", pk) for pk in ids - vistos]
+        publicar(eventos)
+
+    transaction.on_commit(_seguro(enviar))
+
+
+def favoritos_cambiados(usuario_id: int, libro_ids, activo: bool) -> None:
+    eventos = [("fav", int(usuario_id), int(l), bool(activo)) for l in libro_ids]
+    if eventos:
+        transaction.on_commit(_seguro(lambda: publicar(eventos)))
+
+
+def _seguro(fn):
+    def envoltorio():
+        try:
+            fn()
+        except Exception:
+            # el grafo se corrige en la próxima reconstrucción
+            logger.exception("No se pudieron publicar eventos de coincidencias")
+    return envoltorio
+
+
+# =========================
+# API
+# =========================
+def para_usuario(usuario_id: int, limite: int = 20) -> dict:
+    """listo=False: el proceso aún no tiene grafo (se está construyendo), reintentar."""
+    g = grafo()
+    if g is None:
+        return {"directos": [], "ciclos": [], "listo": False}
+    with _lock:
+        return {"directos": g.directos(usuario_id, limite), "ciclos": g.ciclos(usuario_id, limite),
+                "listo": True}
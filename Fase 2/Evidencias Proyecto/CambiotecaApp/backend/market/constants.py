@@ -13,3 +13,11 @@ INTERCAMBIO_ESTADO = {
     "CANCELADO": "Cancelado",
     "RECHAZADO": "Rechazado",
 }
+
+# libro.estado_publicacion (ver market/publicacion.py)
+LIBRO_PUBLICACION = {
+    "DISPONIBLE": "disponible",
+    "EN_NEGOCIACION": "en_negociacion",
+    "INTERCAMBIADO": "intercambiado",
+    "RETIRADO": "retirado",
+}
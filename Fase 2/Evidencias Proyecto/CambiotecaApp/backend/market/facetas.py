@@ -0,0 +1,103 @@
+# market/facetas.py
+"""
+Conteos por faceta del catálogo (género, estado, tipo de tapa, comuna) para
+los filtros actuales de `GET libros/`.
+
+- Una sola consulta: GROUP BY de las cuatro columnas juntas; cada faceta se
+  suma en Python a partir de esas combinaciones (son pocas: géneros x estados
+  x tapas x comunas con libros).
+- Los conteos se calculan con todos los filtros aplicados, incluido el de la
+  propia faceta.
+- Resultado cacheado por consulta normalizada durante FACETAS_TTL. La clave
+  sale de los mismos valores con que filtra `LibroViewSet.get_queryset`
+  (`normalizar`): otro orden o espacios repetidos -> misma clave. Las
+  mayúsculas no se pliegan: icontains/iexact dependen de la collation.
+- `invalidar()` (lo llama feed.invalidar en cada cambio del catálogo) sube la
+  versión que va en todas las claves; los conteos viejos quedan huérfanos y
+  vencen por TTL.
+"""
+import hashlib
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+# parámetros de GET libros/ que cambian el conjunto (los demás no entran en la clave)
+PARAMETROS = ("query", "region", "comuna", "genero", "estado", "tipo_tapa")
+VERSION = "facetas:version"
+
+
+def _ttl() -> int:
+    return getattr(settings, "FACETAS_TTL", 60)
+
+
+def normalizar(valor) -> str:
+    """Espacios colapsados; get_queryset filtra con esto mismo."""
+    return " ".join(str(valor or "").split())
+
+
+def clave(params) -> str:
+    normal = sorted((p, normalizar(params.get(p))) for p in PARAMETROS if normalizar(params.get(p)))
+    version = cache.get(VERSION, 0)
+    return f"facetas:{version}:" + hashlib.sha1(urlencode(normal).encode()).hexdigest()
+
+
+def _nueva_version():
+    if cache.add(VERSION, 1, None):
+        return
+    try:
+        cache.incr(VERSION)
+    except ValueError:  # expulsada entre add e incr
+        cache.add(VERSION, 1, None)
+
+
+def invalidar() -> None:
+    """Descarta todos los conteos cacheados cuando la transacción actual se confirme."""
+    transaction.on_commit(_nueva_version)
+
+
+def calcular(qs) -> dict:
+    filas = (qs.order_by()
+             .values("id_genero_id", "id_genero__nombre", "estado", "tipo_tapa",
+                     "id_comuna_id", "id_comuna__nombre")
+             .annotate(n=Count("pk")))
+
+    total = 0
+    genero, estado, tapa, comuna = (defaultdict(int) for _ in range(4))
+    nombres = {}
+    for f in filas:
+        n = f["n"]
+        total += n
+        genero[f["id_genero_id"]] += n
+        estado[f["estado"]] += n
+        tapa[f["tipo_tapa"]] += n
+        comuna[f["id_comuna_id"]] += n
+        nombres[("g", f["id_genero_id"])] = f["id_genero__nombre"]
+        nombres[("c", f["id_comuna_id"])] = f["id_comuna__nombre"]
+
+    def por_id(conteos, tipo):
+        return [{"id": k, "nombre": nombres[(tipo, k)], "n": n}
+                for k, n in sorted(conteos.items(), key=lambda kv: (-kv[1], str(nombres[(tipo, kv[0])])))]
+
+    def por_valor(conteos):
+        return [{"valor": k, "n": n} for k, n in sorted(conteos.items(), key=lambda kv: (-kv[1], str(kv[0])))]
+
+    return {
+        "total": total,
+        "genero": por_id(genero, "g"),
+        "estado": por_valor(estado),
+        "tipo_tapa": por_valor(tapa),
+        "comuna": por_id(comuna, "c"),
+    }
+
+
+def facetas(qs, params) -> dict:
+    k = clave(params)
+    datos = cache.get(k)
+    if datos is None:
+        datos = calcular(qs)
+        cache.set(k, datos, _ttl())
+    return datos
@@ -0,0 +1,66 @@
+# market/favoritos.py
+"""
+Favoritos por usuario.
+
+- El conjunto de ids favoritos de cada usuario se cachea (una consulta al
+  fallar); con él se responden los "¿cuáles de estos N son favoritos?" y el
+  flag `is_favorito` del catálogo sin una consulta por card.
+- Agregar/quitar van en lote: un INSERT IGNORE (ux_favorito_usuario_libro) y
+  un DELETE ... IN; el caché del usuario se borra tras el commit y los
+  cambios se avisan al grafo de coincidencias.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import coincidencias
+from .models import Favorito, Libro
+
+FAVORITOS_LOTE_MAX = 100
+
+
+def _clave(usuario_id: int) -> str:
+    return f"favoritos:{usuario_id}"
+
+
+def ids_de(usuario_id: int) -> frozenset:
+    ids = cache.get(_clave(usuario_id))
+    if ids is None:
+        ids = frozenset(Favorito.objects.filter(id_usuario_id=usuario_id)
+                        .values_list("id_libro_id", flat=True))
+        cache.set(_clave(usuario_id), ids, getattr(settings, "FAVORITOS_TTL", 600))
+    return ids
+
+
+def _invalidar(usuario_id: int) -> None:
+    transaction.on_commit(lambda: cache.delete(_clave(usuario_id)))
+
+
+def cambiar(usuario_id: int, agregar, quitar) -> dict:
+    """
+    Devuelve {"agregados", "quitados", "invalidos"}. Inválidos: libros que no
+    existen o son del mismo usuario (no se marcan los propios).
+    """
+    agregar, quitar = set(agregar) - set(quitar), set(quitar)
+    with transaction.atomic():
+        validos = set(Libro.objects.filter(pk__in=agregar).exclude(id_usuario_id=usuario_id)
+                      .values_list("pk", flat=True))
+        actuales = set(Favorito.objects.filter(id_usuario_id=usuario_id, id_libro_id__in=agregar | quitar)
+                       .values_list("id_libro_id", flat=True))
+
+        nuevos = sorted(validos - actuales)
+        if nuevos:
+            Favorito.objects.bulk_create(
+                [Favorito(id_usuario_id=usuario_id, id_libro_id=l) for l in nuevos],
+                ignore_conflicts=True,
+            )
+        quitados = sorted(quitar & actuales)
+        if quitados:
+            Favorito.objects.filter(id_usuario_id=usuario_id, id_libro_id__in=quitados).delete()
+
+        if nuevos or quitados:
+            _invalidar(usuario_id)
+            coincidencias.favoritos_cambiados(usuario_id, nuevos, True)
+            coincidencias.favoritos_cambiados(usuario_id, quitados, False)
+
+    return {"agregados": nuevos, "quitados": quitados, "invalidos": sorted(agregar - validos)}
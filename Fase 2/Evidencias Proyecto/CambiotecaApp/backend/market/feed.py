@@ -0,0 +1,87 @@
+# market/feed.py
+"""
+Caché del feed de inicio (`GET libros/latest/`), la primera llamada de la app.
+
+- Se guarda ya serializado en el caché de Django (Redis entre workers en
+  producción, LocMem local) con un TTL de respaldo (FEED_LATEST_TTL).
+- Las escrituras que pueden cambiarlo (crear/editar/eliminar libro y toda
+  transición que pasa por publicacion.recalcular) solo borran la clave
+  después del commit: nada de reconstruir en el hilo del que escribe. De
+  paso invalidan los conteos de facetas (market/facetas.py).
+- Cuando está frío (tras un cambio, TTL vencido, reinicio), las lecturas
+  concurrentes no van todas a la BD: un lock por proceso más un `cache.add`
+  como lock entre workers; el resto espera un momento y lee lo que dejó el
+  que construyó.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import facetas
+from .constants import LIBRO_PUBLICACION
+from .models import Libro
+from .serializers import LibroSerializer
+
+FEED_N = 10
+FEED_CLAVE = "feed:latest"
+FEED_LOCK = "feed:latest:lock"
+FEED_LOCK_TTL = 10          # segundos; por si el que construye muere sin soltarlo
+FEED_ESPERA = (0.05, 40)    # (intervalo, intentos) leyendo mientras otro construye
+
+_lock = threading.Lock()
+
+
+def _ttl() -> int:
+    return getattr(settings, "FEED_LATEST_TTL", 300)
+
+
+def construir() -> list:
+    qs = (Libro.objects
+          .select_related("id_usuario", "id_genero")
+          .filter(estado_publicacion=LIBRO_PUBLICACION["DISPONIBLE"])  # usa ix_libro_publicacion
+          .order_by("-fecha_subida", "-id_libro")[:FEED_N])
+    return list(LibroSerializer(qs, many=True).data)
+
+
+def refrescar() -> list:
+    datos = construir()
+    cache.set(FEED_CLAVE, datos, _ttl())
+    return datos
+
+
+def latest() -> list:
+    datos = cache.get(FEED_CLAVE)
+    if datos is not None:
+        return datos
+
+    with _lock:  # un solo hilo por proceso llega hasta acá
+        datos = cache.get(FEED_CLAVE)
+        if datos is not None:
+            return datos
+        if cache.add(FEED_LOCK, 1, FEED_LOCK_TTL):
+            try:
+                return refrescar()
+            finally:
+                cache.delete(FEED_LOCK)
+
+        # otro worker lo está construyendo
+        intervalo, intentos = FEED_ESPERA
+        for _ in range(intentos):
+            time.sleep(intervalo)
+            datos = cache.get(FEED_CLAVE)
+            if datos is not None:
+                return datos
+        return construir()  # se demoró demasiado: mejor responder igual
+
+
+def _borrar():
+    cache.delete(FEED_CLAVE)
+
+
+def invalidar() -> None:
+    """Borra el feed cuando la transacción actual se confirme; lo reconstruye la próxima lectura."""
+    transaction.on_commit(_borrar)
+    facetas.invalidar()
@@ -0,0 +1,168 @@
+# market/libro_borrado.py
+"""
+Borrado de un libro y su cascada, en pocas sentencias por conjunto.
+
+1. Bloquea la fila del libro y re-verifica que no esté en un intercambio
+   Completado (dentro de la transacción, no antes).
+2. Un solo UPDATE ... CASE decide el nuevo estado de todas las solicitudes
+   afectadas (donde el libro fue el aceptado o el deseado).
+3. Un DELETE para los intercambios activos, uno para favoritos/vistas y uno
+   para las filas de imagen.
+4. Los archivos se borran fuera de la transacción, en la cola
+   (market.borrar_archivos): el tiempo con locks ya no depende de cuántas
+   imágenes hay ni de la latencia del disco.
+
+El endpoint marca `libro.eliminado_en` (soft-delete) y cierra en la misma
+transacción sus solicitudes e intercambios abiertos; el purgador (`purgar_eliminados`, comando purgar_libros) corre `borrar_libro`
+libro por libro en horas de poco tráfico.
+"""
+import logging
+import time
+
+from django.db import transaction
+from django.db.models import Case, Q, Value, When
+from django.utils import timezone
+
+from .constants import INTERCAMBIO_ESTADO, LIBRO_PUBLICACION, SOLICITUD_ESTADO
+from .models import (
+    Favorito, ImagenLibro, Intercambio, Libro, LibroSolicitudesVistas, SolicitudIntercambio,
+)
+from . import chat_archivo, coincidencias
+from .publicacion import intercambiado, libros_de_intercambios, recalcular
+from .tareas import borrar_archivos
+
+logger = logging.getLogger(__name__)
+
+INTER_ACTIVOS = [INTERCAMBIO_ESTADO["ACEPTADO"], INTERCAMBIO_ESTADO["PENDIENTE"]]
+SOL_ACTIVAS = [SOLICITUD_ESTADO["ACEPTADA"], SOLICITUD_ESTADO["PENDIENTE"]]
+
+
+class LibroEnIntercambioCompletado(Exception):
+    pass
+
+
+def _cancelar_dependencias(libro_id: int) -> None:
+    """
+    Cancela/rechaza las solicitudes activas que dependen del libro, borra sus
+    intercambios activos y recalcula los libros de la contraparte. Llamar
+    dentro de la transacción, con la fila del libro ya bloqueada.
+    """
+    ahora = timezone.now()
+    inter_libro = Intercambio.objects.filter(
+        id_libro_ofrecido_aceptado_id=libro_id, estado_intercambio__in=INTER_ACTIVOS,
+    )
+
+    # solicitudes afectadas, bloqueadas en una sola lectura
+    filas = list(
+        SolicitudIntercambio.objects.select_for_update()
+        .filter(Q(pk__in=inter_libro.values("id_solicitud_id")) |
+                Q(id_libro_deseado_id=libro_id, estado__in=SOL_ACTIVAS))
+        .values_list("pk", "id_libro_deseado_id", "estado")
+    )
+    if not filas:
+        return
+    sol_ids = [pk for pk, _, _ in filas]
+    sol_deseado = [pk for pk, deseado, est in filas if deseado == libro_id and est in SOL_ACTIVAS]
+
+    # el libro fue el ACEPTADO: Aceptado -> Cancelada, Pendiente -> Rechazada
+    # el libro es el DESEADO:   Aceptada -> Cancelada, Pendiente -> Rechazada
+    SolicitudIntercambio.objects.filter(pk__in=sol_ids).update(
+        estado=Case(
+            When(pk__in=inter_libro.filter(estado_intercambio=INTERCAMBIO_ESTADO["ACEPTADO"])
+                                   .values("id_solicitud_id"),
+                 then=Value(SOLICITUD_ESTADO["CANCELADA"])),
+            When(pk__in=inter_libro.filter(estado_intercambio=INTERCAMBIO_ESTADO["PENDIENTE"])
+                                   .values("id_solicitud_id"),
+                 then=Value(SOLICITUD_ESTADO["RECHAZADA"])),
+            When(estado=SOLICITUD_ESTADO["ACEPTADA"], then=Value(SOLICITUD_ESTADO["CANCELADA"])),
+            default=Value(SOLICITUD_ESTADO["RECHAZADA"]),
+        ),
+        actualizada_en=ahora,
+    )
+    borrados = Intercambio.objects.filter(
+        Q(id_libro_ofrecido_aceptado_id=libro_id, estado_intercambio__in=INTER_ACTIVOS) |
+        Q(id_solicitud_id__in=sol_deseado)
+    ).exclude(estado_intercambio=INTERCAMBIO_ESTADO["COMPLETADO"])
+    # los otros libros de esos intercambios pueden volver a quedar disponibles
+    otros = libros_de_intercambios(borrados) - {libro_id}
+    chat_archivo.borrar_de_intercambios(borrados.values("pk"))
+    borrados.delete()
+    recalcular(otros)
+
+
+def borrar_libro(libro_id: int) -> bool:
+    """
+    Borra el libro y cancela/rechaza lo que dependía de él.
+    False si no existe; LibroEnIntercambioCompletado si no se puede borrar.
+    """
+    with transaction.atomic():
+        if not Libro.todos.select_for_update().filter(pk=libro_id).exists():
+            return False
+        if intercambiado(libro_id):
+            raise LibroEnIntercambioCompletado()
+
+        _cancelar_dependencias(libro_id)
+
+        # dependencias sin CASCADE
+        Favorito.objects.filter(id_libro_id=libro_id).delete()
+        LibroSolicitudesVistas.objects.filter(id_libro_id=libro_id).delete()
+
+        imagenes = ImagenLibro.objects.filter(id_libro_id=libro_id)
+        rutas = [r.replace("\\", "/") for r in imagenes.values_list("url_imagen", flat=True) if r]
+        imagenes.delete()
+
+        Libro.todos.filter(pk=libro_id).delete()
+        coincidencias.libros_cambiados([libro_id])  # sus favoritos ya no existen
+
+        if rutas:
+            # se inserta en esta misma transacción: solo corre si el borrado se confirma
+            borrar_archivos.encolar(rutas=rutas)
+    return True
+
+
+def marcar_eliminado(libro_id: int) -> bool:
+    """
+    Soft-delete: desde ya el catálogo no lo muestra (Libro.objects). Las
+    solicitudes e intercambios abiertos se cierran en el acto, como en
+    `borrar_libro` (no quedan negociaciones vivas por un libro retirado);
+    imágenes, favoritos y la fila misma quedan para el purgador.
+    """
+    with transaction.atomic():
+        if not Libro.objects.select_for_update().filter(pk=libro_id).exists():
+            return False
+        # con la fila bloqueada: completar un intercambio recalcula el libro
+        # (UPDATE de esta fila), así que no puede confirmarse entre medio
+        if intercambiado(libro_id):
+            raise LibroEnIntercambioCompletado()
+
+        _cancelar_dependencias(libro_id)
+        Libro.objects.filter(pk=libro_id).update(
+            eliminado_en=timezone.now(), estado_publicacion=LIBRO_PUBLICACION["RETIRADO"],
+        )
+        coincidencias.libros_cambiados([libro_id])
+    return True
+
+
+def purgar_eliminados(lote: int = 20, pausa: float = 0.2) -> int:
+    """
+    Borra de verdad hasta `lote` libros marcados. Una transacción corta por libro
+    y una pausa entre ellos para no competir con el tráfico.
+    """
+    ids = list(
+        Libro.todos.filter(eliminado_en__isnull=False)
+        # quedan marcados: su historial se conserva
+        .exclude(estado_publicacion=LIBRO_PUBLICACION["INTERCAMBIADO"])
+        .order_by("eliminado_en")
+        .values_list("pk", flat=True)[:lote]
+    )
+    borrados = 0
+    for i, libro_id in enumerate(ids):
+        if i and pausa:
+            time.sleep(pausa)
+        try:
+            borrados += borrar_libro(libro_id)
+        except LibroEnIntercambioCompletado:
+            pass
+        except Exception:
+            logger.exception("No se pudo purgar el libro %s", libro_id)
+    return borrados
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from market.chat_archivo import archivar_conversacion, borrar_huerfanos, conversaciones_archivables
+
+
+class Command(BaseCommand):
+    help = "Mueve al archivo frío los chats de intercambios Completados/Cancelados hace más de N días."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dias", type=int, default=getattr(settings, "CHAT_ARCHIVO_DIAS", 90))
+        parser.add_argument("--lote", type=int, default=200, help="Máximo de conversaciones por ejecución.")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        ids = list(conversaciones_archivables(opts["dias"])[:opts["lote"]])
+        if opts["dry_run"]:
+            self.stdout.write(f"{len(ids)} conversaciones archivables: {ids}")
+            return
+
+        total = 0
+        for cid in ids:
+            # una transacción corta por conversación: no bloquea la tabla completa
+            total += archivar_conversacion(cid)
+        self.stdout.write(self.style.SUCCESS(f"Archivadas {len(ids)} conversaciones ({total} mensajes)."))
+        huerfanos = borrar_huerfanos()
+        if huerfanos:
+            self.stdout.write(f"Borrados {huerfanos} archivos de conversaciones que ya no existen.")
@@ -0,0 +1,62 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from market.coincidencias import GrafoDeseos
+
+
+class Command(BaseCommand):
+    help = ("Mide el grafo de coincidencias con datos sintéticos en memoria (no usa la BD): "
+            "construcción, aplicación de un lote de eventos y consultas por usuario.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--usuarios", type=int, default=100_000)
+        parser.add_argument("--libros", type=int, default=3, help="Libros publicados por usuario.")
+        parser.add_argument("--favoritos", type=int, default=8, help="Favoritos por usuario.")
+        parser.add_argument("--eventos", type=int, default=10_000, help="Eventos en el lote incremental.")
+        parser.add_argument("--consultas", type=int, default=2_000)
+        parser.add_argument("--semilla", type=int, default=1)
+
+    def handle(self, *args, **o):
+        rnd = random.Random(o["semilla"])
+        n_libros = o["usuarios"] * o["libros"]
+        dueno = [i // o["libros"] for i in range(n_libros)]
+
+        t = time.perf_counter()
+        g = GrafoDeseos()
+        for libro_id, u in enumerate(dueno):
+            g.libro(libro_id, u)
+        for u in range(o["usuarios"]):
+            for libro_id in rnd.sample(range(n_libros), o["favoritos"]):
+                g.favorito(u, libro_id, True)
+        self.stdout.write(f"construcción: {time.perf_counter() - t:.2f} s "
+                          f"({n_libros} libros, {o['usuarios'] * o['favoritos']} favoritos, "
+                          f"{sum(len(c) for c in g.salientes.values())} aristas)")
+
+        eventos = []
+        for _ in range(o["eventos"]):
+            if rnd.random() < 0.7:
+                eventos.append(("fav", rnd.randrange(o["usuarios"]), rnd.randrange(n_libros), rnd.random() < 0.6))
+            else:
+                libro_id = rnd.randrange(n_libros)
+                eventos.append(("libro", libro_id, dueno[libro_id] if rnd.random() < 0.5 else None))
+        t = time.perf_counter()
+        g.aplicar(eventos)
+        self.stdout.write(f"lote de {len(eventos)} eventos: {(time.perf_counter() - t) * 1000:.1f} ms")
+
+        tiempos, directos, ciclos = [], 0, 0
+        for _ in range(o["consultas"]):
+            u = rnd.randrange(o["usuarios"])
+            t = time.perf_counter()
+            d, c = g.directos(u), g.ciclos(u)
+            tiempos.append((time.perf_counter() - t) * 1000)
+            directos += len(d)
+            ciclos += len(c)
+        tiempos.sort()
+        self.stdout.write(
+            f"consulta por usuario: p50 {statistics.median(tiempos):.3f} ms, "
+            f"p99 {tiempos[int(len(tiempos) * 0.99) - 1]:.3f} ms, máx {tiempos[-1]:.3f} ms "
+            f"({directos} directos y {ciclos} ciclos en {o['consultas']} usuarios)"
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from market.libro_borrado import purgar_eliminados
+from market.models import Libro
+
+
+class Command(BaseCommand):
+    help = ("Borra definitivamente los libros eliminados (soft-delete) con sus dependencias "
+            "e imágenes, en lotes chicos. Pensado para cron en horas de poco tráfico.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lote", type=int, default=20, help="Libros por lote.")
+        parser.add_argument("--pausa", type=float, default=0.2, help="Segundos entre libros.")
+        parser.add_argument("--max", type=int, default=500, help="Máximo de libros por ejecución.")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        if opts["dry_run"]:
+            n = Libro.todos.filter(eliminado_en__isnull=False).count()
+            self.stdout.write(f"{n} libros marcados como eliminados.")
+            return
+
+        total = 0
+        while total < opts["max"]:
+            n = purgar_eliminados(min(opts["lote"], opts["max"] - total), opts["pausa"])
+            if not n:
+                break
+            total += n
+        self.stdout.write(self.style.SUCCESS(f"Purgados {total} libros."))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from market.models import Libro
+from market.publicacion import recalcular
+
+
+class Command(BaseCommand):
+    help = ("Recalcula libro.estado_publicacion desde los intercambios, en lotes por id. "
+            "Para reparar desvíos si algo cambió intercambios por fuera de la app "
+            "(SQL manual, procedimientos almacenados).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lote", type=int, default=1000, help="Libros por UPDATE.")
+
+    def handle(self, *args, **opts):
+        antes = dict(Libro.todos.values_list("pk", "estado_publicacion"))
+        ids = sorted(antes)
+        for i in range(0, len(ids), opts["lote"]):
+            with transaction.atomic():
+                recalcular(ids[i:i + opts["lote"]])
+
+        cambiados = sum(1 for pk, est in Libro.todos.values_list("pk", "estado_publicacion")
+                        if antes.get(pk) != est)
+        self.stdout.write(self.style.SUCCESS(f"{len(ids)} libros revisados, {cambiados} corregidos."))
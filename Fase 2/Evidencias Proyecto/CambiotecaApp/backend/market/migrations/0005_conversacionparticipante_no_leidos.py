@@ -0,0 +1,37 @@
+# Tabla no administrada por Django: la columna se agrega con SQL directo (MySQL).
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0004_librosolicitudesvistas'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE conversacion_participante "
+                "ADD COLUMN no_leidos INT UNSIGNED NOT NULL DEFAULT 0",
+                # índice cubriente para SUM(no_leidos) por usuario (badge del app)
+                "CREATE INDEX ix_cp_usuario_no_leidos "
+                "ON conversacion_participante (id_usuario, archivado, no_leidos)",
+                # backfill: mensajes del otro posteriores al último visto
+                """
+                UPDATE conversacion_participante p
+                SET p.no_leidos = (
+                    SELECT COUNT(*)
+                    FROM conversacion_mensaje m
+                    WHERE m.id_conversacion = p.id_conversacion
+                      AND m.id_mensaje > COALESCE(p.ultimo_visto_id_mensaje, 0)
+                      AND m.id_usuario_emisor <> p.id_usuario
+                )
+                """,
+            ],
+            reverse_sql=[
+                "DROP INDEX ix_cp_usuario_no_leidos ON conversacion_participante",
+                "ALTER TABLE conversacion_participante DROP COLUMN no_leidos",
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Tabla no administrada por Django: columna e índice con SQL directo (MySQL).
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0005_conversacionparticipante_no_leidos'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE conversacion_mensaje "
+                "ADD COLUMN clave_idempotencia VARCHAR(64) NULL",
+                # NULLs no chocan entre sí: mensajes sin clave siguen funcionando
+                "CREATE UNIQUE INDEX ux_cm_emisor_clave "
+                "ON conversacion_mensaje (id_conversacion, id_usuario_emisor, clave_idempotencia)",
+            ],
+            reverse_sql=[
+                "DROP INDEX ux_cm_emisor_clave ON conversacion_mensaje",
+                "ALTER TABLE conversacion_mensaje DROP COLUMN clave_idempotencia",
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0006_conversacionmensaje_clave_idempotencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversacionArchivo',
+            fields=[
+                ('id_conversacion', models.IntegerField(db_column='id_conversacion', primary_key=True, serialize=False)),
+                ('mensajes', models.BinaryField()),
+                ('total_mensajes', models.PositiveIntegerField(default=0)),
+                ('ultimo_id_mensaje', models.IntegerField(default=0)),
+                ('ultimo_mensaje', models.TextField(blank=True, null=True)),
+                ('archivado_en', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'conversacion_archivo',
+            },
+        ),
+    ]
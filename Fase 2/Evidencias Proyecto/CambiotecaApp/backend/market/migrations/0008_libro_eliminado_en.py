@@ -0,0 +1,27 @@
+# Tabla no administrada por Django: columna e índices con SQL directo (MySQL).
+# MySQL no tiene índices parciales (WHERE eliminado_en IS NULL): se usan
+# índices compuestos que empiezan por las columnas del filtro. El del catálogo
+# es ix_libro_publicacion (0011).
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0007_conversacionarchivo'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE libro ADD COLUMN eliminado_en DATETIME(6) NULL",
+                # purga: eliminado_en IS NOT NULL AND eliminado_en < ?
+                "CREATE INDEX ix_libro_eliminado ON libro (eliminado_en)",
+            ],
+            reverse_sql=[
+                "DROP INDEX ix_libro_eliminado ON libro",
+                "ALTER TABLE libro DROP COLUMN eliminado_en",
+            ],
+        ),
+    ]
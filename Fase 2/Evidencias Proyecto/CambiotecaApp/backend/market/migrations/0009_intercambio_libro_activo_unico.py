@@ -0,0 +1,27 @@
+# Tabla no administrada por Django: columna generada e índice con SQL directo (MySQL).
+# Emula un índice único parcial (UNIQUE ... WHERE estado_intercambio = 'Aceptado'):
+# la columna vale NULL salvo en intercambios aceptados, y los NULL no chocan.
+# Si hoy hay dos intercambios 'Aceptado' con el mismo libro, resolverlos antes de migrar.
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0008_libro_eliminado_en'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE intercambio ADD COLUMN libro_aceptado_activo INT "
+                "GENERATED ALWAYS AS (IF(estado_intercambio = 'Aceptado', id_libro_ofrecido_aceptado, NULL)) VIRTUAL",
+                "CREATE UNIQUE INDEX ux_intercambio_libro_activo ON intercambio (libro_aceptado_activo)",
+            ],
+            reverse_sql=[
+                "DROP INDEX ux_intercambio_libro_activo ON intercambio",
+                "ALTER TABLE intercambio DROP COLUMN libro_aceptado_activo",
+            ],
+        ),
+    ]
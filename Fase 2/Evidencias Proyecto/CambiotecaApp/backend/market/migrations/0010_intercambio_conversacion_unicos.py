@@ -0,0 +1,26 @@
+# Tablas no administradas por Django: índices únicos con SQL directo (MySQL).
+# aceptar_solicitud crea intercambio/conversación/participantes con INSERT IGNORE
+# (bulk_create(ignore_conflicts=True)); estas claves lo hacen idempotente.
+# Si hoy hay duplicados (dos intercambios por solicitud), resolverlos antes de migrar.
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0009_intercambio_libro_activo_unico'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "CREATE UNIQUE INDEX ux_intercambio_solicitud ON intercambio (id_solicitud)",
+                "CREATE UNIQUE INDEX ux_conversacion_intercambio ON conversacion (id_intercambio)",
+            ],
+            reverse_sql=[
+                "DROP INDEX ux_conversacion_intercambio ON conversacion",
+                "DROP INDEX ux_intercambio_solicitud ON intercambio",
+            ],
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Tabla no administrada por Django: columna, carga inicial e índice con SQL directo (MySQL).
+# El UPDATE aplica la misma precedencia que market/publicacion.py.
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0010_intercambio_conversacion_unicos'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE libro ADD COLUMN estado_publicacion VARCHAR(15) NOT NULL DEFAULT 'disponible'",
+                """
+                UPDATE libro l SET l.estado_publicacion = CASE
+                    WHEN EXISTS (
+                        SELECT 1 FROM intercambio i
+                        JOIN solicitud_intercambio s ON s.id_solicitud = i.id_solicitud
+                        WHERE i.estado_intercambio = 'Completado'
+                          AND (i.id_libro_ofrecido_aceptado = l.id_libro OR s.id_libro_deseado = l.id_libro)
+                    ) THEN 'intercambiado'
+                    WHEN l.eliminado_en IS NOT NULL OR l.disponible = 0 THEN 'retirado'
+                    WHEN EXISTS (
+                        SELECT 1 FROM intercambio i
+                        JOIN solicitud_intercambio s ON s.id_solicitud = i.id_solicitud
+                        WHERE i.estado_intercambio IN ('Pendiente', 'Aceptado')
+                          AND (i.id_libro_ofrecido_aceptado = l.id_libro OR s.id_libro_deseado = l.id_libro)
+                    ) THEN 'en_negociacion'
+                    ELSE 'disponible'
+                END
+                """,
+                # catálogo: estado_publicacion = 'disponible' AND eliminado_en IS NULL ORDER BY fecha_subida
+                "CREATE INDEX ix_libro_publicacion ON libro (estado_publicacion, eliminado_en, fecha_subida)",
+            ],
+            reverse_sql=[
+                "DROP INDEX ix_libro_publicacion ON libro",
+                "ALTER TABLE libro DROP COLUMN estado_publicacion",
+            ],
+        ),
+    ]
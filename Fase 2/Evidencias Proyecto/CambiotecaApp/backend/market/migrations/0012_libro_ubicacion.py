@@ -0,0 +1,33 @@
+# Tabla no administrada por Django: columnas, carga inicial e índices con SQL directo (MySQL).
+# id_comuna / id_region son copia de usuario.comuna_id -> comuna.id_region del dueño.
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0011_libro_estado_publicacion'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE libro ADD COLUMN id_comuna INT NULL, ADD COLUMN id_region INT NULL",
+                """
+                UPDATE libro l
+                JOIN usuario u ON u.id_usuario = l.id_usuario
+                JOIN comuna c ON c.id_comuna = u.comuna_id
+                SET l.id_comuna = c.id_comuna, l.id_region = c.id_region
+                """,
+                # catálogo por zona: id_region/id_comuna = ? AND estado_publicacion = ? ORDER BY fecha_subida
+                "CREATE INDEX ix_libro_region ON libro (id_region, estado_publicacion, eliminado_en, fecha_subida)",
+                "CREATE INDEX ix_libro_comuna ON libro (id_comuna, estado_publicacion, eliminado_en, fecha_subida)",
+            ],
+            reverse_sql=[
+                "DROP INDEX ix_libro_comuna ON libro",
+                "DROP INDEX ix_libro_region ON libro",
+                "ALTER TABLE libro DROP COLUMN id_region, DROP COLUMN id_comuna",
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Tabla no administrada por Django: índice único con SQL directo (MySQL).
+# Los favoritos se agregan en lote con INSERT IGNORE (bulk_create(ignore_conflicts=True));
+# antes se borran los duplicados que pudiera haber (queda el más antiguo).
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0012_libro_ubicacion'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """
+                DELETE f1 FROM favorito f1
+                JOIN favorito f2 ON f2.id_usuario = f1.id_usuario
+                                AND f2.id_libro = f1.id_libro
+                                AND f2.id_favorito < f1.id_favorito
+                """,
+                "CREATE UNIQUE INDEX ux_favorito_usuario_libro ON favorito (id_usuario, id_libro)",
+            ],
+            reverse_sql=[
+                "DROP INDEX ux_favorito_usuario_libro ON favorito",
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Tabla no administrada por Django: columna e índice con SQL directo (MySQL).
+# `lote` identifica las filas de un mismo INSERT múltiple para leer sus ids
+# de vuelta (views._crear_solicitudes); las solicitudes antiguas quedan en NULL.
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0013_favorito_unico'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE solicitud_intercambio ADD COLUMN lote CHAR(32) NULL",
+                "CREATE INDEX ix_solicitud_lote ON solicitud_intercambio (lote)",
+            ],
+            reverse_sql=[
+                "DROP INDEX ix_solicitud_lote ON solicitud_intercambio",
+                "ALTER TABLE solicitud_intercambio DROP COLUMN lote",
+            ],
+        ),
+    ]
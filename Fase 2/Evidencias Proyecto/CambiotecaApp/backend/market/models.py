@@ -2,7 +2,7 @@
 
 from django.db import models
 from rest_framework import serializers
-from .constants import SOLICITUD_ESTADO, INTERCAMBIO_ESTADO
+from .constants import SOLICITUD_ESTADO, INTERCAMBIO_ESTADO, LIBRO_PUBLICACION
 from django.utils import timezone
 
 class Genero(models.Model):
@@ -19,6 +19,12 @@ class Genero(models.Model):
 # Referencias entre apps por string:
 # 'core.Usuario', 'market.Libro'
 
+class LibroManager(models.Manager):
+    """Oculta los libros eliminados (soft-delete) en todas las consultas del catálogo."""
+    def get_queryset(self):
+        return super().get_queryset().filter(eliminado_en__isnull=True)
+
+
 class Libro(models.Model):
     id_libro = models.AutoField(primary_key=True)
     titulo = models.CharField(max_length=255)
@@ -31,6 +37,14 @@ class Libro(models.Model):
     tipo_tapa = models.CharField(max_length=20)            # Enum en BD; aquí CharField
     disponible = models.BooleanField(default=True)
     fecha_subida = models.DateTimeField(db_column='fecha_subida', auto_now_add=False)
+    # soft-delete: lo borra de verdad el purgador (python manage.py purgar_libros)
+    eliminado_en = models.DateTimeField(null=True, blank=True, db_column='eliminado_en')
+    # derivado de disponible/eliminado_en/intercambios; lo mantiene market.publicacion
+    estado_publicacion = models.CharField(
+        max_length=15,
+        default=LIBRO_PUBLICACION["DISPONIBLE"],
+        choices=[(v, v) for v in LIBRO_PUBLICACION.values()],
+    )
 
     id_usuario = models.ForeignKey(
         'core.Usuario', db_column='id_usuario',
@@ -40,6 +54,19 @@ class Libro(models.Model):
         'market.Genero', db_column='id_genero',
         on_delete=models.RESTRICT, related_name='libros'
     )
+    # ubicación del dueño copiada al libro (filtros por zona sin join);
+    # la mantiene market.ubicacion.sincronizar_usuario
+    id_comuna = models.ForeignKey(
+        'core.Comuna', db_column='id_comuna', null=True, blank=True,
+        on_delete=models.DO_NOTHING, db_constraint=False, related_name='libros'
+    )
+    id_region = models.ForeignKey(
+        'core.Region', db_column='id_region', null=True, blank=True,
+        on_delete=models.DO_NOTHING, db_constraint=False, related_name='libros'
+    )
+
+    objects = LibroManager()
+    todos = models.Manager()  # incluye eliminados (purgador)
 
     class Meta:
         db_table = 'libro'
@@ -215,6 +242,8 @@ class ConversacionParticipante(models.Model):
     archivado = models.BooleanField(default=False)
     ultimo_visto_id_mensaje = models.IntegerField(default=0, db_column='ultimo_visto_id_mensaje')
     visto_en = models.DateTimeField(null=True, blank=True)
+    # contador real de no leídos: +1 en enviar_mensaje, 0 en marcar_visto
+    no_leidos = models.PositiveIntegerField(default=0, db_column='no_leidos')
 
     class Meta:
         db_table = 'conversacion_participante'
@@ -236,12 +265,28 @@ class ConversacionMensaje(models.Model):
     enviado_en = models.DateTimeField(db_column='enviado_en')
     editado_en = models.DateTimeField(db_column='editado_en', null=True, blank=True)
     eliminado = models.BooleanField(default=False)
+    # id generado por el cliente: reintentos del móvil no duplican mensajes
+    clave_idempotencia = models.CharField(max_length=64, null=True, blank=True, db_column='clave_idempotencia')
 
     class Meta:
         db_table = 'conversacion_mensaje'
         managed = False
 
 
+class ConversacionArchivo(models.Model):
+    # Archivo frío de chats de intercambios cerrados (ver market/chat_archivo.py).
+    # Sin FK a 'conversacion' (tabla no administrada): la PK es el mismo id.
+    id_conversacion = models.IntegerField(primary_key=True, db_column='id_conversacion')
+    mensajes = models.BinaryField()                         # JSON comprimido (zlib)
+    total_mensajes = models.PositiveIntegerField(default=0)
+    ultimo_id_mensaje = models.IntegerField(default=0)
+    ultimo_mensaje = models.TextField(null=True, blank=True)  # para la lista de chats
+    archivado_en = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'conversacion_archivo'
+
+
 class SolicitudIntercambio(models.Model):
     id_solicitud = models.AutoField(primary_key=True)
     id_usuario_solicitante = models.ForeignKey('core.Usuario', db_column='id_usuario_solicitante',
@@ -266,6 +311,8 @@ class SolicitudIntercambio(models.Model):
     fecha_completado = models.DateTimeField(null=True, blank=True)
     creada_en = models.DateTimeField(null=True, blank=True)
     actualizada_en = models.DateTimeField(null=True, blank=True)
+    # token del INSERT múltiple que la creó (MySQL no devuelve los ids del lote)
+    lote = models.CharField(max_length=32, null=True, blank=True, db_column='lote')
 
     class Meta:
         db_table = 'solicitud_intercambio'
@@ -0,0 +1,71 @@
+# market/publicacion.py
+"""
+Estado de publicación de un libro, guardado en `libro.estado_publicacion`.
+
+Antes se calculaba en cada consulta (EXISTS sobre intercambio por fila). Ahora
+es una columna indexada que se recalcula, en la misma transacción, cada vez
+que cambia algo de lo que depende:
+
+    intercambiado   hay un intercambio Completado (en cualquier rol)
+    retirado        eliminado (soft-delete) o disponible = False
+    en_negociacion  hay un intercambio Pendiente/Aceptado (en cualquier rol)
+    disponible      el resto
+
+(en ese orden de precedencia; el UPDATE de la migración 0011 usa el mismo).
+"""
+from django.db.models import Case, Exists, OuterRef, Q, Value, When
+
+from . import coincidencias, feed
+from .constants import INTERCAMBIO_ESTADO, LIBRO_PUBLICACION
+from .models import Intercambio, Libro
+
+# se puede ofrecer/pedir (aunque esté en negociación: eso lo decide quien llama)
+PUBLICADOS = (LIBRO_PUBLICACION["DISPONIBLE"], LIBRO_PUBLICACION["EN_NEGOCIACION"])
+
+
+def _intercambio_con(estados):
+    return Exists(
+        Intercambio.objects
+        .filter(estado_intercambio__in=estados)
+        .filter(Q(id_libro_ofrecido_aceptado_id=OuterRef("pk")) |
+                Q(id_solicitud__id_libro_deseado_id=OuterRef("pk")))
+    )
+
+
+def _estado_derivado():
+    return Case(
+        When(_intercambio_con([INTERCAMBIO_ESTADO["COMPLETADO"]]),
+             then=Value(LIBRO_PUBLICACION["INTERCAMBIADO"])),
+        When(Q(eliminado_en__isnull=False) | Q(disponible=False),
+             then=Value(LIBRO_PUBLICACION["RETIRADO"])),
+        When(_intercambio_con([INTERCAMBIO_ESTADO["PENDIENTE"], INTERCAMBIO_ESTADO["ACEPTADO"]]),
+             then=Value(LIBRO_PUBLICACION["EN_NEGOCIACION"])),
+        default=Value(LIBRO_PUBLICACION["DISPONIBLE"]),
+    )
+
+
+def recalcular(libro_ids) -> int:
+    """Un UPDATE para todos los libros tocados por una transición (llamar dentro de ella)."""
+    ids = {int(i) for i in libro_ids if i}
+    if not ids:
+        return 0
+    feed.invalidar()
+    coincidencias.libros_cambiados(ids)
+    return Libro.todos.filter(pk__in=ids).update(estado_publicacion=_estado_derivado())
+
+
+def libros_de_intercambios(intercambios) -> set:
+    """Ids de ambos libros (deseado y aceptado) de un queryset de Intercambio."""
+    ids = set()
+    for deseado, aceptado in intercambios.values_list(
+        "id_solicitud__id_libro_deseado_id", "id_libro_ofrecido_aceptado_id"
+    ):
+        ids.update((deseado, aceptado))
+    ids.discard(None)
+    return ids
+
+
+def intercambiado(libro_id: int) -> bool:
+    return Libro.todos.filter(
+        pk=libro_id, estado_publicacion=LIBRO_PUBLICACION["INTERCAMBIADO"]
+    ).exists()
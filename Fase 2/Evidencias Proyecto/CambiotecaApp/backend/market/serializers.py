@@ -20,6 +20,11 @@ class LibroSerializer(serializers.ModelSerializer):
     # Mostrar PK del género y su nombre
     id_genero = serializers.IntegerField(source='id_genero_id', read_only=True)
     genero_nombre = serializers.SerializerMethodField()
+    # zona del dueño (copiada en el libro)
+    id_comuna = serializers.IntegerField(source='id_comuna_id', read_only=True)
+    id_region = serializers.IntegerField(source='id_region_id', read_only=True)
+    # solo si la vista pasa context["favoritos"] (ids del usuario); si no, null
+    is_favorito = serializers.SerializerMethodField()
 
     class Meta:
         model = Libro
@@ -27,9 +32,11 @@ class LibroSerializer(serializers.ModelSerializer):
             'id', 'id_libro',
             'titulo', 'autor', 'isbn', 'anio_publicacion', 'estado',
             'editorial', 'tipo_tapa', 'descripcion',
-            'disponible', 'fecha_subida',
+            'disponible', 'estado_publicacion', 'fecha_subida',
             'owner_nombre', 'owner_id',
             'id_genero', 'genero_nombre',
+            'id_comuna', 'id_region',
+            'is_favorito',
         ]
 
     def get_owner_id(self, obj):
@@ -58,6 +65,10 @@ class LibroSerializer(serializers.ModelSerializer):
         g = getattr(obj, 'id_genero', None)
         return getattr(g, 'nombre', None) if g else None
 
+    def get_is_favorito(self, obj):
+        favoritos = self.context.get('favoritos')
+        return None if favoritos is None else obj.id_libro in favoritos
+
 
 # 👇 la dejamos igual; no rompe mientras no la instancies desde una vista.
 class LibroCreateSerializer(serializers.ModelSerializer):
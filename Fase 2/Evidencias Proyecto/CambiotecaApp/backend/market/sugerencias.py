@@ -0,0 +1,186 @@
+# market/sugerencias.py
+"""
+Autocompletado del buscador (`GET libros/suggest/?q=`) sin tocar MySQL.
+
+- Índice en memoria por proceso: títulos y autores normalizados (minúsculas,
+  sin tildes, espacios colapsados) con su peso = cuántos libros los usan.
+- Búsqueda por prefijo sobre un arreglo ordenado (bisect); cada término se
+  indexa también desde el comienzo de cada palabra ("marquez" encuentra
+  "Gabriel García Márquez"). Los prefijos cortos, que abarcan muchos
+  términos, guardan su top-k ya calculado hasta el próximo cambio (solo los
+  que encuentran algo, y a lo más CORTOS_MAX: una ráfaga de basura no llena
+  la memoria; un prefijo sin resultados sale barato igual).
+- Memoria acotada: a lo más SUGERENCIAS_MAX_TERMINOS términos; al construir se
+  quedan los de más peso y uno nuevo no entra si el índice está lleno (lo
+  considerará la próxima reconstrucción).
+- La primera consulta lanza la construcción en segundo plano (y responde
+  vacío hasta que esté lista: nunca se recorre el catálogo en el request) y
+  luego se actualiza incrementalmente al crear/editar/eliminar libros (tras
+  el commit). Como cada worker tiene su
+  propio índice, además se reconstruye en segundo plano cada
+  SUGERENCIAS_REFRESCO segundos para recoger cambios hechos en otros workers.
+"""
+import heapq
+import logging
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Libro
+
+logger = logging.getLogger(__name__)
+
+TIPOS = ("titulo", "autor")
+PREFIJO_CORTO = 3   # prefijos de hasta este largo guardan su top-k
+CORTOS_MAX = 2000   # top-k guardados (LRU); solo de prefijos con resultados
+K_MAX = 20
+
+
+def normalizar(texto) -> str:
+    s = unicodedata.normalize("NFKD", str(texto or ""))
+    s = "".join(ch for ch in s if not unicodedata.combining(ch))
+    return " ".join(s.casefold().split())
+
+
+def _sufijos(norm: str):
+    """El término completo y desde cada palabra siguiente."""
+    yield norm
+    for i, ch in enumerate(norm):
+        if ch == " ":
+            yield norm[i + 1:]
+
+
+class IndicePrefijos:
+    def __init__(self, max_terminos: int):
+        self.max_terminos = max_terminos
+        self._lock = threading.RLock()
+        self._pesos = {}      # (tipo, norm) -> [texto a mostrar, n libros]
+        self._claves = []     # ordenado: (clave de búsqueda, tipo, norm)
+        self._cortos = OrderedDict()  # prefijo corto -> top-K_MAX ya calculado (LRU)
+        self.construido_en = None
+
+    # ---------- construcción ----------
+    def construir(self, filas) -> None:
+        """filas: iterable de (titulo, autor)."""
+        conteo, textos = Counter(), {}
+        for titulo, autor in filas:
+            for tipo, texto in zip(TIPOS, (titulo, autor)):
+                norm = normalizar(texto)
+                if norm:
+                    conteo[(tipo, norm)] += 1
+                    textos.setdefault((tipo, norm), str(texto).strip())
+
+        pesos = {t: [textos[t], n] for t, n in conteo.most_common(self.max_terminos)}
+        claves = sorted((clave, tipo, norm) for (tipo, norm) in pesos for clave in _sufijos(norm))
+        with self._lock:
+            self._pesos, self._claves = pesos, claves
+            self._cortos.clear()
+            self.construido_en = time.monotonic()
+
+    # ---------- cambios incrementales ----------
+    def sumar(self, tipo: str, texto, delta: int) -> None:
+        norm = normalizar(texto)
+        if not norm:
+            return
+        t = (tipo, norm)
+        with self._lock:
+            actual = self._pesos.get(t)
+            if actual is None:
+                if delta <= 0 or len(self._pesos) >= self.max_terminos:
+                    return
+                self._pesos[t] = [str(texto).strip(), delta]
+                for clave in _sufijos(norm):
+                    insort(self._claves, (clave, tipo, norm))
+            else:
+                actual[1] += delta
+                if actual[1] <= 0:
+                    del self._pesos[t]
+                    for clave in _sufijos(norm):
+                        i = bisect_left(self._claves, (clave, tipo, norm))
+                        if i < len(self._claves) and self._claves[i] == (clave, tipo, norm):
+                            del self._claves[i]
+            self._cortos.clear()
+
+    # ---------- consulta ----------
+    def buscar(self, q, k: int = 8) -> list:
+        prefijo = normalizar(q)
+        if not prefijo:
+            return []
+        with self._lock:
+            if len(prefijo) > PREFIJO_CORTO:
+                return self._top(prefijo, k)
+            top = self._cortos.get(prefijo)
+            if top is not None:
+                self._cortos.move_to_end(prefijo)
+                return top[:k]
+            top = self._top(prefijo, K_MAX)
+            if top:
+                self._cortos[prefijo] = top
+                if len(self._cortos) > CORTOS_MAX:
+                    self._cortos.popitem(last=False)
+            return top[:k]
+
+    def _top(self, prefijo: str, k: int) -> list:
+        vistos = set()
+        i = bisect_left(self._claves, (prefijo,))
+        while i < len(self._claves) and self._claves[i][0].startswith(prefijo):
+            vistos.add(self._claves[i][1:])
+            i += 1
+        mejores = heapq.nsmallest(
+            k, vistos, key=lambda t: (-self._pesos[t][1], len(t[1]), t[1]),
+        )
+        return [{"texto": self._pesos[t][0], "tipo": t[0], "n": self._pesos[t][1]} for t in mejores]
+
+    def __len__(self):
+        return len(self._pesos)
+
+
+indice = IndicePrefijos(getattr(settings, "SUGERENCIAS_MAX_TERMINOS", 50_000))
+_reconstruyendo = threading.Lock()
+
+
+def _reconstruir() -> None:
+    try:
+        indice.construir(Libro.objects.values_list("titulo", "autor").iterator(chunk_size=2000))
+    except Exception:
+        logger.exception("No se pudo reconstruir el índice de sugerencias")
+    finally:
+        connection.close()  # la conexión de este hilo
+        _reconstruyendo.release()
+
+
+def _lanzar_reconstruccion() -> None:
+    if _reconstruyendo.acquire(blocking=False):  # una a la vez por proceso
+        threading.Thread(target=_reconstruir, daemon=True).start()
+
+
+def sugerir(q, k: int = 8) -> list:
+    """[] mientras el proceso construye el índice por primera vez (en segundo plano)."""
+    if indice.construido_en is None:
+        _lanzar_reconstruccion()
+        return []
+    if time.monotonic() - indice.construido_en > getattr(settings, "SUGERENCIAS_REFRESCO", 600):
+        _lanzar_reconstruccion()  # mientras tanto se responde con el índice actual
+    return indice.buscar(q, max(1, min(k, K_MAX)))
+
+
+def libro_cambiado(antes=None, despues=None) -> None:
+    """
+    antes/despues: (titulo, autor) o None. Se aplica tras el commit (si la
+    transacción se deshace el índice no cambia).
+    """
+    def aplicar():
+        if indice.construido_en is None:
+            return  # se construirá completo con la primera consulta
+        for fila, delta in ((antes, -1), (despues, +1)):
+            if fila:
+                for tipo, texto in zip(TIPOS, fila):
+                    indice.sumar(tipo, texto, delta)
+
+    if antes != despues:
+        transaction.on_commit(aplicar)
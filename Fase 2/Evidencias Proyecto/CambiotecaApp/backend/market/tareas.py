@@ -0,0 +1,56 @@
+# market/tareas.py
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from core.cola import tarea
+
+from .chat_archivo import no_leidos_archivados
+from .models import ConversacionMensaje, ConversacionParticipante
+
+
+@tarea("market.borrar_archivos")
+def borrar_archivos(rutas: list):
+    """Borra imágenes de libros ya eliminados."""
+    for rel in rutas:
+        if rel and default_storage.exists(rel):
+            default_storage.delete(rel)
+
+
+@tarea("market.purgar_libros")
+def purgar_libros(lote: int = 20):
+    from .libro_borrado import purgar_eliminados  # libro_borrado importa este módulo
+    purgar_eliminados(lote)
+
+
+@tarea("market.reconciliar_no_leidos")
+def reconciliar_no_leidos(conversaciones=None):
+    """
+    Recalcula conversacion_participante.no_leidos desde los mensajes (corrige
+    derivas del contador). Sin `conversaciones` recorre todas.
+    A lo de la tabla caliente se suman los mensajes archivados no vistos
+    (chat_archivo.no_leidos_archivados), en la misma transacción.
+    """
+    no_vistos = (ConversacionMensaje.objects
+                 .filter(id_conversacion=OuterRef("id_conversacion"),
+                         id_mensaje__gt=Coalesce(OuterRef("ultimo_visto_id_mensaje"), Value(0)))
+                 .exclude(id_usuario_emisor=OuterRef("id_usuario"))
+                 .order_by()
+                 .values("id_conversacion")
+                 .annotate(n=Count("id_mensaje"))
+                 .values("n"))
+    # Sin joins en el filtro: la PK del modelo no es única (PK compuesta real),
+    # así que el UPDATE no puede pasar por un "pk IN (...)".
+    participantes = ConversacionParticipante.objects.all()
+    ids = None
+    if conversaciones:
+        ids = [int(c) for c in conversaciones]
+        participantes = participantes.filter(id_conversacion_id__in=ids)
+    with transaction.atomic():
+        participantes.update(no_leidos=Coalesce(
+            Subquery(no_vistos, output_field=IntegerField()), Value(0)))
+        for (conv_id, user_id), n in no_leidos_archivados(ids).items():
+            (ConversacionParticipante.objects
+             .filter(id_conversacion_id=conv_id, id_usuario_id=user_id)
+             .update(no_leidos=F("no_leidos") + n))
@@ -1,3 +1,1124 @@
-from django.test import TestCase
+import itertools
+import threading
+import time
+import uuid
+from collections import Counter
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q, QuerySet
+from django.test import Client, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.response import Response
+
+from core.models import Comuna, Region, Tarea, Usuario
+
+from . import chat_archivo, coincidencias, facetas, favoritos, feed, sugerencias, views
+from .constants import INTERCAMBIO_ESTADO, LIBRO_PUBLICACION, SOLICITUD_ESTADO
+from .libro_borrado import LibroEnIntercambioCompletado, borrar_libro, marcar_eliminado, purgar_eliminados
+from .models import (
+    Conversacion, ConversacionMensaje, ConversacionParticipante, Genero, ImagenLibro, Intercambio, Libro,
+    SolicitudIntercambio, SolicitudOferta,
+)
+from .publicacion import recalcular
+from .sugerencias import CORTOS_MAX, IndicePrefijos
+from .tareas import borrar_archivos, reconciliar_no_leidos
+from .ubicacion import sincronizar_usuario
+
+
+# =========================
+# Fixtures
+# =========================
+class Datos:
+    """Usuarios, libros y solicitudes mínimos (los modelos no tienen defaults para todo)."""
+
+    def usuario(self):
+        if not hasattr(self, "_comuna"):
+            self._comuna = Comuna.objects.create(nombre="Santiago", id_region=Region.objects.create(nombre="RM"))
+        tag = uuid.uuid4().hex[:10]
+        return Usuario.objects.create(
+            rut=f"T{tag}", nombres="Test", apellido_paterno="Test", apellido_materno="Test",
+            nombre_usuario=f"u_{tag}", email=f"u_{tag}@example.com", telefono="0", direccion="-",
+            numeracion="0", comuna=self._comuna, contrasena="!", fecha_registro=timezone.localdate(),
+            activo=True,
+        )
+
+    def libro(self, dueno):
+        if not hasattr(self, "_genero"):
+            self._genero = Genero.objects.create(nombre="Novela")
+        return Libro.objects.create(
+            titulo="Libro", isbn="0", anio_publicacion=2000, autor="-", estado="Nuevo",
+            descripcion="-", editorial="-", tipo_tapa="Blanda", disponible=True,
+            fecha_subida=timezone.now(), id_usuario=dueno, id_genero=self._genero,
+        )
+
+    def solicitud(self, deseado, ofrecido, estado=SOLICITUD_ESTADO["PENDIENTE"]):
+        s = SolicitudIntercambio.objects.create(
+            id_usuario_solicitante=ofrecido.id_usuario, id_usuario_receptor=deseado.id_usuario,
+            id_libro_deseado=deseado, estado=estado,
+        )
+        SolicitudOferta.objects.create(id_solicitud=s, id_libro_ofrecido=ofrecido)
+        return s
+
+    def intercambio(self, solicitud, aceptado, estado=INTERCAMBIO_ESTADO["ACEPTADO"]):
+        it = Intercambio.objects.create(
+            id_solicitud=solicitud, id_libro_ofrecido_aceptado=aceptado, estado_intercambio=estado,
+        )
+        recalcular([solicitud.id_libro_deseado_id, aceptado.pk])
+        return it
+
+    def publicacion(self, libro):
+        return Libro.todos.values_list("estado_publicacion", flat=True).get(pk=libro.pk)
+
+    def conversacion(self, *usuarios):
+        """Conversación de un intercambio aceptado entre los dueños de dos libros nuevos."""
+        a, b = usuarios or (self.usuario(), self.usuario())
+        s = self.solicitud(self.libro(b), self.libro(a))
+        it = self.intercambio(s, s.ofertas.get().id_libro_ofrecido)
+        conv = Conversacion.objects.create(id_intercambio=it, ultimo_id_mensaje=0)
+        # PK compuesta real: save() haría UPDATE por id_conversacion, como en la vista
+        ConversacionParticipante.objects.bulk_create([
+            ConversacionParticipante(id_conversacion=conv, id_usuario=u, ultimo_visto_id_mensaje=0)
+            for u in (a, b)
+        ])
+        return conv
+
+    def mensaje(self, conv, emisor, cuerpo="hola", clave=None):
+        return ConversacionMensaje.objects.create(
+            id_conversacion=conv, id_usuario_emisor=emisor, cuerpo=cuerpo, enviado_en=timezone.now(),
+            clave_idempotencia=clave,
+        )
+
+    def participante(self, conv, usuario):
+        return ConversacionParticipante.objects.get(id_conversacion=conv, id_usuario=usuario)
+
+
+# =========================
+# Soft-delete (libro_borrado.marcar_eliminado)
+# =========================
+class MarcarEliminadoTests(Datos, TestCase):
+    def setUp(self):
+        self.ana, self.beto, self.caro = self.usuario(), self.usuario(), self.usuario()
+        self.libro_ana = self.libro(self.ana)
+
+    def _estado(self, s):
+        return SolicitudIntercambio.objects.values_list("estado", flat=True).get(pk=s.pk)
+
+    def test_cierra_negociaciones_donde_es_el_deseado(self):
+        libro_beto, libro_caro = self.libro(self.beto), self.libro(self.caro)
+        aceptada = self.solicitud(self.libro_ana, libro_beto, SOLICITUD_ESTADO["ACEPTADA"])
+        self.intercambio(aceptada, libro_beto)
+        pendiente = self.solicitud(self.libro_ana, libro_caro)
+        self.assertEqual(self.publicacion(libro_beto), LIBRO_PUBLICACION["EN_NEGOCIACION"])
+
+        self.assertTrue(marcar_eliminado(self.libro_ana.pk))
+
+        self.assertEqual(self._estado(aceptada), SOLICITUD_ESTADO["CANCELADA"])
+        self.assertEqual(self._estado(pendiente), SOLICITUD_ESTADO["RECHAZADA"])
+        self.assertFalse(Intercambio.objects.exists())
+        # el libro de la contraparte vuelve a estar disponible
+        self.assertEqual(self.publicacion(libro_beto), LIBRO_PUBLICACION["DISPONIBLE"])
+        self.assertEqual(self.publicacion(self.libro_ana), LIBRO_PUBLICACION["RETIRADO"])
+        self.assertFalse(Libro.objects.filter(pk=self.libro_ana.pk).exists())
+        self.assertTrue(Libro.todos.filter(pk=self.libro_ana.pk, eliminado_en__isnull=False).exists())
+
+    def test_cierra_negociaciones_donde_es_el_aceptado(self):
+        libro_beto = self.libro(self.beto)
+        s = self.solicitud(libro_beto, self.libro_ana, SOLICITUD_ESTADO["ACEPTADA"])
+        self.intercambio(s, self.libro_ana)
+
+        marcar_eliminado(self.libro_ana.pk)
+
+        self.assertEqual(self._estado(s), SOLICITUD_ESTADO["CANCELADA"])
+        self.assertFalse(Intercambio.objects.exists())
+        self.assertEqual(self.publicacion(libro_beto), LIBRO_PUBLICACION["DISPONIBLE"])
+
+    def test_no_toca_lo_que_no_depende_del_libro(self):
+        libro_beto, libro_caro = self.libro(self.beto), self.libro(self.caro)
+        ajena = self.solicitud(libro_beto, libro_caro, SOLICITUD_ESTADO["ACEPTADA"])
+        it = self.intercambio(ajena, libro_caro)
+
+        marcar_eliminado(self.libro_ana.pk)
+
+        self.assertEqual(self._estado(ajena), SOLICITUD_ESTADO["ACEPTADA"])
+        self.assertTrue(Intercambio.objects.filter(pk=it.pk).exists())
+        self.assertEqual(self.publicacion(libro_caro), LIBRO_PUBLICACION["EN_NEGOCIACION"])
+
+    def test_completado_no_se_puede_eliminar(self):
+        libro_beto = self.libro(self.beto)
+        s = self.solicitud(self.libro_ana, libro_beto, SOLICITUD_ESTADO["ACEPTADA"])
+        self.intercambio(s, libro_beto, INTERCAMBIO_ESTADO["COMPLETADO"])
+
+        with self.assertRaises(LibroEnIntercambioCompletado):
+            marcar_eliminado(self.libro_ana.pk)
+        self.assertTrue(Libro.objects.filter(pk=self.libro_ana.pk).exists())
+
+    def test_inexistente_o_ya_eliminado(self):
+        self.assertFalse(marcar_eliminado(999999))
+        self.assertTrue(marcar_eliminado(self.libro_ana.pk))
+        self.assertFalse(marcar_eliminado(self.libro_ana.pk))
+
+
+# =========================
+# Borrado en conjunto (delete_book -> purgar_eliminados -> borrar_libro)
+# =========================
+@override_settings(TAREAS_EAGER=False)
+class BorrarLibroTests(Datos, TestCase):
+    def setUp(self):
+        self.ana, self.beto = self.usuario(), self.usuario()
+        self.libro_ana = self.libro(self.ana)
+        ImagenLibro.objects.bulk_create([
+            ImagenLibro(id_libro=self.libro_ana, url_imagen="libros\\a.jpg", orden=0),
+            ImagenLibro(id_libro=self.libro_ana, url_imagen="libros/b.jpg", orden=1),
+            ImagenLibro(id_libro=self.libro_ana, url_imagen=None, orden=2),
+        ])
+        self.client = Client()
+
+    def _borrar(self):
+        r = self.client.delete(f"/api/libros/{self.libro_ana.pk}/delete/")
+        self.assertEqual(r.status_code, 204)
+
+    def test_delete_book_oculta_del_catalogo_y_deja_todo_para_el_purgador(self):
+        self._borrar()
+        self.assertFalse(Libro.objects.filter(pk=self.libro_ana.pk).exists())
+        self.assertTrue(Libro.todos.filter(pk=self.libro_ana.pk).exists())
+        self.assertEqual(ImagenLibro.objects.filter(id_libro=self.libro_ana).count(), 3)
+        self.assertFalse(Tarea.objects.filter(nombre="market.borrar_archivos").exists())
+        self.assertEqual(self.client.delete(f"/api/libros/{self.libro_ana.pk}/delete/").status_code, 404)
+
+    def test_purgar_borra_en_conjunto_y_encola_los_archivos(self):
+        vivo = self.libro(self.beto)
+        self._borrar()
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(purgar_eliminados(pausa=0), 1)
+
+        self.assertFalse(Libro.todos.filter(pk=self.libro_ana.pk).exists())
+        self.assertTrue(Libro.objects.filter(pk=vivo.pk).exists())
+        self.assertFalse(ImagenLibro.objects.exists())
+        borrados_imagen = [q for q in ctx.captured_queries
+                           if q["sql"].startswith('DELETE FROM "imagen_libro"')]
+        self.assertEqual(len(borrados_imagen), 1)
+        # una sola tarea, con las rutas normalizadas; el disco no se toca en la transacción
+        self.assertEqual(list(Tarea.objects.filter(nombre="market.borrar_archivos")
+                              .values_list("payload", flat=True)),
+                         [{"rutas": ["libros/a.jpg", "libros/b.jpg"]}])
+
+    def test_la_tarea_borra_los_archivos(self):
+        with mock.patch("market.tareas.default_storage") as storage:
+            storage.exists.side_effect = lambda rel: rel != "libros/b.jpg"
+            borrar_archivos(["libros/a.jpg", "libros/b.jpg", ""])
+        storage.delete.assert_called_once_with("libros/a.jpg")
+
+    def test_rollback_no_encola_nada(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                borrar_libro(self.libro_ana.pk)
+                raise RuntimeError("falla después del borrado")
+        self.assertTrue(Libro.objects.filter(pk=self.libro_ana.pk).exists())
+        self.assertEqual(ImagenLibro.objects.filter(id_libro=self.libro_ana).count(), 3)
+        self.assertFalse(Tarea.objects.exists())
+
+
+# =========================
+# Solicitudes en lote (views.crear_solicitudes_lote)
+# =========================
+class SolicitudesLoteTests(Datos, TestCase):
+    URL = "/api/solicitudes/crear-lote/"
+
+    def setUp(self):
+        self.yo = self.usuario()
+        self.mio = self.libro(self.yo)
+        self.deseados = [self.libro(self.usuario()) for _ in range(4)]
+
+    def _crear(self, deseados, ofrecidos=None):
+        return self.client.post(self.URL, {
+            "id_usuario_solicitante": self.yo.pk,
+            "id_libros_deseados": deseados,
+            "id_libros_ofrecidos": ofrecidos or [self.mio.pk],
+        }, content_type="application/json")
+
+    def _assert_creadas(self, r):
+        self.assertEqual(r.status_code, 201, r.data)
+        creadas = r.data["creadas"]
+        self.assertEqual([c["id_libro_deseado"] for c in creadas], [l.pk for l in self.deseados])
+        for c in creadas:
+            s = SolicitudIntercambio.objects.get(pk=c["id_solicitud"])
+            self.assertEqual(s.id_libro_deseado_id, c["id_libro_deseado"])
+            self.assertEqual(list(s.ofertas.values_list("id_libro_ofrecido_id", flat=True)), [self.mio.pk])
+
+    def test_ids_de_cada_solicitud(self):
+        self._assert_creadas(self._crear([l.pk for l in self.deseados]))
+
+    def test_ids_sin_insert_multiple_que_los_devuelva(self):
+        # MySQL: un solo INSERT y los ids se leen por el token del lote
+        self.solicitud(self.deseados[0], self.libro(self.usuario()))  # mismo libro deseado, otro lote
+        with mock.patch.object(type(connection.features), "can_return_rows_from_bulk_insert", False), \
+                CaptureQueriesContext(connection) as consultas:
+            self._assert_creadas(self._crear([l.pk for l in self.deseados]))
+        inserts = [q["sql"] for q in consultas.captured_queries
+                   if q["sql"].startswith('INSERT INTO "solicitud_intercambio"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertTrue(any('"solicitud_intercambio"."lote" =' in q["sql"] for q in consultas.captured_queries))
+
+    def test_repetidos_y_basura_se_ignoran(self):
+        a, b = self.deseados[0].pk, self.deseados[1].pk
+        r = self._crear([a, str(a), "x", None, b, a])
+        self.assertEqual([c["id_libro_deseado"] for c in r.data["creadas"]], [a, b])
+
+    def test_lista_demasiado_larga_se_rechaza_sin_recorrerla(self):
+        r = self._crear(list(range(1, 100_000)))
+        self.assertEqual(r.status_code, 400)
+        self.assertIn("Máximo", r.data["detail"])
+        r = self._crear([self.deseados[0].pk], ofrecidos=[self.mio.pk] * 4)
+        self.assertEqual(r.status_code, 400)
+        self.assertFalse(SolicitudIntercambio.objects.exists())
+
+
+# =========================
+# Favoritos (views.favoritos_view / favoritos_contiene)
+# =========================
+class FavoritosTests(Datos, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.yo = self.usuario()
+        self.libros = [self.libro(self.usuario()) for _ in range(3)]
+
+    def _post(self, **cuerpo):
+        return self.client.post("/api/favoritos/", {"user_id": self.yo.pk, **cuerpo},
+                                content_type="application/json")
+
+    def _contiene(self, ids):
+        return self.client.get("/api/favoritos/contiene/", {"user_id": self.yo.pk, "ids": ids})
+
+    def test_agregar_quitar_y_contiene(self):
+        a, b, c = (l.pk for l in self.libros)
+        r = self._post(agregar=[a, b, b])
+        self.assertEqual(r.status_code, 200, r.data)
+        self._post(quitar=[a])
+        r = self._contiene(f"{a},{b},{c},x")
+        self.assertEqual(r.data["favoritos"], [b])
+
+    def test_lotes_demasiado_grandes_se_rechazan(self):
+        tope = favoritos.FAVORITOS_LOTE_MAX
+        self.assertEqual(self._post(agregar=list(range(tope + 1))).status_code, 400)
+        self.assertEqual(self._post(quitar=[1] * (tope + 1)).status_code, 400)
+        self.assertEqual(self._contiene(",".join("1" * (2 * tope + 1))).status_code, 400)
+        self.assertEqual(self._contiene(",".join(str(i) for i in range(2 * tope))).status_code, 200)
+
+
+# =========================
+# Autocompletado (sugerencias.IndicePrefijos)
+# =========================
+class IndicePrefijosTests(TestCase):
+    def setUp(self):
+        self.indice = IndicePrefijos(max_terminos=100)
+        self.indice.construir([("Cien años de soledad", "Gabriel García Márquez"),
+                               ("El amor en los tiempos del cólera", "Gabriel García Márquez")])
+
+    def test_proceso_nuevo_responde_sin_esperar_la_construccion(self):
+        liberar = threading.Event()
+        nuevo = IndicePrefijos(max_terminos=100)
+        construir = nuevo.construir
+
+        def construir_lento(filas):
+            self.assertTrue(liberar.wait(5))
+            construir([("Rayuela", "Julio Cortázar")])
+
+        with mock.patch.object(sugerencias, "indice", nuevo), \
+                mock.patch.object(nuevo, "construir", side_effect=construir_lento):
+            self.assertEqual(sugerencias.sugerir("ray"), [])  # no espera a construir()
+            self.assertEqual(sugerencias.sugerir("ray"), [])
+            liberar.set()
+            self.assertTrue(sugerencias._reconstruyendo.acquire(timeout=5))
+            sugerencias._reconstruyendo.release()
+            self.assertEqual(nuevo.construir.call_count, 1)  # una sola construcción
+            self.assertEqual([r["texto"] for r in sugerencias.sugerir("ray")], ["Rayuela"])
+
+    def test_prefijo_de_palabra_y_sin_tildes(self):
+        textos = [r["texto"] for r in self.indice.buscar("marq")]
+        self.assertEqual(textos, ["Gabriel García Márquez"])
+        self.assertEqual(self.indice.buscar("gar")[0]["n"], 2)
+
+    def test_solo_se_guardan_prefijos_cortos_con_resultados(self):
+        self.indice.buscar("cie")
+        for a in "xyz":
+            for b in "qwj":
+                self.indice.buscar(a + b)
+        self.assertEqual(list(self.indice._cortos), ["cie"])
+
+    def test_cache_de_prefijos_cortos_acotado(self):
+        prefijos = ["".join(p) for p in itertools.product("abcdefghijklm", repeat=3)][:CORTOS_MAX + 50]
+        indice = IndicePrefijos(max_terminos=len(prefijos))
+        indice.construir([(p, "") for p in prefijos])
+        for p in prefijos:
+            self.assertEqual(len(indice.buscar(p)), 1)
+        self.assertEqual(len(indice._cortos), CORTOS_MAX)
+        self.assertNotIn(prefijos[0], indice._cortos)  # el menos usado salió primero
+        self.assertIn(prefijos[-1], indice._cortos)
+
+
+# =========================
+# Grafo de coincidencias (coincidencias.grafo)
+# =========================
+class GrafoCoincidenciasTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self._reiniciar()
+        self.addCleanup(self._reiniciar)
+        self.liberar = threading.Event()
+
+    def _reiniciar(self):
+        coincidencias._grafo, coincidencias._aplicado = None, 0
+        coincidencias._construido_en = coincidencias._hueco_desde = None
+
+    def _grafo_mutuo(self):
+        g = coincidencias.GrafoDeseos()
+        g.libro(10, 1)
+        g.libro(20, 2)
+        g.favorito(1, 20, True)
+        g.favorito(2, 10, True)
+        return g
+
+    def _construir_lento(self, g):
+        def construir():
+            self.assertTrue(self.liberar.wait(5))
+            return g
+        return mock.patch.object(coincidencias, "construir", side_effect=construir)
+
+    def _esperar_reconstruccion(self):
+        # el hilo suelta _reconstruyendo al terminar
+        self.assertTrue(coincidencias._reconstruyendo.acquire(timeout=5))
+        coincidencias._reconstruyendo.release()
+
+    def test_proceso_nuevo_responde_sin_esperar_la_construccion(self):
+        with self._construir_lento(self._grafo_mutuo()):
+            res = coincidencias.para_usuario(1)  # no se bloquea en construir()
+            self.assertEqual(res, {"directos": [], "ciclos": [], "listo": False})
+            self.liberar.set()
+            self._esperar_reconstruccion()
+
+        res = coincidencias.para_usuario(1)
+        self.assertTrue(res["listo"])
+        self.assertEqual(res["directos"], [{"usuario": 2, "recibes": [20], "entregas": [10]}])
+
+    def test_hueco_largo_sigue_con_el_grafo_anterior(self):
+        anterior = coincidencias.GrafoDeseos()
+        coincidencias._grafo, coincidencias._construido_en = anterior, time.monotonic()
+        # el lote 1 expiró: el 2 no se puede aplicar
+        cache.set(coincidencias.CLAVE_SEQ, 2)
+        cache.set(coincidencias.CLAVE_LOTE.format(2), [("libro", 99, 1)])
+        coincidencias._hueco_desde = time.monotonic() - coincidencias.HUECO_MAX - 1
+
+        nuevo = self._grafo_mutuo()
+        with self._construir_lento(nuevo):
+            self.assertIs(coincidencias.grafo(), anterior)
+            self.assertIs(coincidencias.grafo(), anterior)  # una sola reconstrucción en curso
+            self.liberar.set()
+            self._esperar_reconstruccion()
+            self.assertEqual(coincidencias.construir.call_count, 1)
+
+        self.assertIs(coincidencias.grafo(), nuevo)
+        self.assertEqual(coincidencias._aplicado, 2)  # lo anterior ya viene de la BD
+
+
+# =========================
+# Aceptaciones concurrentes (views._aceptar_bloqueado)
+# =========================
+@skipUnlessDBFeature("has_select_for_update")  # la garantía viene de los locks de fila
+class AceptarConcurrenteTests(Datos, TransactionTestCase):
+    """
+    Varios hilos (cada uno con su conexión) aceptan a la vez solicitudes que
+    comparten un libro: debe ganar exactamente una.
+    """
+    HILOS = 8
+
+    def _disparar(self, solicitudes, libro_aceptado):
+        barrera = threading.Barrier(len(solicitudes))
+        codigos = Counter()
+        lock = threading.Lock()
+
+        def aceptar(s, aceptado):
+            try:
+                barrera.wait()
+                r = Client().post(f"/api/solicitudes/{s.pk}/aceptar/",
+                                  {"user_id": s.id_usuario_receptor_id, "id_libro_aceptado": aceptado.pk},
+                                  content_type="application/json")
+                codigo = r.status_code
+            except Exception as e:
+                codigo = type(e).__name__
+            finally:
+                connection.close()  # la conexión de este hilo
+            with lock:
+                codigos[codigo] += 1
+
+        hilos = [threading.Thread(target=aceptar, args=(s, libro_aceptado(s))) for s in solicitudes]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        return codigos
+
+    def _aceptados(self, libro):
+        return (Intercambio.objects
+                .filter(estado_intercambio=INTERCAMBIO_ESTADO["ACEPTADO"])
+                .filter(Q(id_libro_ofrecido_aceptado=libro) | Q(id_solicitud__id_libro_deseado=libro))
+                .count())
+
+    def test_mismo_libro_deseado(self):
+        # un receptor acepta en paralelo N solicitudes por su mismo libro; lo
+        # protege el lock de la fila del libro (ux_intercambio_libro_activo
+        # solo cubre el libro ofrecido)
+        deseado = self.libro(self.usuario())
+        ofrecidos = {}
+        solicitudes = []
+        for _ in range(self.HILOS):
+            ofrecido = self.libro(self.usuario())
+            s = self.solicitud(deseado, ofrecido)
+            ofrecidos[s.pk] = ofrecido
+            solicitudes.append(s)
+
+        codigos = self._disparar(solicitudes, lambda s: ofrecidos[s.pk])
+
+        # el que gana rechaza las demás solicitudes por ese libro: según el
+        # orden, las otras ven 409 (libro ocupado) o 404 (ya respondida)
+        self.assertEqual(codigos[200], 1, codigos)
+        self.assertEqual(codigos[404] + codigos[409], self.HILOS - 1, codigos)
+        self.assertEqual(self._aceptados(deseado), 1)
+
+    def test_mismo_libro_ofrecido(self):
+        # un solicitante ofrece el mismo libro a N receptores que aceptan a la vez
+        ofrecido = self.libro(self.usuario())
+        solicitudes = [self.solicitud(self.libro(self.usuario()), ofrecido) for _ in range(self.HILOS)]
+
+        codigos = self._disparar(solicitudes, lambda s: ofrecido)
+
+        self.assertEqual(codigos[200], 1, codigos)
+        self.assertEqual(codigos[409], self.HILOS - 1, codigos)
+        self.assertEqual(self._aceptados(ofrecido), 1)
+
+
+class AceptarBloqueadoTests(Datos, TestCase):
+    """
+    Lo mismo sin hilos (corre en cualquier BD): el orden de los locks y el 409
+    que ve la segunda aceptación una vez que obtiene el lock.
+    """
+    def setUp(self):
+        self.receptor, self.solicitante = self.usuario(), self.usuario()
+        self.ofrecido = self.libro(self.solicitante)
+        self.deseado = self.libro(self.receptor)  # id mayor que el ofrecido
+
+    def _aceptar(self, s, aceptado):
+        with transaction.atomic():
+            return views._aceptar_bloqueado(s.pk, s.id_libro_deseado_id, aceptado.pk)
+
+    def test_bloquea_los_libros_en_orden_de_id_y_luego_la_solicitud(self):
+        s = self.solicitud(self.deseado, self.ofrecido)
+        bloqueos = []
+        select_for_update = QuerySet.select_for_update
+
+        def registrar(qs, *args, **kwargs):
+            bloqueos.append(qs.model)
+            return select_for_update(qs, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, "select_for_update", autospec=True, side_effect=registrar), \
+                CaptureQueriesContext(connection) as consultas:
+            res = self._aceptar(s, self.ofrecido)
+        self.assertNotIsInstance(res, Response)
+        self.assertEqual(bloqueos[:2], [Libro, SolicitudIntercambio])
+        primera = next(q["sql"] for q in consultas.captured_queries if q["sql"].startswith("SELECT"))
+        self.assertIn('FROM "libro"', primera)
+        self.assertRegex(primera, r'ORDER BY (1|"libro"\."id_libro") ASC$')  # pk es la 1ª columna
+
+    def test_libro_ofrecido_ya_comprometido_es_409(self):
+        s1 = self.solicitud(self.deseado, self.ofrecido)
+        s2 = self.solicitud(self.libro(self.usuario()), self.ofrecido)  # el mismo libro a otro receptor
+        self.assertNotIsInstance(self._aceptar(s1, self.ofrecido), Response)
+
+        res = self._aceptar(s2, self.ofrecido)
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(res.data["detail"], "El libro aceptado ya está comprometido en otro intercambio.")
+        self.assertEqual(SolicitudIntercambio.objects.get(pk=s2.pk).estado, SOLICITUD_ESTADO["PENDIENTE"])
+
+    def test_libro_deseado_ya_comprometido_es_409(self):
+        s1 = self.solicitud(self.deseado, self.ofrecido)
+        otro = self.libro(self.usuario())
+        s2 = self.solicitud(self.deseado, otro)
+        self.assertNotIsInstance(self._aceptar(s1, self.ofrecido), Response)
+        # aceptar s1 rechazó s2; aunque vuelva a pendiente, el libro deseado sigue tomado
+        SolicitudIntercambio.objects.filter(pk=s2.pk).update(estado=SOLICITUD_ESTADO["PENDIENTE"])
+
+        res = self._aceptar(s2, otro)
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(res.data["detail"], "Ese libro ya tiene otro intercambio aceptado en curso.")
+
+
+# =========================
+# Aceptar: intercambio, conversación y participantes en lote
+# =========================
+@override_settings(TAREAS_EAGER=False)
+class AceptarSolicitudTests(Datos, TestCase):
+    def setUp(self):
+        self.receptor, self.solicitante, self.otro = self.usuario(), self.usuario(), self.usuario()
+        self.deseado = self.libro(self.receptor)
+        self.ofrecido = self.libro(self.solicitante)
+        self.s = self.solicitud(self.deseado, self.ofrecido)
+        self.hermana = self.solicitud(self.deseado, self.libro(self.otro))
+        self.client = Client()
+
+    def _aceptar(self, user=None):
+        return self.client.post(f"/api/solicitudes/{self.s.pk}/aceptar/",
+                                {"user_id": (user or self.receptor).pk, "id_libro_aceptado": self.ofrecido.pk},
+                                content_type="application/json")
+
+    def test_un_insert_por_tabla(self):
+        with CaptureQueriesContext(connection) as ctx:
+            r = self._aceptar()
+        self.assertEqual(r.status_code, 200)
+        inserts = Counter(q["sql"].split('"')[1] for q in ctx.captured_queries
+                          if q["sql"].startswith("INSERT"))
+        self.assertEqual(inserts["intercambio"], 1)
+        self.assertEqual(inserts["conversacion"], 1)
+        self.assertEqual(inserts["conversacion_participante"], 1)
+
+        it = Intercambio.objects.get()
+        self.assertEqual(r.json()["intercambio_id"], it.pk)
+        conv = Conversacion.objects.get(id_intercambio=it)
+        self.assertEqual(
+            dict(ConversacionParticipante.objects.filter(id_conversacion=conv).values_list("id_usuario", "rol")),
+            {self.solicitante.pk: "solicitante", self.receptor.pk: "ofreciente"},
+        )
+
+    def test_rechaza_las_hermanas_y_las_avisa_de_una_vez(self):
+        r = self._aceptar()
+        self.assertEqual(r.json()["rechazadas"], [self.hermana.pk])
+        self.assertEqual(SolicitudIntercambio.objects.get(pk=self.hermana.pk).estado, SOLICITUD_ESTADO["RECHAZADA"])
+
+        tareas = list(Tarea.objects.filter(nombre="core.notificar").values_list("payload", flat=True))
+        self.assertEqual(len(tareas), 1)
+        self.assertEqual(sorted((e["u"], e["tipo"]) for e in tareas[0]["eventos"]),
+                         sorted([(self.solicitante.pk, "solicitud_aceptada"),
+                                 (self.otro.pk, "solicitud_rechazada")]))
+
+    def test_reaceptar_no_duplica(self):
+        primera = self._aceptar().json()["intercambio_id"]
+        r = self._aceptar()
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()["intercambio_id"], primera)
+        self.assertEqual(r.json()["rechazadas"], [])
+        self.assertEqual(Intercambio.objects.count(), 1)
+        self.assertEqual(Conversacion.objects.count(), 1)
+        self.assertEqual(ConversacionParticipante.objects.count(), 2)
+
+    def test_solo_el_receptor(self):
+        self.assertEqual(self._aceptar(self.solicitante).status_code, 403)
+        self.assertFalse(Intercambio.objects.exists())
+
+
+# =========================
+# Estado de publicación (market/publicacion.py)
+# =========================
+class PublicacionTests(Datos, TestCase):
+    def setUp(self):
+        self.a, self.b = self.usuario(), self.usuario()
+        self.deseado, self.ofrecido = self.libro(self.b), self.libro(self.a)
+        self.client = Client()
+
+    def _estados(self):
+        return self.publicacion(self.deseado), self.publicacion(self.ofrecido)
+
+    def _pasar_a(self, it, estado):
+        Intercambio.objects.filter(pk=it.pk).update(estado_intercambio=estado)
+        recalcular([self.deseado.pk, self.ofrecido.pk])
+
+    def test_transiciones(self):
+        D, N, I, R = (LIBRO_PUBLICACION[k] for k in ("DISPONIBLE", "EN_NEGOCIACION", "INTERCAMBIADO", "RETIRADO"))
+        s = self.solicitud(self.deseado, self.ofrecido)
+        self.assertEqual(self._estados(), (D, D))  # una solicitud sola no compromete
+
+        it = self.intercambio(s, self.ofrecido)
+        self.assertEqual(self._estados(), (N, N))
+
+        self._pasar_a(it, INTERCAMBIO_ESTADO["CANCELADO"])
+        self.assertEqual(self._estados(), (D, D))
+
+        Libro.objects.filter(pk=self.ofrecido.pk).update(disponible=False)
+        self._pasar_a(it, INTERCAMBIO_ESTADO["ACEPTADO"])
+        self.assertEqual(self._estados(), (N, R))  # retirado gana a en negociación
+
+        self._pasar_a(it, INTERCAMBIO_ESTADO["COMPLETADO"])
+        self.assertEqual(self._estados(), (I, I))  # intercambiado gana a todo
+
+    def test_populares_cuenta_solo_los_disponibles(self):
+        # todos se llaman "Libro" y siguen con disponible=True
+        s = self.solicitud(self.deseado, self.ofrecido)
+        self.intercambio(s, self.ofrecido, estado=INTERCAMBIO_ESTADO["COMPLETADO"])  # 2 intercambiados
+        en_negociacion = self.libro(self.usuario())
+        self.intercambio(self.solicitud(self.libro(self.usuario()), en_negociacion), en_negociacion)
+        self.libro(self.usuario())  # libre
+
+        r = self.client.get("/api/libros/populares/")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json(), [{"titulo": "Libro", "total_intercambios": 2, "repeticiones": 1}])
+
+    def test_ofertas_ocupadas_incluye_los_comprometidos(self):
+        pendiente = self.libro(self.a)
+        self.solicitud(self.libro(self.usuario()), pendiente)
+        self.intercambio(self.solicitud(self.deseado, self.ofrecido), self.ofrecido)
+        self.libro(self.a)  # libre
+
+        r = self.client.get("/api/solicitudes/ofertas-ocupadas/", {"user_id": self.a.pk})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json(), {"ocupados": sorted([self.ofrecido.pk, pendiente.pk])})
+
+
+# =========================
+# Feed de inicio (market/feed.py)
+# =========================
+class FeedTests(Datos, TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_invalidar_solo_borra_y_despues_del_commit(self):
+        cache.set(feed.FEED_CLAVE, ["viejo"])
+        with mock.patch.object(feed, "construir") as construir:
+            with self.captureOnCommitCallbacks(execute=True):
+                feed.invalidar()
+                self.assertEqual(cache.get(feed.FEED_CLAVE), ["viejo"])
+        self.assertIsNone(cache.get(feed.FEED_CLAVE))
+        construir.assert_not_called()  # el que escribe no reconstruye
+
+    def test_la_proxima_lectura_reconstruye(self):
+        libro = self.libro(self.usuario())
+        self.assertEqual([b["id_libro"] for b in feed.latest()], [libro.pk])
+        with mock.patch.object(feed, "construir") as construir:
+            feed.latest()
+        construir.assert_not_called()
+
+    def test_lecturas_concurrentes_construyen_una_vez(self):
+        llamadas = []
+
+        def construir():
+            llamadas.append(1)
+            time.sleep(0.1)
+            return ["nuevo"]
+
+        resultados = []
+        with mock.patch.object(feed, "construir", construir):
+            hilos = [threading.Thread(target=lambda: resultados.append(feed.latest())) for _ in range(8)]
+            for h in hilos:
+                h.start()
+            for h in hilos:
+                h.join()
+        self.assertEqual(len(llamadas), 1)
+        self.assertEqual(resultados, [["nuevo"]] * 8)
+
+    def test_espera_al_worker_que_esta_construyendo(self):
+        cache.add(feed.FEED_LOCK, 1)  # lock tomado por otro proceso
+        threading.Timer(0.05, cache.set, (feed.FEED_CLAVE, ["de otro"])).start()
+        with mock.patch.object(feed, "FEED_ESPERA", (0.01, 100)), \
+                mock.patch.object(feed, "construir") as construir:
+            self.assertEqual(feed.latest(), ["de otro"])
+        construir.assert_not_called()
+
+
+# =========================
+# Facetas (market/facetas.py)
+# =========================
+class FacetasTests(Datos, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dueno = self.usuario()
+        Libro.objects.filter(pk=self.libro(self.dueno).pk).update(titulo="El Principito")
+        self.libro(self.dueno)
+        self.client = Client()
+
+    def _total(self, **params):
+        r = self.client.get("/api/libros/facetas/", params)
+        self.assertEqual(r.status_code, 200)
+        return r.json()["total"]
+
+    def test_espacios_misma_clave_y_mismo_filtro(self):
+        clave = facetas.clave({"query": " El   Principito "})
+        self.assertEqual(clave, facetas.clave({"query": "El Principito"}))
+        self.assertEqual(self._total(query="El Principito"), 1)
+        self.assertIsNotNone(cache.get(clave))
+        # antes el listado filtraba "El   Principito" tal cual (0) y la clave daba 1
+        self.assertEqual(self._total(query="  El   Principito"), 1)
+
+    def test_mayusculas_no_comparten_clave(self):
+        self.assertNotEqual(facetas.clave({"query": "ABC"}), facetas.clave({"query": "abc"}))
+
+    def test_cambio_del_catalogo_invalida_los_conteos(self):
+        self.assertEqual(self._total(), 2)
+        self.libro(self.dueno)
+        self.assertEqual(self._total(), 2)  # cacheado
+        with self.captureOnCommitCallbacks(execute=True):
+            feed.invalidar()
+        self.assertEqual(self._total(), 3)
+
+    def test_cambio_de_comuna_del_dueno_invalida_los_conteos(self):
+        antes = facetas.clave({"comuna": "1"})
+        with self.captureOnCommitCallbacks(execute=True):
+            sincronizar_usuario(self.dueno.pk)
+        self.assertNotEqual(facetas.clave({"comuna": "1"}), antes)
+
+
+# =========================
+# Chat: no leídos por participante
+# =========================
+@override_settings(TAREAS_EAGER=False)
+class NoLeidosTests(Datos, TestCase):
+    def setUp(self):
+        self.a, self.b = self.usuario(), self.usuario()
+        self.conv, self.otra = self.conversacion(self.a, self.b), self.conversacion(self.a, self.b)
+        self.client = Client()
+
+    def _enviar(self, conv, emisor):
+        r = self.client.post(f"/api/chat/conversacion/{conv.pk}/enviar/",
+                             {"id_usuario_emisor": emisor.pk, "cuerpo": "hola"},
+                             content_type="application/json")
+        self.assertEqual(r.status_code, 201)
+        return r.json()["id_mensaje"]
+
+    def _badge(self, usuario):
+        return self.client.get(f"/api/chat/{usuario.pk}/unread/").json()["unread"]
+
+    def _lista(self, usuario):
+        r = self.client.get(f"/api/chat/{usuario.pk}/conversaciones/")
+        self.assertEqual(r.status_code, 200)
+        return {c["id_conversacion"]: c for c in r.json()}
+
+    def test_enviar_suma_solo_a_los_demas(self):
+        self._enviar(self.conv, self.a)
+        self._enviar(self.conv, self.a)
+        self._enviar(self.conv, self.b)
+        self.assertEqual(self.participante(self.conv, self.b).no_leidos, 2)
+        self.assertEqual(self.participante(self.conv, self.a).no_leidos, 1)
+
+    def test_badge_suma_las_conversaciones_no_archivadas(self):
+        self.assertEqual(self._badge(self.b), 0)
+        for conv in (self.conv, self.conv, self.otra):
+            self._enviar(conv, self.a)
+        self.assertEqual(self._badge(self.b), 3)
+        self.assertEqual(self._badge(self.a), 0)
+
+        ConversacionParticipante.objects.filter(id_conversacion=self.otra, id_usuario=self.b) \
+            .update(archivado=True)
+        self.assertEqual(self._badge(self.b), 2)
+
+    def test_badge_no_lee_los_mensajes(self):
+        self._enviar(self.conv, self.a)
+        with CaptureQueriesContext(connection) as ctx:
+            self._badge(self.b)
+        self.assertFalse([q for q in ctx.captured_queries if "conversacion_mensaje" in q["sql"]])
+
+    def test_lista_cuenta_mensajes_no_diferencia_de_ids(self):
+        # ids intercalados entre conversaciones: la resta de ids daría 3 en self.conv
+        self._enviar(self.conv, self.a)
+        self._enviar(self.otra, self.a)
+        self._enviar(self.otra, self.a)
+        self._enviar(self.conv, self.a)
+        lista = self._lista(self.b)
+        self.assertEqual(lista[self.conv.pk]["unread_count"], 2)
+        self.assertEqual(lista[self.otra.pk]["unread_count"], 2)
+        self.assertEqual(self._lista(self.a)[self.conv.pk]["unread_count"], 0)
+
+    def test_marcar_visto_deja_en_cero(self):
+        self._enviar(self.conv, self.a)
+        self._enviar(self.otra, self.a)
+        self.client.post(f"/api/chat/conversacion/{self.conv.pk}/visto/", {"id_usuario": self.b.pk},
+                         content_type="application/json")
+        self.assertEqual(self._lista(self.b)[self.conv.pk]["unread_count"], 0)
+        self.assertEqual(self._badge(self.b), 1)
+
+
+# =========================
+# Chat: ventanas de mensajes y formato compacto
+# =========================
+class VentanaMensajesTests(Datos, TestCase):
+    def setUp(self):
+        self.a, self.b = self.usuario(), self.usuario()
+        self.conv = self.conversacion(self.a, self.b)
+        self.ids = [self.mensaje(self.conv, (self.a, self.b)[i % 2], f"m {i}").pk for i in range(15)]
+        self.client = Client()
+
+    def _get(self, headers=None, **params):
+        r = self.client.get(f"/api/chat/conversacion/{self.conv.pk}/mensajes/", params, headers=headers)
+        self.assertEqual(r.status_code, 200)
+        return r
+
+    def _ids(self, **params):
+        return [m["id_mensaje"] for m in self._get(**params).json()]
+
+    def test_sin_parametros_todo_el_historial(self):
+        self.assertEqual(self._ids(), self.ids)
+
+    def test_hacia_atras_por_paginas(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self._ids(limit=5), self.ids[-5:])
+        self.assertTrue([q for q in ctx.captured_queries if "LIMIT 5" in q["sql"]])
+
+        paginas, before = [], self.ids[-5]
+        while True:
+            ids = self._ids(limit=5, before=before)
+            if not ids:
+                break
+            paginas.append(ids)
+            before = ids[0]
+        self.assertEqual(paginas, [self.ids[5:10], self.ids[:5]])
+        self.assertEqual(self._ids(limit=0), self.ids[-1:])  # limit se acota a [1, MAX]
+
+    def test_after_solo_los_nuevos(self):
+        self.assertEqual(self._ids(after=self.ids[12]), self.ids[13:])
+        self.assertEqual(self._ids(after=self.ids[-1]), [])
+
+    def test_since_visto_contexto_y_no_leidos(self):
+        ConversacionParticipante.objects.filter(id_conversacion=self.conv, id_usuario=self.b) \
+            .update(ultimo_visto_id_mensaje=self.ids[11])
+        r = self._get(since_visto=1, id_usuario=self.b.pk)
+        self.assertEqual([m["id_mensaje"] for m in r.json()], self.ids[11 - views.MENSAJES_CONTEXTO + 1:])
+        self.assertEqual(r["X-Ultimo-Visto"], str(self.ids[11]))
+        # sin id_usuario no hay visto: historial completo
+        self.assertEqual(self._ids(since_visto=1), self.ids)
+
+    def test_formato_compacto(self):
+        esperado = self._get(limit=3).json()
+        por_query = self._get(limit=3, compact=1).json()
+        por_accept = self._get(limit=3, headers={"Accept": "application/vnd.cambioteca.compact+json"}).json()
+        self.assertEqual(por_query, por_accept)
+        self.assertEqual(por_query["cols"], list(views.MENSAJE_COLS))
+        self.assertEqual([dict(zip(por_query["cols"], r)) for r in por_query["rows"]], esperado)
+
+        ConversacionParticipante.objects.filter(id_conversacion=self.conv, id_usuario=self.b) \
+            .update(ultimo_visto_id_mensaje=self.ids[-2])
+        r = self._get(since_visto=1, id_usuario=self.b.pk, compact=1).json()
+        self.assertEqual(r["ultimo_visto_id_mensaje"], self.ids[-2])
+        self.assertEqual(r["rows"][-1][0], self.ids[-1])
+
+
+# =========================
+# Chat: envío en lote
+# =========================
+@override_settings(TAREAS_EAGER=False)
+class ChatLoteTests(Datos, TestCase):
+    def setUp(self):
+        self.a, self.b = self.usuario(), self.usuario()
+        self.conv = self.conversacion(self.a, self.b)
+        self.client = Client()
+
+    def _lote(self, *claves):
+        return self.client.post(
+            f"/api/chat/conversacion/{self.conv.pk}/enviar-lote/",
+            {"id_usuario_emisor": self.a.pk,
+             "mensajes": [{"cuerpo": f"m {c}", "client_id": c} for c in claves]},
+            content_type="application/json",
+        )
+
+    def test_lote_suma_no_leidos_y_encola_una_notificacion(self):
+        r = self._lote("x", "y", "z")
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual([m["duplicado"] for m in r.json()["mensajes"]], [False] * 3)
+        self.assertEqual(self.participante(self.conv, self.b).no_leidos, 3)
+        self.assertEqual(self.participante(self.conv, self.a).no_leidos, 0)
+        tareas = list(Tarea.objects.filter(nombre="core.notificar").values_list("payload", flat=True))
+        self.assertEqual(len(tareas), 1)
+        self.assertEqual(tareas[0]["eventos"][0]["n"], 3)
+
+    def test_reintento_solo_cuenta_los_nuevos(self):
+        self._lote("x", "y")
+        r = self._lote("x", "y", "z")
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual([m["duplicado"] for m in r.json()["mensajes"]], [True, True, False])
+        self.assertEqual(self.participante(self.conv, self.b).no_leidos, 3)
+
+    def test_reintento_concurrente_no_cuenta_doble(self):
+        # otro request con la misma clave confirma mientras este espera el lock
+        def otro_request(conversacion_id):
+            self.mensaje(self.conv, self.a, "m y", clave="y")
+
+        with mock.patch.object(views, "_bloquear_conversacion", side_effect=otro_request):
+            r = self._lote("x", "y")
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual([m["duplicado"] for m in r.json()["mensajes"]], [False, True])
+        self.assertEqual(self.participante(self.conv, self.b).no_leidos, 1)
+        self.assertEqual(ConversacionMensaje.objects.filter(id_conversacion=self.conv).count(), 2)
+
+
+# =========================
+# Chat: marcar como visto
+# =========================
+@override_settings(TAREAS_EAGER=False)
+class MarcarVistoTests(Datos, TestCase):
+    def setUp(self):
+        self.a, self.b = self.usuario(), self.usuario()
+        self.conv, self.otra = self.conversacion(self.a, self.b), self.conversacion(self.a, self.b)
+        self.client = Client()
+        for conv in (self.conv, self.conv, self.otra):
+            self._enviar(conv)
+
+    def _enviar(self, conv):
+        r = self.client.post(f"/api/chat/conversacion/{conv.pk}/enviar/",
+                             {"id_usuario_emisor": self.a.pk, "cuerpo": "hola"},
+                             content_type="application/json")
+        self.assertEqual(r.status_code, 201)
+        return r.json()["id_mensaje"]
+
+    def _visto(self, conv, **cuerpo):
+        return self.client.post(f"/api/chat/conversacion/{conv.pk}/visto/", cuerpo,
+                                content_type="application/json")
+
+    def test_deja_visto_el_ultimo_y_no_leidos_en_cero(self):
+        ultimo = self._enviar(self.conv)
+        r = self._visto(self.conv, id_usuario=self.b.pk)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json(), {"ultimo_visto_id_mensaje": ultimo})
+        p = self.participante(self.conv, self.b)
+        self.assertEqual((p.ultimo_visto_id_mensaje, p.no_leidos), (ultimo, 0))
+        self.assertEqual(self.participante(self.otra, self.b).no_leidos, 1)  # la otra no se toca
+
+    def test_no_retrocede(self):
+        ConversacionParticipante.objects.filter(id_conversacion=self.conv, id_usuario=self.b) \
+            .update(ultimo_visto_id_mensaje=10 ** 6)
+        self._visto(self.conv, id_usuario=self.b.pk)
+        self.assertEqual(self.participante(self.conv, self.b).ultimo_visto_id_mensaje, 10 ** 6)
+
+    def test_id_usuario_invalido_es_400(self):
+        for cuerpo in ({}, {"id_usuario": "abc"}, {"id_usuario": None}):
+            self.assertEqual(self._visto(self.conv, **cuerpo).status_code, 400, cuerpo)
+        self.assertEqual(self.participante(self.conv, self.b).no_leidos, 2)
+
+    def test_lote_todas_o_algunas(self):
+        r = self.client.post("/api/chat/visto/", {"id_usuario": self.b.pk, "conversaciones": [self.otra.pk, "x"]},
+                             content_type="application/json")
+        self.assertEqual(r.json(), {"ok": True, "actualizadas": 1})
+        self.assertEqual(self.participante(self.conv, self.b).no_leidos, 2)
+
+        r = self.client.post("/api/chat/visto/", {"id_usuario": self.b.pk}, content_type="application/json")
+        self.assertEqual(r.json(), {"ok": True, "actualizadas": 2})
+        self.assertEqual(self.client.get(f"/api/chat/{self.b.pk}/unread/").json(), {"unread": 0})
+
+
+# =========================
+# Chat: archivo frío (market/chat_archivo.py)
+# =========================
+@override_settings(TAREAS_EAGER=False)
+class ChatArchivoTests(Datos, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.a, self.b = self.usuario(), self.usuario()
+        self.conv = self.conversacion(self.a, self.b)
+        self.frios = [self.mensaje(self.conv, (self.a, self.b)[i % 2], f"viejo {i}").pk for i in range(10)]
+        self.assertEqual(chat_archivo.archivar_conversacion(self.conv.pk), 10)
+        self.client = Client()
+        self.envios = [self._enviar(f"c{i}") for i in range(5)]
+        self.calientes = [r.json()["id_mensaje"] for r in self.envios]
+        self.todos = self.frios + self.calientes
+
+    def _enviar(self, client_id):
+        return self.client.post(f"/api/chat/conversacion/{self.conv.pk}/enviar/",
+                                {"id_usuario_emisor": self.a.pk, "cuerpo": f"nuevo {client_id}",
+                                 "client_id": client_id},
+                                content_type="application/json")
+
+    def _get(self, **params):
+        r = self.client.get(f"/api/chat/conversacion/{self.conv.pk}/mensajes/", params)
+        self.assertEqual(r.status_code, 200)
+        return r.json()
+
+    def _ids(self, **params):
+        return [m["id_mensaje"] for m in self._get(**params)]
+
+    def _contando_lecturas(self):
+        return mock.patch.object(views, "leer_archivo", side_effect=chat_archivo.leer_archivo)
+
+    def test_ida_y_vuelta(self):
+        mensajes = self._get()
+        self.assertEqual([m["id_mensaje"] for m in mensajes], self.todos)
+        self.assertEqual([m["cuerpo"] for m in mensajes],
+                         [f"viejo {i}" for i in range(10)] + [f"nuevo c{i}" for i in range(5)])
+        self.assertEqual(ConversacionMensaje.objects.filter(id_conversacion=self.conv).count(), 5)
+
+    def test_paginacion_hacia_atras_cruza_el_borde(self):
+        with self._contando_lecturas() as leer:
+            self.assertEqual(self._ids(limit=4), self.todos[-4:])
+            self.assertEqual(leer.call_count, 0)  # la primera página sale de la tabla caliente
+
+            paginas, before = [], self.todos[-4]
+            while True:
+                ids = self._ids(limit=4, before=before)
+                if not ids:
+                    break
+                paginas.append(ids)
+                before = ids[0]
+        self.assertEqual(paginas[0], self.todos[-8:-4])  # 1 caliente + 3 archivados
+        self.assertEqual(sum(reversed(paginas), []) + self.todos[-4:], self.todos)
+        self.assertGreater(leer.call_count, 0)
+
+    def test_polling_en_caliente_no_abre_el_archivo(self):
+        with self._contando_lecturas() as leer:
+            self.assertEqual(self._ids(after=self.calientes[2]), self.calientes[3:])
+            self.assertEqual(self._ids(before=self.calientes[4], limit=2), self.calientes[2:4])
+        self.assertEqual(leer.call_count, 0)
+
+    def test_since_visto_cruza_el_borde(self):
+        ConversacionParticipante.objects.filter(id_conversacion=self.conv, id_usuario=self.b) \
+            .update(ultimo_visto_id_mensaje=self.calientes[1])
+        # contexto: los 10 anteriores (8 archivados + 2 calientes); no leídos: los 3 calientes
+        self.assertEqual(self._ids(since_visto=1, id_usuario=self.b.pk), self.todos[2:])
+
+    def test_after_dentro_del_archivo_sigue_en_caliente(self):
+        self.assertEqual(self._ids(after=self.frios[7], limit=4), self.frios[8:] + self.calientes[:2])
+        self.assertEqual(self._ids(after=self.frios[7]), self.frios[8:] + self.calientes)
+
+    def test_claves_de_idempotencia(self):
+        self.assertEqual([r.status_code for r in self.envios], [201] * 5)
+        repetido = self._enviar("c0")
+        self.assertEqual(repetido.status_code, 200)
+        self.assertEqual(repetido.json(), {"id_mensaje": self.calientes[0], "duplicado": True})
+        self.assertEqual(ConversacionMensaje.objects.filter(clave_idempotencia="c0").count(), 1)
+        self.assertEqual(self.participante(self.conv, self.b).no_leidos, 5)
+
+
+# =========================
+# Tareas (market/tareas.py)
+# =========================
+class ReconciliarNoLeidosTests(Datos, TestCase):
+    def setUp(self):
+        self.a, self.b = self.usuario(), self.usuario()
+        self.conv = self.conversacion(self.a, self.b)
+        for emisor in (self.a, self.a, self.b, self.a):
+            ultimo = self.mensaje(self.conv, emisor)
+        # a vio hasta el final, b hasta el segundo mensaje
+        ConversacionParticipante.objects.filter(id_conversacion=self.conv, id_usuario=self.a) \
+            .update(ultimo_visto_id_mensaje=ultimo.pk, no_leidos=7)
+        segundo = ConversacionMensaje.objects.filter(id_conversacion=self.conv).order_by("pk")[1]
+        ConversacionParticipante.objects.filter(id_conversacion=self.conv, id_usuario=self.b) \
+            .update(ultimo_visto_id_mensaje=segundo.pk, no_leidos=0)
+
+    def _no_leidos(self, conv, usuario):
+        return self.participante(conv, usuario).no_leidos
+
+    def test_recalcula_desde_los_mensajes(self):
+        reconciliar_no_leidos()
+        self.assertEqual(self._no_leidos(self.conv, self.a), 0)
+        self.assertEqual(self._no_leidos(self.conv, self.b), 1)  # solo el último de a
+
+    def test_sin_mensajes_queda_en_cero(self):
+        vacia = self.conversacion()
+        ConversacionParticipante.objects.filter(id_conversacion=vacia).update(no_leidos=3)
+        reconciliar_no_leidos()
+        self.assertEqual(
+            list(ConversacionParticipante.objects.filter(id_conversacion=vacia)
+                 .values_list("no_leidos", flat=True)), [0, 0])
+
+    def test_solo_las_conversaciones_pedidas(self):
+        otra = self.conversacion()
+        ConversacionParticipante.objects.filter(id_conversacion=otra).update(no_leidos=5)
+        reconciliar_no_leidos(conversaciones=[self.conv.pk])
+        self.assertEqual(self._no_leidos(self.conv, self.a), 0)
+        self.assertEqual(
+            set(ConversacionParticipante.objects.filter(id_conversacion=otra)
+                .values_list("no_leidos", flat=True)), {5})
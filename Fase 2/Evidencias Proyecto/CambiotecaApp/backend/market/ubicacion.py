@@ -0,0 +1,27 @@
+# market/ubicacion.py
+"""
+Ubicación del dueño copiada en el libro (`libro.id_comuna`, `libro.id_region`)
+para filtrar el catálogo por zona con un índice, sin el join
+libro -> usuario -> comuna en cada consulta.
+"""
+from core.models import Usuario
+
+from . import facetas
+from .models import Libro
+
+
+def de_usuario(usuario_id: int) -> tuple:
+    """(id_comuna, id_region) del usuario, o (None, None)."""
+    fila = (Usuario.objects.filter(pk=usuario_id)
+            .values_list("comuna_id", "comuna__id_region_id")
+            .first())
+    return fila or (None, None)
+
+
+def sincronizar_usuario(usuario_id: int) -> int:
+    """Un UPDATE sobre todos sus libros (incluye eliminados). Llamar al cambiar su comuna."""
+    comuna_id, region_id = de_usuario(usuario_id)
+    facetas.invalidar()  # la faceta comuna cambia
+    return Libro.todos.filter(id_usuario_id=usuario_id).update(
+        id_comuna_id=comuna_id, id_region_id=region_id,
+    )
@@ -7,7 +7,7 @@ from .views import (
     upload_image, list_images, update_image, delete_image,
     marcar_solicitudes_vistas, delete_book,
     books_by_title, lista_conversaciones,
-    mensajes_de_conversacion, enviar_mensaje, marcar_visto, catalog_generos,
+    mensajes_de_conversacion, enviar_mensaje, enviar_mensajes_lote, marcar_visto, marcar_visto_lote, total_no_leidos, catalog_generos,
     crear_solicitud_intercambio, listar_solicitudes_recibidas, listar_solicitudes_enviadas,
     aceptar_solicitud, rechazar_solicitud, proponer_encuentro, confirmar_encuentro,
     generar_codigo, completar_intercambio, cancelar_solicitud, cancelar_intercambio,
@@ -35,11 +35,15 @@ urlpatterns = [
     
     # --- NUEVAS URLs PARA SOLICITUDES ---
     path('solicitudes/crear/', views.crear_solicitud_intercambio, name='solicitud-crear'),
+    path('solicitudes/crear-lote/', views.crear_solicitudes_lote, name='solicitud-crear-lote'),
     path('solicitudes/recibidas/', views.listar_solicitudes_recibidas, name='solicitudes-recibidas'),
     path('solicitudes/enviadas/', views.listar_solicitudes_enviadas, name='solicitudes-enviadas'),
     path('solicitudes/<int:solicitud_id>/aceptar/', views.aceptar_solicitud, name='solicitud-aceptar'),
     path('solicitudes/<int:solicitud_id>/rechazar/', views.rechazar_solicitud, name='solicitud-rechazar'),
     path('solicitudes/ofertas-ocupadas/', libros_ofrecidos_ocupados),
+    path('users/<int:user_id>/matches/', views.coincidencias_usuario, name='coincidencias-usuario'),
+    path('favoritos/', views.favoritos_view, name='favoritos'),
+    path('favoritos/contiene/', views.favoritos_contiene, name='favoritos-contiene'),
 
     # --- URLs ANTIGUAS (coméntalas o elimínalas) ---
     # path('intercambios/create/', crear_intercambio),
@@ -49,9 +53,12 @@ urlpatterns = [
 
      # Chats
     path('chat/<int:user_id>/conversaciones/', lista_conversaciones),        # 👈 FALTABA
+    path('chat/<int:user_id>/unread/', total_no_leidos),                     # badge del app
     path('chat/conversacion/<int:conversacion_id>/mensajes/', mensajes_de_conversacion),
     path('chat/conversacion/<int:conversacion_id>/enviar/',   enviar_mensaje),
+    path('chat/conversacion/<int:conversacion_id>/enviar-lote/', enviar_mensajes_lote),  # cola offline
     path('chat/conversacion/<int:conversacion_id>/visto/',    marcar_visto), # 👈 recomendable agregar
+    path('chat/visto/', marcar_visto_lote),                                  # "marcar todo como leído"
 
     #COMPLETAR INTERCAMBIO
     path('intercambios/<int:intercambio_id>/proponer/', proponer_encuentro),
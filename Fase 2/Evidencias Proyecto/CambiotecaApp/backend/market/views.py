@@ -9,15 +9,16 @@ from rest_framework import serializers as drf_serializers
 
 from django.db.models import (
     Q, F, Value, Count, IntegerField,
-    Exists, Subquery, OuterRef, Max, Avg,BooleanField, Case, When
+    Exists, Subquery, OuterRef, Max, Avg,BooleanField, Case, When, Sum
 )
 from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 
 from rest_framework import permissions, viewsets, status
-from rest_framework.decorators import action, api_view, permission_classes, parser_classes
+from rest_framework.decorators import action, api_view, permission_classes, parser_classes, renderer_classes
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 
@@ -28,7 +29,14 @@ from django.db import IntegrityError, transaction
 
 
 from django.utils.dateparse import parse_datetime
-from .constants import SOLICITUD_ESTADO, INTERCAMBIO_ESTADO
+from .constants import SOLICITUD_ESTADO, INTERCAMBIO_ESTADO, LIBRO_PUBLICACION
+from .chat_archivo import CAMPOS_MENSAJE, leer_archivo, ultimo_id_archivado
+from .libro_borrado import LibroEnIntercambioCompletado, marcar_eliminado
+from . import feed
+from .publicacion import PUBLICADOS, intercambiado, libros_de_intercambios, recalcular
+from . import coincidencias, facetas, favoritos, sugerencias, ubicacion
+from core import actividad, notificaciones
+from core.authentication import usuario_id
 
 inter_prefetch = Prefetch(
     'intercambio',
@@ -78,50 +86,73 @@ def _save_book_image(file_obj) -> str:
 # Libros (read-only)
 # =========================
 
-active_ix = Exists(
-    Intercambio.objects.filter(
-        Q(id_libro_ofrecido_aceptado=OuterRef('pk')) |
-        Q(id_solicitud__id_libro_deseado=OuterRef('pk'))
-    ).filter(estado_intercambio__in=['Pendiente','Aceptado'])
-)
-
-
 class LibroViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = LibroSerializer
     permission_classes = [permissions.AllowAny]
 
+    def _usuario_actual(self):
+        return _int_or_none(usuario_id(self.request, self.request.query_params.get('user_id')))
+
+    def get_serializer_context(self):
+        ctx = super().get_serializer_context()
+        uid = self._usuario_actual()
+        if uid:
+            ctx['favoritos'] = favoritos.ids_de(uid)  # is_favorito sin una consulta por card
+        return ctx
+
     def get_queryset(self):
+        # en negociación / disponible ya vienen en la columna estado_publicacion
         qs = (Libro.objects
-              .select_related('id_usuario')
-              .annotate(en_negociacion=active_ix)  # 👈
-              .annotate(
-                  public_disponible=Case(
-                      When(disponible=True, en_negociacion=False, then=Value(True)),
-                      default=Value(False),
-                      output_field=BooleanField(),
-                  )
-              )
+              .select_related('id_usuario', 'id_genero')
               .all()
               .order_by('-id_libro'))
 
-        q = self.request.query_params.get('query')
+        q = facetas.normalizar(self.request.query_params.get('query'))  # igual que la clave de facetas
         if q:
             qs = qs.filter(
                 Q(titulo__icontains=q) |
                 Q(autor__icontains=q) |
                 Q(id_genero__nombre__icontains=q)
             )
+
+        # por zona del dueño: columnas copiadas en libro (ix_libro_region / ix_libro_comuna)
+        # y por género (facetas)
+        for param, campo in (('region', 'id_region_id'), ('comuna', 'id_comuna_id'),
+                             ('genero', 'id_genero_id')):
+            raw = self.request.query_params.get(param)
+            if raw in (None, ''):
+                continue
+            valor = _int_or_none(raw)
+            if valor is None:
+                raise drf_serializers.ValidationError({param: "Debe ser un id numérico."})
+            qs = qs.filter(**{campo: valor})
+
+        for param in ('estado', 'tipo_tapa'):
+            valor = facetas.normalizar(self.request.query_params.get(param))
+            if valor:
+                qs = qs.filter(**{f'{param}__iexact': valor})
         return qs
 
+    @action(detail=False, methods=['get'])
+    def facetas(self, request):
+        """Conteos por género/estado/tipo_tapa/comuna con los mismos filtros del listado."""
+        return Response(facetas.facetas(self.get_queryset(), request.query_params))
+
+    @action(detail=False, methods=['get'], url_path='suggest')
+    def sugerencias(self, request):
+        """Autocompletado de títulos/autores desde el índice en memoria (market/sugerencias.py)."""
+        q = (request.query_params.get('q') or '').strip()
+        k = _int_or_none(request.query_params.get('k')) or 8
+        return Response({"q": q, "sugerencias": sugerencias.sugerir(q, k) if q else []})
+
     @action(detail=False, methods=['get'])
     def latest(self, request):
-        qs = (
-            Libro.objects
-            .annotate(en_negociacion=active_ix)
-            .filter(disponible=True, en_negociacion=False)  # 👈 no mostrar en negociación
-            .order_by('-fecha_subida', '-id_libro')[:10]
-        )
-        data = LibroSerializer(qs, many=True).data
+        # top 10 disponibles (no en negociación), servido desde caché: ver market/feed.py
+        data = feed.latest()
+        uid = self._usuario_actual()
+        if uid:
+            favs = favoritos.ids_de(uid)
+            data = [dict(b, is_favorito=b['id_libro'] in favs) for b in data]
         return Response(data)
 
     @action(detail=False, methods=['get'])
@@ -168,7 +199,8 @@ class LibroViewSet(viewsets.ReadOnlyModelViewSet):
         out = []
         for k in top_keys:
             title = display_map[k]
-            repeticiones = Libro.objects.filter(titulo__iexact=title, disponible=True).count()
+            repeticiones = Libro.objects.filter(
+                titulo__iexact=title, estado_publicacion=LIBRO_PUBLICACION["DISPONIBLE"]).count()
             out.append({
                 "titulo": title,
                 "total_intercambios": acc[k],
@@ -201,6 +233,7 @@ def create_book(request):
         dt = timezone.now()
 
     try:
+        comuna_id, region_id = ubicacion.de_usuario(int(data["id_usuario"]))
         libro = Libro.objects.create(
             titulo=data["titulo"],
             isbn=str(data["isbn"]),
@@ -213,8 +246,17 @@ def create_book(request):
             id_usuario_id=int(data["id_usuario"]),
             id_genero_id=int(data["id_genero"]),
             disponible=bool(data.get("disponible", True)),
+            estado_publicacion=LIBRO_PUBLICACION[
+                "DISPONIBLE" if bool(data.get("disponible", True)) else "RETIRADO"
+            ],
             fecha_subida=dt,            # 👈 imprescindible
+            id_comuna_id=comuna_id,
+            id_region_id=region_id,
         )
+        feed.invalidar()
+        sugerencias.libro_cambiado(despues=(libro.titulo, libro.autor))
+        coincidencias.libros_cambiados([libro.id_libro])
+        actividad.registrar(request, libro.id_usuario_id, "libro_creado", libro.id_libro)
         return Response({"id": libro.id_libro}, status=201)
     except Exception as e:
         return Response({"detail": f"No se pudo crear: {e}"}, status=400)
@@ -224,12 +266,7 @@ def create_book(request):
 # =========================
 
 def _book_locked_by_completed(libro_id: int) -> bool:
-    return Intercambio.objects.filter(
-        estado_intercambio="Completado"
-    ).filter(
-        Q(id_libro_ofrecido_aceptado_id=libro_id) |
-        Q(id_solicitud__id_libro_deseado_id=libro_id)
-    ).exists()
+    return intercambiado(libro_id)
 
 
 @api_view(["POST"])
@@ -461,27 +498,11 @@ def my_books(request):
     u = Usuario.objects.filter(pk=user_id).select_related("comuna").first()
     comuna_nombre = getattr(getattr(u, "comuna", None), "nombre", None)
 
-    # ¿En qué libros hay un intercambio Completado (en cualquiera de los dos roles)?
-    book_ids = list(qs.values_list("id_libro", flat=True))
-    completed_acc = set(
-        Intercambio.objects.filter(
-            estado_intercambio="Completado",
-            id_libro_ofrecido_aceptado_id__in=book_ids
-        ).values_list("id_libro_ofrecido_aceptado_id", flat=True)
-    )
-    completed_des = set(
-        Intercambio.objects.filter(
-            estado_intercambio="Completado",
-            id_solicitud__id_libro_deseado_id__in=book_ids
-        ).values_list("id_solicitud__id_libro_deseado_id", flat=True)
-    )
-    completed_any = completed_acc | completed_des
-
     data = []
     for b in qs:
         img_rel = (b.first_image or "").replace("\\", "/")
         has_new = int(getattr(b, "max_activity_id", 0) or 0) > int(getattr(b, "last_seen", 0) or 0)
-        editable = bool(b.disponible) and (b.id_libro not in completed_any)
+        editable = b.estado_publicacion in PUBLICADOS
 
         data.append({
             "id": b.id_libro,
@@ -584,21 +605,7 @@ def my_books_with_history(request):
     u = Usuario.objects.filter(pk=user_id).select_related("comuna").first()
     comuna_nombre = getattr(getattr(u, "comuna", None), "nombre", None)
 
-    # ¿En qué libros hay un intercambio Completado (en cualquiera de los dos roles)?
     book_ids = list(qs.values_list("id_libro", flat=True))
-    completed_acc = set(
-        Intercambio.objects.filter(
-            estado_intercambio="Completado",
-            id_libro_ofrecido_aceptado_id__in=book_ids
-        ).values_list("id_libro_ofrecido_aceptado_id", flat=True)
-    )
-    completed_des = set(
-        Intercambio.objects.filter(
-            estado_intercambio="Completado",
-            id_solicitud__id_libro_deseado_id__in=book_ids
-        ).values_list("id_solicitud__id_libro_deseado_id", flat=True)
-    )
-    completed_any = completed_acc | completed_des
 
     # ======= Armado de historial (ambos roles) =======
     # Rol "deseado": solicitudes que apuntan a mis libros
@@ -688,7 +695,7 @@ def my_books_with_history(request):
     for b in qs:
         img_rel = (b.first_image or "").replace("\\", "/")
         has_new = int(getattr(b, "max_activity_id", 0) or 0) > int(getattr(b, "last_seen", 0) or 0)
-        editable = bool(b.disponible) and (b.id_libro not in completed_any)
+        editable = b.estado_publicacion in PUBLICADOS
 
         # ordenar historial y truncar por limit
         raw_items = sorted(items_by_book.get(b.id_libro, []),
@@ -771,19 +778,13 @@ def update_book(request, libro_id: int):
         return Response({"detail": "Libro no encontrado."}, status=404)
 
     # 🔒 Si el libro aparece en un intercambio COMPLETADO (en cualquier rol), no se puede editar
-    locked = Intercambio.objects.filter(
-        estado_intercambio="Completado"
-    ).filter(
-        Q(id_libro_ofrecido_aceptado_id=libro_id) |
-        Q(id_solicitud__id_libro_deseado_id=libro_id)
-    ).exists()
-
-    if locked:
+    if libro.estado_publicacion == LIBRO_PUBLICACION["INTERCAMBIADO"]:
         return Response(
             {"detail": "No se puede editar: el libro ya está asociado a un intercambio 'Completado'."},
             status=status.HTTP_409_CONFLICT
         )
 
+    antes = (libro.titulo, libro.autor)
     allowed = {
         "titulo", "autor", "isbn", "anio_publicacion", "estado",
         "descripcion", "editorial", "tipo_tapa", "disponible", "id_genero"
@@ -844,11 +845,18 @@ def update_book(request, libro_id: int):
         try:
             # Nota: para FK usamos el nombre del campo (id_genero), no *_id
             # Django resuelve la columna correcta.
-            libro.save(update_fields=list(set(changed)))
+            with transaction.atomic():
+                libro.save(update_fields=list(set(changed)))
+                if "disponible" in changed:
+                    recalcular([libro.id_libro])
+                else:
+                    feed.invalidar()
+                sugerencias.libro_cambiado(antes, (libro.titulo, libro.autor))
         except IntegrityError as e:
             return Response({"detail": f"Restricción de integridad: {e}"}, status=400)
         except Exception as e:
             return Response({"detail": f"No se pudo actualizar: {e}"}, status=400)
+        actividad.registrar(request, usuario_id(request) or libro.id_usuario_id, "libro_editado", libro.id_libro)
 
     return Response({
         "id": libro.id_libro,
@@ -873,128 +881,27 @@ from django.db.models import Q
 @api_view(["DELETE"])
 @permission_classes([AllowAny])  # en prod: IsAuthenticated
 def delete_book(request, libro_id: int):
-    libro = Libro.objects.select_related('id_usuario').filter(pk=libro_id).first()
-    if not libro:
-        return Response({"detail": "Libro no encontrado."}, status=404)
-
     # (Opcional) Sólo el dueño puede borrar
     # user_id = request.query_params.get("user_id")
-    # if not user_id or int(user_id) != libro.id_usuario_id:
+    # if not user_id or not Libro.objects.filter(pk=libro_id, id_usuario_id=user_id).exists():
     #     return Response({"detail": "No autorizado."}, status=403)
 
-    # 🔒 Bloquea si el libro aparece en un intercambio COMPLETADO (en cualquier rol)
-    completed = (
-        Intercambio.objects
-        .filter(estado_intercambio="Completado")
-        .filter(
-            Q(id_libro_ofrecido_aceptado_id=libro_id) |
-            Q(id_solicitud__id_libro_deseado_id=libro_id)
-        )
-        .exists()
-    )
-    if completed:
+    try:
+        fila = Libro.objects.filter(pk=libro_id).values_list("titulo", "autor", "id_usuario_id").first()
+        # soft-delete: la cascada y los archivos los borra el purgador
+        if not marcar_eliminado(libro_id):
+            return Response({"detail": "Libro no encontrado."}, status=404)
+        feed.invalidar()
+        sugerencias.libro_cambiado(antes=fila[:2] if fila else None)
+        actividad.registrar(request, usuario_id(request) or (fila and fila[2]), "libro_eliminado", libro_id)
+        return Response(status=204)
+
+    except LibroEnIntercambioCompletado:
+        # 🔒 el libro aparece en un intercambio COMPLETADO (en cualquier rol)
         return Response(
             {"detail": "No se puede eliminar: el libro participa en un intercambio 'Completado'."},
             status=status.HTTP_409_CONFLICT
         )
-
-    try:
-        with transaction.atomic():
-            # =========================================================
-            # 1) Intercambios donde este libro fue el ACEPTADO (no completados)
-            #    → actualizar solicitud y borrar intercambio
-            # =========================================================
-            inter_qs = (
-                Intercambio.objects
-                .select_for_update()
-                .filter(id_libro_ofrecido_aceptado_id=libro_id)
-                .exclude(estado_intercambio="Completado")
-            )
-
-            # Aceptados → Cancelada
-            inter_acc = list(
-                inter_qs.filter(estado_intercambio="Aceptado")
-                        .values_list("id_intercambio", "id_solicitud_id")
-            )
-            if inter_acc:
-                inter_ids = [i for (i, _) in inter_acc]
-                sol_ids   = [s for (_, s) in inter_acc]
-                SolicitudIntercambio.objects.filter(pk__in=sol_ids).update(
-                    estado="Cancelada", actualizada_en=timezone.now()
-                )
-                Intercambio.objects.filter(pk__in=inter_ids).delete()
-
-            # Pendientes → Rechazada (por si existieran)
-            inter_pen = list(
-                inter_qs.filter(estado_intercambio="Pendiente")
-                        .values_list("id_intercambio", "id_solicitud_id")
-            )
-            if inter_pen:
-                inter_ids = [i for (i, _) in inter_pen]
-                sol_ids   = [s for (_, s) in inter_pen]
-                SolicitudIntercambio.objects.filter(pk__in=sol_ids).update(
-                    estado="Rechazada", actualizada_en=timezone.now()
-                )
-                Intercambio.objects.filter(pk__in=inter_ids).delete()
-
-            # =========================================================
-            # 2) Solicitudes donde este libro es el DESEADO (activas)
-            #    → Aceptadas → Cancelada ; Pendientes → Rechazada
-            # =========================================================
-            sol_qs = (
-                SolicitudIntercambio.objects
-                .select_for_update()
-                .filter(id_libro_deseado_id=libro_id)
-                .exclude(estado__in=["Rechazada", "Cancelada"])
-            )
-
-            sol_aceptadas_ids = list(
-                sol_qs.filter(estado="Aceptada").values_list("id_solicitud", flat=True)
-            )
-            if sol_aceptadas_ids:
-                SolicitudIntercambio.objects.filter(pk__in=sol_aceptadas_ids).update(
-                    estado="Cancelada", actualizada_en=timezone.now()
-                )
-                Intercambio.objects.filter(id_solicitud_id__in=sol_aceptadas_ids).exclude(
-                    estado_intercambio="Completado"
-                ).delete()
-
-            sol_pend_ids = list(
-                sol_qs.filter(estado="Pendiente").values_list("id_solicitud", flat=True)
-            )
-            if sol_pend_ids:
-                SolicitudIntercambio.objects.filter(pk__in=sol_pend_ids).update(
-                    estado="Rechazada", actualizada_en=timezone.now()
-                )
-                Intercambio.objects.filter(id_solicitud_id__in=sol_pend_ids).delete()
-
-            # =========================================================
-            # 3) Limpiar dependencias sin CASCADE
-            # =========================================================
-            try:
-                from .models import Favorito
-                Favorito.objects.filter(id_libro_id=libro_id).delete()
-            except Exception:
-                pass
-
-            LibroSolicitudesVistas.objects.filter(id_libro_id=libro_id).delete()
-
-            for im in ImagenLibro.objects.filter(id_libro_id=libro_id):
-                rel = (im.url_imagen or '').replace('\\', '/')
-                im.delete()
-                try:
-                    if rel:
-                        default_storage.delete(rel)
-                except Exception:
-                    pass
-
-            # =========================================================
-            # 4) Finalmente, eliminar el libro
-            # =========================================================
-            libro.delete()
-
-        return Response(status=204)
-
     except IntegrityError as e:
         return Response({"detail": f"Restricción de integridad: {e}"}, status=400)
     except Exception as e:
@@ -1055,9 +962,9 @@ def crear_intercambio(request):
     if ls.id_usuario_id != uid_ofr:
         return Response({"detail": "El libro solicitado no pertenece al usuario destino."}, status=400)
 
-    if not lo.disponible:
+    if lo.estado_publicacion not in PUBLICADOS:
         return Response({"detail": "Tu libro ofrecido no está disponible."}, status=400)
-    if not ls.disponible:
+    if ls.estado_publicacion not in PUBLICADOS:
         return Response({"detail": "El libro solicitado ya no está disponible."}, status=400)
 
     # Evitar duplicados 'Pendiente' entre las mismas 4 entidades
@@ -1117,8 +1024,11 @@ def responder_intercambio(request, intercambio_id: int):
     if not it:
         return Response({"detail": "Intercambio no encontrado"}, status=404)
 
-    it.estado_intercambio = estado
-    it.save(update_fields=["estado_intercambio"])
+    with transaction.atomic():
+        it.estado_intercambio = estado
+        it.save(update_fields=["estado_intercambio"])
+        recalcular(libros_de_intercambios(Intercambio.objects.filter(pk=it.pk)))
+    actividad.registrar(request, usuario_id(request), f"intercambio_{estado.lower()}", intercambio_id)
     return Response({"ok": True})
 
 
@@ -1264,7 +1174,7 @@ def lista_conversaciones(request, user_id: int):
     SELECT
     c.id_conversacion,
     c.actualizado_en                         AS ultimo_enviado_en,
-    cm.cuerpo                                AS ultimo_mensaje,
+    COALESCE(cm.cuerpo, ca.ultimo_mensaje)   AS ultimo_mensaje,
     other_u.id_usuario                       AS otro_usuario_id,
     other_u.nombre_usuario                   AS nombre_usuario,
     other_u.nombres                          AS nombres,
@@ -1272,7 +1182,7 @@ def lista_conversaciones(request, user_id: int):
     c.titulo                                 AS titulo_chat,
     i.id_intercambio                         AS id_intercambio,
     ls.titulo                                AS libro_solicitado_titulo,
-    GREATEST(COALESCE(c.ultimo_id_mensaje,0) - COALESCE(me.ultimo_visto_id_mensaje,0), 0) AS unread_count
+    COALESCE(me.no_leidos, 0)                AS unread_count
     FROM conversacion c
     JOIN conversacion_participante me
     ON me.id_conversacion = c.id_conversacion
@@ -1285,6 +1195,8 @@ def lista_conversaciones(request, user_id: int):
     ON other_u.id_usuario = other_p.id_usuario
     LEFT JOIN conversacion_mensaje cm
     ON cm.id_mensaje = c.ultimo_id_mensaje
+    LEFT JOIN conversacion_archivo ca
+    ON ca.id_conversacion = c.id_conversacion
     LEFT JOIN intercambio i
     ON i.id_intercambio = c.id_intercambio
     LEFT JOIN solicitud_intercambio si
@@ -1341,7 +1253,7 @@ def calificar_intercambio(request, intercambio_id: int):
 
     # IDs y datos
     try:
-        user_id = int(request.data.get("user_id"))
+        user_id = int(usuario_id(request, request.data.get("user_id")))
         puntuacion = int(request.data.get("puntuacion"))
     except (TypeError, ValueError):
         return Response({"detail": "user_id/puntuacion inválidos."}, status=400)
@@ -1377,84 +1289,511 @@ def calificar_intercambio(request, intercambio_id: int):
 
 
 
+MENSAJES_LIMIT_DEFAULT = 50
+MENSAJES_LIMIT_MAX = 200
+MENSAJES_CONTEXTO = 10  # mensajes ya vistos que acompañan a since_visto
+MENSAJE_COLS = ("id_mensaje", "emisor_id", "cuerpo", "enviado_en", "eliminado")
+MENSAJE_FIELDS = CAMPOS_MENSAJE
+
+
+class CompactJSONRenderer(JSONRenderer):
+    """Accept: application/vnd.cambioteca.compact+json -> filas como arrays (sin repetir claves)."""
+    media_type = "application/vnd.cambioteca.compact+json"
+    format = "compact"
+
+
+def _int_or_none(raw):
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        return None
+
+
+# Los ids archivados son todos menores que los que quedan en la tabla caliente
+# (archivar_conversacion mueve todo hasta el último). Se pagina primero sobre la
+# tabla y el archivo (`archivo`: callable que lo lee, o None) solo se abre si la
+# página no alcanza o el cursor cae dentro de él.
+
+def _hacia_atras(base, archivo, hasta, n):
+    """Últimas `n` filas con id < hasta (None = sin tope), en orden ASC."""
+    qs = base if hasta is None else base.filter(id_mensaje__lt=hasta)
+    rows = list(qs.order_by('-id_mensaje').values_list(*MENSAJE_FIELDS)[:n])
+    rows.reverse()
+    if len(rows) < n and archivo is not None:
+        viejas = [r for r in archivo() if hasta is None or r[0] < hasta]
+        rows = viejas[-(n - len(rows)):] + rows
+    return rows
+
+
+def _hacia_adelante(base, archivo, desde, n=None):
+    """Primeras `n` filas (None = todas) con id > desde (None = desde el inicio), ASC."""
+    rows = []
+    if archivo is not None:
+        rows = [r for r in archivo() if desde is None or r[0] > desde]
+        if n is not None:
+            rows = rows[:n]
+            if len(rows) == n:
+                return rows
+    qs = base if desde is None else base.filter(id_mensaje__gt=desde)
+    qs = qs.order_by('id_mensaje').values_list(*MENSAJE_FIELDS)
+    return rows + list(qs if n is None else qs[:n - len(rows)])
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@renderer_classes([JSONRenderer, CompactJSONRenderer])
 def mensajes_de_conversacion(request, conversacion_id: int):
-    # base: todos los mensajes de la conversación en orden ASC por id
-    qs = (ConversacionMensaje.objects
-          .filter(id_conversacion_id=conversacion_id)
-          .order_by('id_mensaje'))
-
-    # soporta ?after= / ?after_id= (solo mensajes nuevos)
-    after = request.query_params.get('after') or request.query_params.get('after_id')
-    if after:
-        try:
-            after_i = int(after)
-            qs = qs.filter(id_mensaje__gt=after_i)
-        except (TypeError, ValueError):
-            pass  # ignoramos 'after' inválido y devolvemos todo
+    """
+    Siempre en orden ASC por id_mensaje (rango sobre el índice de id_conversacion).
+      ?after=<id>                      solo mensajes nuevos (polling)
+      ?before=<id>&limit=N             ventana hacia atrás; sin before = últimos N
+      ?since_visto=1&id_usuario=<id>   últimos vistos de contexto + no leídos
+      (sin parámetros)                 historial completo, como antes
+    Si el chat fue archivado (archivar_chats) se mezcla el archivo frío con lo caliente.
+    Formato compacto con ?compact=1 o Accept: application/vnd.cambioteca.compact+json
+      -> { "cols": [...], "rows": [[...], ...] }
+    """
+    params = request.query_params
+    base = ConversacionMensaje.objects.filter(id_conversacion_id=conversacion_id)
+
+    limit = _int_or_none(params.get('limit'))
+    if limit is not None:
+        limit = max(1, min(limit, MENSAJES_LIMIT_MAX))
+    after = _int_or_none(params.get('after') or params.get('after_id'))
+    before = _int_or_none(params.get('before'))
+    user_id = _int_or_none(params.get('id_usuario'))
+
+    visto = None
+    if params.get('since_visto') and user_id is not None:
+        visto = (ConversacionParticipante.objects
+                 .filter(id_conversacion_id=conversacion_id, id_usuario_id=user_id)
+                 .values_list('ultimo_visto_id_mensaje', flat=True)
+                 .first()) or 0
+
+    # chat archivado (archivar_chats): el archivo frío va antes de la tabla caliente
+    arch_max = ultimo_id_archivado(conversacion_id)
+    archivo, leido = None, []
+    if arch_max is not None:
+        def archivo():
+            # se lee una sola vez por request, aunque lo pidan las dos mitades de since_visto
+            if not leido:
+                leido.append(leer_archivo(conversacion_id, arch_max))
+            return leido[0]
+
+    def archivo_desde(desde):
+        return archivo if arch_max is not None and (desde is None or desde < arch_max) else None
+
+    if visto is not None:
+        rows = (_hacia_atras(base, archivo, visto + 1, MENSAJES_CONTEXTO)
+                + _hacia_adelante(base, archivo_desde(visto), visto, limit or MENSAJES_LIMIT_DEFAULT))
+    elif before is not None or (limit is not None and after is None):
+        # página más reciente primero; el cliente pide la siguiente con before=<primer id>
+        rows = _hacia_atras(base, archivo, before, limit or MENSAJES_LIMIT_DEFAULT)
+    else:
+        rows = _hacia_adelante(base, archivo_desde(after), after, limit)
+
+    compact = (getattr(request.accepted_renderer, 'format', None) == 'compact'
+               or params.get('compact') in ('1', 'true'))
+    if compact:
+        data = {"cols": list(MENSAJE_COLS), "rows": [list(r) for r in rows]}
+        if visto is not None:
+            data["ultimo_visto_id_mensaje"] = visto
+        return Response(data, status=200)
 
-    data = [{
-        "id_mensaje": m.id_mensaje,
-        "emisor_id": m.id_usuario_emisor_id,
-        "cuerpo": m.cuerpo,
-        "enviado_en": m.enviado_en,
-        "eliminado": m.eliminado,
-        # opcional si existe en tu modelo:
-        # "editado_en": getattr(m, "editado_en", None),
-    } for m in qs]
+    resp = Response([dict(zip(MENSAJE_COLS, r)) for r in rows], status=200)
+    if visto is not None:
+        resp['X-Ultimo-Visto'] = str(visto)
+    return resp
 
-    return Response(data, status=200)
+
+CHAT_LOTE_MAX = 50
+
+
+def _chat_escribible(conversacion_id: int):
+    """
+    Devuelve un Response de error si no se puede escribir en la conversación
+    (no existe o el intercambio está Completado); None si está OK.
+    """
+    row = (Conversacion.objects
+           .filter(pk=conversacion_id)
+           .values_list("id_conversacion", "id_intercambio__estado_intercambio")
+           .first())
+    if not row:
+        return Response({"detail": "Conversación no existe."}, status=404)
+    if (row[1] or "").lower() == INTERCAMBIO_ESTADO["COMPLETADO"].lower():
+        return Response({"detail": "El intercambio fue completado. El chat es solo lectura."},
+                        status=status.HTTP_403_FORBIDDEN)
+    return None
+
+
+def _clave_idempotencia(raw) -> str | None:
+    clave = str(raw or "").strip()[:64]
+    return clave or None
+
+
+def _bloquear_conversacion(conversacion_id: int):
+    """
+    Primera sentencia de la transacción de envío: bloquea la fila de
+    conversacion (la que _post_envio actualiza igual). Los envíos a una misma
+    conversación quedan en fila, así lo que lee el lote antes del INSERT sigue
+    valiendo después, y los dos caminos toman los locks en el mismo orden.
+    """
+    list(Conversacion.objects.select_for_update().filter(pk=conversacion_id).values_list('pk'))
+
+
+def _post_envio(conversacion_id: int, emisor_id: int, max_id: int, nuevos: int):
+    """
+    Dentro de la misma transacción del INSERT:
+    - ultimo_id_mensaje solo avanza (GREATEST), aunque haya emisores concurrentes
+    - +nuevos no leídos para los demás participantes
+    - una notificación "N mensajes nuevos" por conversación (se agrupan)
+    """
+    Conversacion.objects.filter(pk=conversacion_id).update(
+        actualizado_en=timezone.now(),
+        ultimo_id_mensaje=Greatest(Coalesce(F('ultimo_id_mensaje'), Value(0)), Value(max_id)),
+    )
+    otros = (ConversacionParticipante.objects
+             .filter(id_conversacion_id=conversacion_id)
+             .exclude(id_usuario_id=emisor_id))
+    otros.update(no_leidos=F('no_leidos') + nuevos)
+    notificaciones.notificar([
+        notificaciones.evento(u, "mensaje", conversacion_id, n=nuevos)
+        for u in otros.values_list('id_usuario_id', flat=True)
+    ])
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def enviar_mensaje(request, conversacion_id: int):
-    emisor_id = int(request.data.get('id_usuario_emisor'))
+    """
+    Body: { "id_usuario_emisor": 1, "cuerpo": "...", "client_id": "uuid-del-móvil" }
+    client_id (o header Idempotency-Key) es opcional: si se repite, no se
+    inserta otro mensaje y se devuelve el id original (200 en vez de 201).
+    """
+    try:
+        emisor_id = int(usuario_id(request, request.data.get('id_usuario_emisor')))
+    except (TypeError, ValueError):
+        return Response({"detail": "id_usuario_emisor inválido."}, status=400)
     cuerpo = (request.data.get('cuerpo') or '').strip()
     if not cuerpo:
         return Response({"detail": "Mensaje vacío."}, status=400)
+    clave = _clave_idempotencia(request.data.get('client_id') or request.headers.get('Idempotency-Key'))
 
-    # 👇 traemos el intercambio y validamos estado
-    conv = (Conversacion.objects
-            .select_related("id_intercambio")
-            .filter(pk=conversacion_id).first())
-    if not conv:
-        return Response({"detail": "Conversación no existe."}, status=404)
+    # 👇 validamos estado del intercambio (una sola consulta con JOIN)
+    err = _chat_escribible(conversacion_id)
+    if err:
+        return err
 
-    ix = getattr(conv, "id_intercambio", None)
-    if ix and (ix.estado_intercambio or "").lower() == "completado":
-        return Response({"detail": "El intercambio fue completado. El chat es solo lectura."},
-                        status=status.HTTP_403_FORBIDDEN)
+    with transaction.atomic():
+        _bloquear_conversacion(conversacion_id)
+        try:
+            with transaction.atomic():
+                m = ConversacionMensaje.objects.create(
+                    id_conversacion_id=conversacion_id,
+                    id_usuario_emisor_id=emisor_id,
+                    cuerpo=cuerpo,
+                    enviado_en=timezone.now(),
+                    clave_idempotencia=clave,
+                )
+        except IntegrityError:
+            # reintento del mismo mensaje -> no-op (índice único por emisor + clave)
+            prev_id = None
+            if clave:
+                prev_id = (ConversacionMensaje.objects
+                           .filter(id_conversacion_id=conversacion_id,
+                                   id_usuario_emisor_id=emisor_id,
+                                   clave_idempotencia=clave)
+                           .values_list('id_mensaje', flat=True)
+                           .first())
+            if prev_id is None:
+                raise
+            return Response({"id_mensaje": prev_id, "duplicado": True}, status=200)
+
+        _post_envio(conversacion_id, emisor_id, m.id_mensaje, 1)
+
+    return Response({"id_mensaje": m.id_mensaje}, status=201)
 
-    m = ConversacionMensaje.objects.create(
-        id_conversacion=conv,
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def enviar_mensajes_lote(request, conversacion_id: int):
+    """
+    Cola offline del móvil en un solo request.
+    Body: { "id_usuario_emisor": 1, "mensajes": [ {"cuerpo": "...", "client_id": "..."}, ... ] }
+    Devuelve [{ client_id, id_mensaje, duplicado }] en el mismo orden.
+    """
+    try:
+        emisor_id = int(usuario_id(request, request.data.get('id_usuario_emisor')))
+    except (TypeError, ValueError):
+        return Response({"detail": "id_usuario_emisor inválido."}, status=400)
+
+    raw = request.data.get('mensajes')
+    if not isinstance(raw, list) or not raw:
+        return Response({"detail": "mensajes debe ser una lista no vacía."}, status=400)
+    if len(raw) > CHAT_LOTE_MAX:
+        return Response({"detail": f"Máximo {CHAT_LOTE_MAX} mensajes por lote."}, status=400)
+
+    items, vistos = [], set()
+    for it in raw:
+        if not isinstance(it, dict):
+            return Response({"detail": "Cada mensaje debe ser un objeto."}, status=400)
+        cuerpo = (it.get('cuerpo') or '').strip()
+        if not cuerpo:
+            return Response({"detail": "Mensaje vacío."}, status=400)
+        # sin client_id generamos uno, así podemos recuperar el id tras el bulk insert
+        clave = _clave_idempotencia(it.get('client_id')) or uuid.uuid4().hex
+        if clave not in vistos:
+            vistos.add(clave)
+            items.append((clave, cuerpo))
+
+    err = _chat_escribible(conversacion_id)
+    if err:
+        return err
+
+    claves = [c for c, _ in items]
+    base = ConversacionMensaje.objects.filter(
+        id_conversacion_id=conversacion_id,
         id_usuario_emisor_id=emisor_id,
-        cuerpo=cuerpo,
-        enviado_en=timezone.now()
+        clave_idempotencia__in=claves,
     )
-    Conversacion.objects.filter(pk=conversacion_id).update(
-        actualizado_en=timezone.now(),
-        ultimo_id_mensaje=m.id_mensaje
+
+    with transaction.atomic():
+        # sin el lock, un reintento concurrente con las mismas claves podía
+        # insertar entre esta lectura y el INSERT: el INSERT IGNORE descartaba
+        # nuestra fila y su id se contaba igual como nuevo (no_leidos doble)
+        _bloquear_conversacion(conversacion_id)
+        previos = set(base.values_list('clave_idempotencia', flat=True))
+        ahora = timezone.now()
+        ConversacionMensaje.objects.bulk_create([
+            ConversacionMensaje(
+                id_conversacion_id=conversacion_id,
+                id_usuario_emisor_id=emisor_id,
+                cuerpo=cuerpo,
+                enviado_en=ahora,
+                clave_idempotencia=clave,
+            )
+            for clave, cuerpo in items if clave not in previos
+        ], ignore_conflicts=True)
+
+        ids = dict(base.values_list('clave_idempotencia', 'id_mensaje'))
+        nuevos = [ids[c] for c in claves if c in ids and c not in previos]
+        if nuevos:
+            _post_envio(conversacion_id, emisor_id, max(nuevos), len(nuevos))
+
+    out = [{
+        "client_id": c,
+        "id_mensaje": ids.get(c),
+        "duplicado": c in previos,
+    } for c in claves]
+    return Response({"mensajes": out}, status=201 if nuevos else 200)
+
+
+def _marcar_vistas(user_id: int, conv_ids=None) -> int:
+    """
+    Un solo UPDATE: ultimo_visto_id_mensaje = conversacion.ultimo_id_mensaje
+    (mantenido por enviar_mensaje), sin retroceder nunca. Deja no_leidos en 0.
+    conv_ids=None -> todas las conversaciones del usuario.
+    """
+    ultimo_sq = (Conversacion.objects
+                 .filter(pk=OuterRef('id_conversacion'))
+                 .values('ultimo_id_mensaje')[:1])
+    qs = ConversacionParticipante.objects.filter(id_usuario_id=user_id)
+    if conv_ids is not None:
+        qs = qs.filter(id_conversacion_id__in=conv_ids)
+    return qs.update(
+        ultimo_visto_id_mensaje=Greatest(
+            Coalesce(F('ultimo_visto_id_mensaje'), Value(0)),
+            Coalesce(Subquery(ultimo_sq), Value(0)),
+        ),
+        visto_en=timezone.now(),
+        no_leidos=0,
     )
-    return Response({"id_mensaje": m.id_mensaje}, status=201)
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def marcar_visto(request, conversacion_id: int):
-    user_id = int(request.data.get('id_usuario'))
-    last_id = ConversacionMensaje.objects.filter(
-        id_conversacion_id=conversacion_id
-    ).aggregate(max_id=Max('id_mensaje'))['max_id'] or 0
-
-    ConversacionParticipante.objects.filter(
-        id_conversacion_id=conversacion_id, id_usuario_id=user_id
-    ).update(ultimo_visto_id_mensaje=last_id, visto_en=timezone.now())
+    try:
+        user_id = int(usuario_id(request, request.data.get('id_usuario')))
+    except (TypeError, ValueError):
+        return Response({"detail": "id_usuario inválido."}, status=400)
+    _marcar_vistas(user_id, [conversacion_id])
 
+    last_id = (ConversacionParticipante.objects
+               .filter(id_conversacion_id=conversacion_id, id_usuario_id=user_id)
+               .values_list('ultimo_visto_id_mensaje', flat=True)
+               .first()) or 0
     return Response({"ultimo_visto_id_mensaje": last_id})
 
 
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def marcar_visto_lote(request):
+    """
+    POST /api/chat/visto/
+    Body: { "id_usuario": 1, "conversaciones": [10, 11, 12] }
+    Sin "conversaciones" marca todas las del usuario ("marcar todo como leído").
+    """
+    try:
+        user_id = int(usuario_id(request, request.data.get('id_usuario')))
+    except (TypeError, ValueError):
+        return Response({"detail": "id_usuario inválido."}, status=400)
+
+    raw = request.data.get('conversaciones')
+    conv_ids = None
+    if raw is not None:
+        if not isinstance(raw, list):
+            return Response({"detail": "conversaciones debe ser una lista."}, status=400)
+        conv_ids = []
+        for x in raw:
+            try:
+                conv_ids.append(int(x))
+            except (TypeError, ValueError):
+                pass
+        if not conv_ids:
+            return Response({"ok": True, "actualizadas": 0})
+
+    n = _marcar_vistas(user_id, conv_ids)
+    return Response({"ok": True, "actualizadas": n})
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def total_no_leidos(request, user_id: int):
+    """
+    GET /api/chat/<user_id>/unread/
+    Total de mensajes no leídos (badge). Suma sobre el índice
+    (id_usuario, archivado, no_leidos), sin tocar conversacion_mensaje.
+    """
+    total = (ConversacionParticipante.objects
+             .filter(id_usuario_id=user_id, archivado=False)
+             .aggregate(total=Sum('no_leidos'))['total'] or 0)
+    return Response({"unread": int(total)})
+
+
+SOLICITUD_MAX_OFRECIDOS = 3
+SOLICITUD_LOTE_MAX = 20
+
+
+def _ids_unicos(raw, maximo=None):
+    """
+    Lista de ints sin repetir, en orden (ignora basura). None si `raw` no es
+    lista. Con `maximo`, una lista más larga ni se recorre: ValueError.
+    """
+    if not isinstance(raw, list):
+        return None
+    if maximo is not None and len(raw) > maximo:
+        raise ValueError(f"Máximo {maximo} libros por lote.")
+    ids = {}  # dict: pertenencia O(1) y conserva el orden
+    for x in raw:
+        try:
+            ids[int(x)] = None
+        except (TypeError, ValueError):
+            continue
+    return list(ids)
+
+
+def _estado_libros(solicitante_id, libro_ids):
+    """
+    Una sola consulta para todos los libros de la solicitud (deseados y ofrecidos):
+    dueño, si siguen publicados, si están en negociación (estado_publicacion)
+    y si el solicitante ya tiene una pendiente por ellos.
+    """
+    pendiente = SolicitudIntercambio.objects.filter(
+        id_usuario_solicitante_id=solicitante_id,
+        id_libro_deseado_id=OuterRef("pk"),
+        estado=SOLICITUD_ESTADO["PENDIENTE"],
+    )
+    filas = (Libro.objects
+             .filter(pk__in=libro_ids)
+             .annotate(ya_pendiente=Exists(pendiente))
+             .values_list("pk", "id_usuario_id", "estado_publicacion", "ya_pendiente"))
+    # id -> (dueño, publicado, comprometido, ya_pendiente)
+    return {pk: (dueno, est in PUBLICADOS, est == LIBRO_PUBLICACION["EN_NEGOCIACION"], pend)
+            for pk, dueno, est, pend in filas}
+
+
+def _error_ofrecidos(solicitante_id, ofrecidos_ids, estado):
+    faltantes = [lid for lid in ofrecidos_ids
+                 if lid not in estado or estado[lid][0] != solicitante_id or not estado[lid][1]]
+    if faltantes:
+        return Response(
+            {"detail": f"Algunos libros ofrecidos no son válidos / no te pertenecen / no están disponibles: {faltantes}"},
+            status=400
+        )
+    if any(estado[lid][2] for lid in ofrecidos_ids):
+        return Response({"detail": "Alguno de tus libros ofrecidos ya está comprometido en un intercambio aceptado."}, status=409)
+    return None
+
+
+def _error_deseado(solicitante_id, libro_deseado_id, estado):
+    """(status, detail) si no se puede pedir ese libro, o None."""
+    info = estado.get(libro_deseado_id)
+    if not info or not info[1]:
+        return 404, "El libro deseado no existe o no está disponible."
+    receptor_id, _, comprometido, ya_pendiente = info
+    if solicitante_id == receptor_id:
+        return 400, "No puedes enviar una solicitud a tu propio libro."
+    # bloqueo por “reservado lógico” (intercambio en curso)
+    if comprometido:
+        return 409, "Ese libro ya tiene un intercambio aceptado en curso."
+    if ya_pendiente:
+        return 400, "Ya existe una solicitud pendiente para este libro."
+    return None
+
+
+def _crear_solicitudes(solicitante_id, deseados, ofrecidos_ids):
+    """
+    deseados: [(id_libro_deseado, id_receptor)]. Inserta las solicitudes y todas
+    sus ofertas en bloque (llamar dentro de transaction.atomic()).
+    """
+    ahora = timezone.now()
+    lote = uuid.uuid4().hex
+    solicitudes = [
+        SolicitudIntercambio(
+            id_usuario_solicitante_id=solicitante_id,
+            id_usuario_receptor_id=receptor_id,
+            id_libro_deseado_id=deseado_id,
+            estado=SOLICITUD_ESTADO["PENDIENTE"],
+            creada_en=ahora,
+            actualizada_en=ahora,
+            lote=lote,
+        )
+        for deseado_id, receptor_id in deseados
+    ]
+    SolicitudIntercambio.objects.bulk_create(solicitudes)
+    if solicitudes and solicitudes[0].pk is None:
+        # MySQL no devuelve los ids de un INSERT múltiple: se leen por el token
+        # del lote (ix_solicitud_lote); el libro deseado no se repite en el lote
+        ids = dict(SolicitudIntercambio.objects.filter(lote=lote)
+                   .values_list("id_libro_deseado_id", "id_solicitud"))
+        for s in solicitudes:
+            s.pk = ids[s.id_libro_deseado_id]
+
+    SolicitudOferta.objects.bulk_create([
+        SolicitudOferta(id_solicitud_id=s.pk, id_libro_ofrecido_id=lid)
+        for s in solicitudes for lid in ofrecidos_ids
+    ])
+    # varias solicitudes por un mismo libro se agrupan en una notificación del receptor
+    notificaciones.notificar([
+        notificaciones.evento(receptor_id, "solicitud_nueva", deseado_id, deseado_id)
+        for deseado_id, receptor_id in deseados
+    ])
+    return solicitudes
+
+
+def _leer_ofrecidos(request):
+    try:
+        ofrecidos_ids = _ids_unicos(request.data.get("id_libros_ofrecidos", []), SOLICITUD_MAX_OFRECIDOS)
+    except ValueError:
+        return None, Response({"detail": "Debes ofrecer entre 1 y 3 libros."}, status=400)
+    if ofrecidos_ids is None:
+        return None, Response({"detail": "id_libros_ofrecidos debe ser una lista."}, status=400)
+    if not (1 <= len(ofrecidos_ids) <= SOLICITUD_MAX_OFRECIDOS):
+        return None, Response({"detail": "Debes ofrecer entre 1 y 3 libros."}, status=400)
+    return ofrecidos_ids, None
+
+
 @api_view(["POST"])
 @permission_classes([AllowAny])  # Cambia a [IsAuthenticated] en prod
 def crear_solicitud_intercambio(request):
@@ -1467,92 +1806,191 @@ def crear_solicitud_intercambio(request):
     }
     """
     try:
-        solicitante_id = int(request.data.get("id_usuario_solicitante"))
+        solicitante_id = int(usuario_id(request, request.data.get("id_usuario_solicitante")))
         libro_deseado_id = int(request.data.get("id_libro_deseado"))
     except (TypeError, ValueError):
         return Response({"detail": "IDs inválidos."}, status=400)
 
-    libros_raw = request.data.get("id_libros_ofrecidos", [])
-    if not isinstance(libros_raw, list):
-        return Response({"detail": "id_libros_ofrecidos debe ser una lista."}, status=400)
+    libros_ofrecidos_ids, err = _leer_ofrecidos(request)
+    if err:
+        return err
 
-    libros_ofrecidos_ids = []
-    for x in libros_raw:
-        try:
-            v = int(x)
-            if v not in libros_ofrecidos_ids:
-                libros_ofrecidos_ids.append(v)
-        except (TypeError, ValueError):
-            pass
+    if libro_deseado_id in libros_ofrecidos_ids:
+        return Response({"detail": "No puedes ofrecer el mismo libro que estás solicitando."}, status=400)
 
-    if not (1 <= len(libros_ofrecidos_ids) <= 3):
-        return Response({"detail": "Debes ofrecer entre 1 y 3 libros."}, status=400)
+    estado = _estado_libros(solicitante_id, [libro_deseado_id, *libros_ofrecidos_ids])
 
-    if libro_deseado_id in libros_ofrecidos_ids:
+    error = _error_deseado(solicitante_id, libro_deseado_id, estado)
+    if error and error[0] != 409:
+        return Response({"detail": error[1]}, status=error[0])
+    err = _error_ofrecidos(solicitante_id, libros_ofrecidos_ids, estado)
+    if err:
+        return err
+    if error:
+        return Response({"detail": error[1]}, status=error[0])
+
+    with transaction.atomic():
+        solicitud, = _crear_solicitudes(
+            solicitante_id, [(libro_deseado_id, estado[libro_deseado_id][0])], libros_ofrecidos_ids,
+        )
+
+    serializer = SolicitudIntercambioSerializer(solicitud)
+    return Response(serializer.data, status=201)
+
+
+@api_view(["POST"])
+@permission_classes([AllowAny])  # Cambia a [IsAuthenticated] en prod
+def crear_solicitudes_lote(request):
+    """
+    Varias solicitudes de una vez (p.ej. lista de deseos desde la búsqueda),
+    todas con la misma oferta.
+    Body:
+    {
+        "id_usuario_solicitante": 1,
+        "id_libros_deseados": [104, 105, 130],
+        "id_libros_ofrecidos": [101, 102]
+    }
+    Respuesta: { "creadas": [{id_solicitud, id_libro_deseado}],
+                 "errores": [{id_libro_deseado, status, detail}] }
+    """
+    try:
+        solicitante_id = int(usuario_id(request, request.data.get("id_usuario_solicitante")))
+    except (TypeError, ValueError):
+        return Response({"detail": "IDs inválidos."}, status=400)
+
+    try:
+        deseados_ids = _ids_unicos(request.data.get("id_libros_deseados", []), SOLICITUD_LOTE_MAX)
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=400)
+    if not deseados_ids:
+        return Response({"detail": "id_libros_deseados debe ser una lista con al menos un libro."}, status=400)
+
+    libros_ofrecidos_ids, err = _leer_ofrecidos(request)
+    if err:
+        return err
+    if set(deseados_ids) & set(libros_ofrecidos_ids):
         return Response({"detail": "No puedes ofrecer el mismo libro que estás solicitando."}, status=400)
 
+    estado = _estado_libros(solicitante_id, [*deseados_ids, *libros_ofrecidos_ids])
+    err = _error_ofrecidos(solicitante_id, libros_ofrecidos_ids, estado)
+    if err:
+        return err
+
+    validos, errores = [], []
+    for lid in deseados_ids:
+        error = _error_deseado(solicitante_id, lid, estado)
+        if error:
+            errores.append({"id_libro_deseado": lid, "status": error[0], "detail": error[1]})
+        else:
+            validos.append((lid, estado[lid][0]))
+
+    creadas = []
+    if validos:
+        with transaction.atomic():
+            creadas = _crear_solicitudes(solicitante_id, validos, libros_ofrecidos_ids)
+
+    return Response({
+        "creadas": [{"id_solicitud": s.pk, "id_libro_deseado": s.id_libro_deseado_id} for s in creadas],
+        "errores": errores,
+    }, status=201 if creadas else 400)
+
+# =========================
+# Favoritos
+# =========================
+@api_view(["GET", "POST"])
+@permission_classes([AllowAny])
+def favoritos_view(request):
+    """
+    GET  /api/favoritos/?user_id=1          -> { "ids": [..] }
+    POST /api/favoritos/  { "user_id": 1, "agregar": [10, 11], "quitar": [7] }
+         -> { "agregados": [..], "quitados": [..], "invalidos": [..] }
+    """
+    raw = request.query_params.get("user_id") if request.method == "GET" else request.data.get("user_id")
     try:
-        libro_deseado = Libro.objects.get(pk=libro_deseado_id, disponible=True)
-    except Libro.DoesNotExist:
-        return Response({"detail": "El libro deseado no existe o no está disponible."}, status=404)
+        user_id = int(usuario_id(request, raw))
+    except (TypeError, ValueError):
+        return Response({"detail": "user_id inválido."}, status=400)
 
-    receptor_id = libro_deseado.id_usuario_id
-    if solicitante_id == receptor_id:
-        return Response({"detail": "No puedes enviar una solicitud a tu propio libro."}, status=400)
+    if request.method == "GET":
+        return Response({"ids": sorted(favoritos.ids_de(user_id))})
 
-    ofrecidos_qs = Libro.objects.filter(
-        pk__in=libros_ofrecidos_ids,
-        id_usuario_id=solicitante_id,
-        disponible=True
-    ).values_list("id_libro", flat=True)
+    try:
+        agregar = _ids_unicos(request.data.get("agregar", []), favoritos.FAVORITOS_LOTE_MAX)
+        quitar = _ids_unicos(request.data.get("quitar", []), favoritos.FAVORITOS_LOTE_MAX)
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=400)
+    if agregar is None or quitar is None:
+        return Response({"detail": "agregar y quitar deben ser listas."}, status=400)
+    if not agregar and not quitar:
+        return Response({"detail": "Nada que cambiar."}, status=400)
+    if len(agregar) + len(quitar) > favoritos.FAVORITOS_LOTE_MAX:
+        return Response({"detail": f"Máximo {favoritos.FAVORITOS_LOTE_MAX} libros por lote."}, status=400)
 
-    validos = set(ofrecidos_qs)
-    faltantes = [lid for lid in libros_ofrecidos_ids if lid not in validos]
-    if faltantes:
-        return Response(
-            {"detail": f"Algunos libros ofrecidos no son válidos / no te pertenecen / no están disponibles: {faltantes}"},
-            status=400
-        )
+    return Response(favoritos.cambiar(user_id, agregar, quitar))
 
-    # === NUEVO: bloqueo por “reservado lógico” (intercambio Aceptado) ===
-    if Intercambio.objects.filter(
-        id_solicitud__id_libro_deseado_id=libro_deseado_id,
-        estado_intercambio__iexact=INTERCAMBIO_ESTADO["ACEPTADO"],
-    ).exists():
-        return Response({"detail": "Ese libro ya tiene un intercambio aceptado en curso."}, status=409)
 
-    if Intercambio.objects.filter(
-        id_libro_ofrecido_aceptado_id__in=libros_ofrecidos_ids,
-        estado_intercambio__iexact=INTERCAMBIO_ESTADO["ACEPTADO"],
-    ).exists():
-        return Response({"detail": "Alguno de tus libros ofrecidos ya está comprometido en un intercambio aceptado."}, status=409)
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def favoritos_contiene(request):
+    """
+    GET /api/favoritos/contiene/?user_id=1&ids=10,11,12
+    -> { "favoritos": [10, 12] }  (de esos ids, cuáles son favoritos)
+    """
+    try:
+        user_id = int(usuario_id(request, request.query_params.get("user_id")))
+    except (TypeError, ValueError):
+        return Response({"detail": "user_id inválido."}, status=400)
+    maximo = 2 * favoritos.FAVORITOS_LOTE_MAX
+    try:
+        # maxsplit: una lista enorme no se llega a partir entera
+        ids = _ids_unicos((request.query_params.get("ids") or "").split(",", maximo), maximo)
+    except ValueError:
+        return Response({"detail": f"Máximo {maximo} ids."}, status=400)
+    favs = favoritos.ids_de(user_id)
+    return Response({"favoritos": [i for i in ids if i in favs]})
 
-    ya_pendiente = SolicitudIntercambio.objects.filter(
-        id_usuario_solicitante_id=solicitante_id,
-        id_usuario_receptor_id=receptor_id,
-        id_libro_deseado_id=libro_deseado_id,
-        estado__iexact="pendiente",
-    ).exists()
-    if ya_pendiente:
-        return Response({"detail": "Ya existe una solicitud pendiente para este libro."}, status=400)
 
-    with transaction.atomic():
-        solicitud = SolicitudIntercambio.objects.create(
-            id_usuario_solicitante_id=solicitante_id,
-            id_usuario_receptor_id=receptor_id,
-            id_libro_deseado_id=libro_deseado_id,
-            estado=SOLICITUD_ESTADO["PENDIENTE"],
-            creada_en=timezone.now(),
-            actualizada_en=timezone.now(),
-        )
-        for lid in libros_ofrecidos_ids:
-            SolicitudOferta.objects.create(
-                id_solicitud=solicitud,
-                id_libro_ofrecido_id=lid
-            )
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def coincidencias_usuario(request, user_id: int):
+    """
+    GET /api/users/<id>/matches/?limite=20
+    Intercambios directos (tú quieres algo suyo y él algo tuyo) y ciclos de tres
+    según favoritos y libros disponibles. Ver market/coincidencias.py.
+    listo=false: el servidor aún está armando el grafo (listas vacías), reintentar.
+    """
+    limite = max(1, min(_int_or_none(request.query_params.get("limite")) or 20, 50))
+    res = coincidencias.para_usuario(user_id, limite)
+
+    # detalle para las cards: una consulta de libros y una de usuarios
+    libro_ids, usuario_ids = set(), set()
+    for d in res["directos"]:
+        usuario_ids.add(d["usuario"])
+        libro_ids.update(d["recibes"], d["entregas"])
+    for c in res["ciclos"]:
+        usuario_ids.update(c["usuarios"])
+        for paso in c["pasos"]:
+            libro_ids.update(paso["libros"])
+    libros = {row["id_libro"]: row for row in
+              Libro.objects.filter(pk__in=libro_ids).values("id_libro", "titulo", "autor")}
+    from core.models import Usuario
+    nombres = dict(Usuario.objects.filter(pk__in=usuario_ids).values_list("id_usuario", "nombre_usuario"))
+
+    def lib(ids):
+        return [libros[i] for i in ids if i in libros]
+
+    def usr(uid):
+        return {"id": uid, "nombre_usuario": nombres.get(uid)}
+
+    return Response({
+        "directos": [{"usuario": usr(d["usuario"]), "recibes": lib(d["recibes"]), "entregas": lib(d["entregas"])}
+                     for d in res["directos"]],
+        "ciclos": [{"usuarios": [usr(u) for u in c["usuarios"]],
+                    "pasos": [{"de": p["de"], "a": p["a"], "libros": lib(p["libros"])} for p in c["pasos"]]}
+                   for c in res["ciclos"]],
+        "listo": res["listo"],
+    })
 
-    serializer = SolicitudIntercambioSerializer(solicitud)
-    return Response(serializer.data, status=201)
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
@@ -1560,21 +1998,24 @@ def libros_ofrecidos_ocupados(request):
     """
     GET /api/solicitudes/ofertas-ocupadas/?user_id=123
     Devuelve { "ocupados": [1,2,3] } con IDs de libros del solicitante
-    que ya están ofrecidos en OTRA solicitud PENDIENTE.
+    que ya están ofrecidos en OTRA solicitud PENDIENTE o comprometidos en un
+    intercambio (estado_publicacion = en_negociacion).
     """
-    user_id = request.query_params.get("user_id")
+    user_id = _int_or_none(request.query_params.get("user_id"))
     if not user_id:
         return Response({"detail": "Falta user_id"}, status=400)
 
-    ocupados = (SolicitudOferta.objects
+    ofrecidos = (SolicitudOferta.objects
         .filter(
             id_solicitud__id_usuario_solicitante_id=user_id,
             id_solicitud__estado__iexact=SOLICITUD_ESTADO["PENDIENTE"]
         )
-        .values_list("id_libro_ofrecido_id", flat=True)
-        .distinct())
+        .values_list("id_libro_ofrecido_id", flat=True))
+    comprometidos = (Libro.objects
+        .filter(id_usuario_id=user_id, estado_publicacion=LIBRO_PUBLICACION["EN_NEGOCIACION"])
+        .values_list("id_libro", flat=True))
 
-    return Response({"ocupados": list(map(int, ocupados))})
+    return Response({"ocupados": sorted(set(ofrecidos) | set(comprometidos))})
 
 
 @api_view(["POST"])
@@ -1582,7 +2023,7 @@ def libros_ofrecidos_ocupados(request):
 def aceptar_solicitud(request, solicitud_id):
     # --- Validaciones básicas ---
     try:
-        user_id = int(request.data.get("user_id"))
+        user_id = int(usuario_id(request, request.data.get("user_id")))
     except (TypeError, ValueError):
         return Response({"detail": "user_id inválido."}, status=400)
 
@@ -1591,118 +2032,179 @@ def aceptar_solicitud(request, solicitud_id):
     except (TypeError, ValueError):
         return Response({"detail": "id_libro_aceptado inválido."}, status=400)
 
-    # Traer solicitud (pendiente o ya aceptada)
-    try:
-        solicitud = (
-            SolicitudIntercambio.objects
-            .select_related("id_usuario_solicitante", "id_usuario_receptor", "id_libro_deseado")
-            .get(
-                pk=solicitud_id,
-                estado__in=[SOLICITUD_ESTADO["PENDIENTE"], SOLICITUD_ESTADO["ACEPTADA"]],
-            )
-        )
-    except SolicitudIntercambio.DoesNotExist:
+    solicitud = (SolicitudIntercambio.objects
+                 .filter(pk=solicitud_id)
+                 .values("id_libro_deseado_id", "id_usuario_receptor_id", "id_usuario_solicitante_id")
+                 .first())
+    if not solicitud:
         return Response({"detail": "La solicitud no existe o ya fue respondida."}, status=404)
 
     # Solo el RECEPTOR puede aceptar
-    if user_id != solicitud.id_usuario_receptor_id:
+    if user_id != solicitud["id_usuario_receptor_id"]:
         return Response({"detail": "Solo el receptor puede aceptar esta solicitud."}, status=403)
 
+    try:
+        with transaction.atomic():
+            res = _aceptar_bloqueado(solicitud_id, solicitud["id_libro_deseado_id"], libro_aceptado_id)
+            if not isinstance(res, Response):
+                deseado_id = solicitud["id_libro_deseado_id"]
+                notificaciones.notificar([
+                    notificaciones.evento(solicitud["id_usuario_solicitante_id"],
+                                          "solicitud_aceptada", res[0], deseado_id),
+                    *(notificaciones.evento(u, "solicitud_rechazada", sid, deseado_id)
+                      for sid, u in res[1]),
+                ])
+    except IntegrityError as e:
+        if "ux_intercambio_libro_activo" not in str(e):
+            raise
+        # otro intercambio aceptado con este libro ganó la carrera
+        return Response({"detail": "El libro aceptado ya está comprometido en otro intercambio."}, status=409)
+    if isinstance(res, Response):
+        return res
+    intercambio_id, rechazadas = res
+    actividad.registrar(request, user_id, "solicitud_aceptada", solicitud_id)
+
+    return Response(
+        {
+            "message": "Intercambio aceptado. Chat habilitado.",
+            "intercambio_id": intercambio_id,
+            # otras pendientes del mismo libro, rechazadas automáticamente
+            "rechazadas": [sid for sid, _ in rechazadas],
+        },
+        status=200,
+    )
+
+
+def _aceptar_bloqueado(solicitud_id, libro_deseado_id, libro_aceptado_id):
+    """
+    Sección crítica de aceptar_solicitud (llamar dentro de transaction.atomic()).
+    Bloquea ambos libros en orden de id (evita deadlocks entre aceptaciones
+    cruzadas), luego la solicitud, y recién ahí re-valida todo.
+    Los locks de fila son la garantía para los dos roles: dos aceptaciones que
+    comparten un libro (deseado u ofrecido) se serializan en ese libro y la
+    segunda ya ve el intercambio de la primera. ux_intercambio_libro_activo
+    (migración 0009) es solo un respaldo para el libro ofrecido; el deseado
+    vive en la solicitud y no entra en un índice de `intercambio`.
+    Devuelve (intercambio_id, [(id_solicitud, id_usuario_solicitante) rechazadas])
+    o un Response de error.
+    """
+    libros = dict(
+        Libro.objects.select_for_update()
+        .filter(pk__in=sorted({libro_deseado_id, libro_aceptado_id}))
+        .order_by("pk")
+        .values_list("pk", "estado_publicacion")
+    )
+    solicitud = (SolicitudIntercambio.objects.select_for_update()
+                 .filter(pk=solicitud_id,
+                         estado__in=[SOLICITUD_ESTADO["PENDIENTE"], SOLICITUD_ESTADO["ACEPTADA"]])
+                 .first())
+    if not solicitud:
+        return Response({"detail": "La solicitud no existe o ya fue respondida."}, status=404)
+
     # El libro elegido debe ser parte de la oferta
-    es_de_oferta = SolicitudOferta.objects.filter(
+    if not SolicitudOferta.objects.filter(
         id_solicitud=solicitud, id_libro_ofrecido_id=libro_aceptado_id
-    ).exists()
-    if not es_de_oferta:
+    ).exists():
         return Response({"detail": "El libro seleccionado no es parte de la oferta original."}, status=400)
 
-    # Ambos libros deben seguir disponibles al momento de ACEPTAR
-    if not Libro.objects.filter(pk=solicitud.id_libro_deseado_id, disponible=True).exists():
+    # Ambos libros deben seguir publicados al momento de ACEPTAR
+    if libros.get(libro_deseado_id) not in PUBLICADOS:
         return Response({"detail": "Tu libro deseado ya no está disponible."}, status=409)
-    if not Libro.objects.filter(pk=libro_aceptado_id, disponible=True).exists():
+    if libros.get(libro_aceptado_id) not in PUBLICADOS:
         return Response({"detail": "El libro aceptado ya no está disponible."}, status=409)
 
-    # === Guards: evitar doble aceptación simultánea sobre estos libros ===
-    if Intercambio.objects.filter(
-        id_solicitud__id_libro_deseado_id=solicitud.id_libro_deseado_id,
-        estado_intercambio__iexact=INTERCAMBIO_ESTADO["ACEPTADO"],
-    ).exclude(id_solicitud_id=solicitud.id_solicitud).exists():
+    # Ningún otro intercambio ACEPTADO puede usar estos libros (en cualquier rol).
+    # Con ambos en 'disponible' (lo normal) no hay nada que buscar.
+    ocupados = set()
+    if any(est == LIBRO_PUBLICACION["EN_NEGOCIACION"] for est in libros.values()):
+        ocupados = libros_de_intercambios(
+            Intercambio.objects
+            .filter(estado_intercambio=INTERCAMBIO_ESTADO["ACEPTADO"])
+            .filter(Q(id_solicitud__id_libro_deseado_id__in=libros) |
+                    Q(id_libro_ofrecido_aceptado_id__in=libros))
+            .exclude(id_solicitud_id=solicitud.id_solicitud)
+        )
+    if libro_deseado_id in ocupados:
         return Response({"detail": "Ese libro ya tiene otro intercambio aceptado en curso."}, status=409)
+    if libro_aceptado_id in ocupados:
+        return Response({"detail": "El libro aceptado ya está comprometido en otro intercambio."}, status=409)
+
+    # 1) Marca la solicitud como aceptada y guarda el libro elegido
+    solicitud.estado = SOLICITUD_ESTADO["ACEPTADA"]
+    solicitud.id_libro_ofrecido_aceptado_id = libro_aceptado_id
+    solicitud.actualizada_en = timezone.now()
+    solicitud.save(update_fields=["estado", "id_libro_ofrecido_aceptado", "actualizada_en"])
 
-    if Intercambio.objects.filter(
+    # 2) Intercambio: INSERT IGNORE (ux_intercambio_solicitud) y una lectura que
+    #    trae también la conversación si ya existía (re-aceptar)
+    Intercambio.objects.bulk_create([Intercambio(
+        id_solicitud_id=solicitud.id_solicitud,
         id_libro_ofrecido_aceptado_id=libro_aceptado_id,
-        estado_intercambio__iexact=INTERCAMBIO_ESTADO["ACEPTADO"],
-    ).exclude(id_solicitud_id=solicitud.id_solicitud).exists():
+        estado_intercambio=INTERCAMBIO_ESTADO["ACEPTADO"],
+        lugar_intercambio="A coordinar",
+    )], ignore_conflicts=True)
+    fila = (Intercambio.objects
+            .filter(id_solicitud_id=solicitud.id_solicitud)
+            .values_list("id_intercambio", "id_libro_ofrecido_aceptado_id",
+                         "estado_intercambio", "conversaciones__id_conversacion")
+            .first())
+    if fila is None:
+        # el INSERT se ignoró por ux_intercambio_libro_activo: otro aceptado ganó
+        transaction.set_rollback(True)
         return Response({"detail": "El libro aceptado ya está comprometido en otro intercambio."}, status=409)
+    intercambio_id, libro_actual, estado_actual, conv_id = fila
 
-    with transaction.atomic():
-        # 1) Marca la solicitud como aceptada y guarda el libro elegido
-        solicitud.estado = SOLICITUD_ESTADO["ACEPTADA"]
-        solicitud.id_libro_ofrecido_aceptado_id = libro_aceptado_id
-        solicitud.actualizada_en = timezone.now()
-        solicitud.save(update_fields=["estado", "id_libro_ofrecido_aceptado", "actualizada_en"])
-
-        # 2) Crea/actualiza el Intercambio (no tocamos 'disponible' aquí)
-        intercambio, created = Intercambio.objects.get_or_create(
-            id_solicitud=solicitud,
-            defaults={
-                "id_libro_ofrecido_aceptado_id": libro_aceptado_id,
-                "estado_intercambio": INTERCAMBIO_ESTADO["ACEPTADO"],
-                "lugar_intercambio": "A coordinar",
-            },
-        )
-        if (not created) and (
-            intercambio.id_libro_ofrecido_aceptado_id != libro_aceptado_id
-            or (intercambio.estado_intercambio or "").lower() != INTERCAMBIO_ESTADO["ACEPTADO"].lower()
-        ):
-            intercambio.id_libro_ofrecido_aceptado_id = libro_aceptado_id
-            intercambio.estado_intercambio = INTERCAMBIO_ESTADO["ACEPTADO"]
-            intercambio.save(update_fields=["id_libro_ofrecido_aceptado", "estado_intercambio"])
-
-        # 3) Conversación del intercambio (con ultimo_id_mensaje=0)
-        conv, _ = Conversacion.objects.get_or_create(
-            id_intercambio_id=intercambio.id_intercambio,
-            defaults={
-                "creado_en": timezone.now(),
-                "actualizado_en": timezone.now(),
-                "ultimo_id_mensaje": 0,
-            },
+    if libro_actual != libro_aceptado_id or estado_actual != INTERCAMBIO_ESTADO["ACEPTADO"]:
+        Intercambio.objects.filter(pk=intercambio_id).update(
+            id_libro_ofrecido_aceptado_id=libro_aceptado_id,
+            estado_intercambio=INTERCAMBIO_ESTADO["ACEPTADO"],
         )
 
-        # 4) Participantes (una sola vez cada uno)
-        ConversacionParticipante.objects.get_or_create(
-            id_conversacion_id=conv.id_conversacion,
-            id_usuario_id=solicitud.id_usuario_solicitante_id,
-            defaults={"rol": "solicitante", "ultimo_visto_id_mensaje": 0, "silenciado": False, "archivado": False},
-        )
-        ConversacionParticipante.objects.get_or_create(
-            id_conversacion_id=conv.id_conversacion,
-            id_usuario_id=solicitud.id_usuario_receptor_id,
-            defaults={"rol": "ofreciente", "ultimo_visto_id_mensaje": 0, "silenciado": False, "archivado": False},
+    # libros de este intercambio (y el que se reemplazó, si re-acepta con otro)
+    recalcular({libro_deseado_id, libro_aceptado_id, libro_actual})
+
+    # 3) Conversación del intercambio (con ultimo_id_mensaje=0). La solicitud está
+    #    bloqueada, así que nadie más puede estar creándola en paralelo.
+    if conv_id is None:
+        ahora = timezone.now()
+        conv_id = Conversacion.objects.create(
+            id_intercambio_id=intercambio_id, creado_en=ahora, actualizado_en=ahora, ultimo_id_mensaje=0,
+        ).id_conversacion
+
+    # 4) Participantes: un solo INSERT IGNORE para ambos
+    ConversacionParticipante.objects.bulk_create([
+        ConversacionParticipante(
+            id_conversacion_id=conv_id, id_usuario_id=uid, rol=rol,
+            ultimo_visto_id_mensaje=0, silenciado=False, archivado=False,
         )
-
-        # 5) (ELIMINADO) No “reservamos” disponibilidad aquí
-
-        # 6) Rechazar automáticamente otras PENDIENTES del mismo libro deseado
-        (
-            SolicitudIntercambio.objects.filter(
-                id_libro_deseado_id=solicitud.id_libro_deseado_id,
-                estado__iexact=SOLICITUD_ESTADO["PENDIENTE"],
-            )
-            .exclude(pk=solicitud.id_solicitud)
-            .update(estado=SOLICITUD_ESTADO["RECHAZADA"], actualizada_en=timezone.now())
+        for uid, rol in ((solicitud.id_usuario_solicitante_id, "solicitante"),
+                         (solicitud.id_usuario_receptor_id, "ofreciente"))
+    ], ignore_conflicts=True)
+
+    # 5) (ELIMINADO) No “reservamos” disponibilidad aquí
+
+    # 6) Rechazar automáticamente otras PENDIENTES del mismo libro deseado
+    #    (se devuelven para avisar a sus solicitantes de una vez)
+    rechazadas = list(
+        SolicitudIntercambio.objects.select_for_update()
+        .filter(id_libro_deseado_id=solicitud.id_libro_deseado_id,
+                estado=SOLICITUD_ESTADO["PENDIENTE"])
+        .exclude(pk=solicitud.id_solicitud)
+        .values_list("id_solicitud", "id_usuario_solicitante_id")
+    )
+    if rechazadas:
+        SolicitudIntercambio.objects.filter(pk__in=[sid for sid, _ in rechazadas]).update(
+            estado=SOLICITUD_ESTADO["RECHAZADA"], actualizada_en=timezone.now()
         )
 
-    return Response(
-        {"message": "Intercambio aceptado. Chat habilitado.", "intercambio_id": intercambio.id_intercambio},
-        status=200,
-    )
+    return intercambio_id, rechazadas
 
 @api_view(["POST"])
 @permission_classes([AllowAny])  # en prod: IsAuthenticated
 def rechazar_solicitud(request, solicitud_id: int):
     # 1) Validar user_id
     try:
-        user_id = int(request.data.get("user_id"))
+        user_id = int(usuario_id(request, request.data.get("user_id")))
     except (TypeError, ValueError):
         return Response({"detail": "user_id inválido."}, status=400)
 
@@ -1742,6 +2244,12 @@ def rechazar_solicitud(request, solicitud_id: int):
             # Otro proceso la cambió entre lectura y update
             return Response({"detail": "La solicitud ya fue respondida."}, status=409)
 
+        notificaciones.notificar([notificaciones.evento(
+            solicitud.id_usuario_solicitante_id, "solicitud_rechazada",
+            solicitud_id, solicitud.id_libro_deseado_id,
+        )])
+
+    actividad.registrar(request, user_id, "solicitud_rechazada", solicitud_id)
     return Response({
         "ok": True,
         "id_solicitud": solicitud_id,
@@ -1789,7 +2297,7 @@ def proponer_encuentro(request, intercambio_id: int):
     if not it:
         return Response({"detail": "Intercambio no encontrado"}, status=404)
 
-    user_id = int(request.data.get("user_id") or 0)
+    user_id = int(usuario_id(request, request.data.get("user_id")) or 0)
     solicitante_id, ofreciente_id = _roles(it)
 
     if user_id != ofreciente_id:
@@ -1827,7 +2335,7 @@ def confirmar_encuentro(request, intercambio_id: int):
     if not it:
         return Response({"detail": "Intercambio no encontrado"}, status=404)
 
-    user_id = int(request.data.get("user_id") or 0)
+    user_id = int(usuario_id(request, request.data.get("user_id")) or 0)
     solicitante_id, ofreciente_id = _roles(it)
 
     if user_id != solicitante_id:
@@ -1860,7 +2368,7 @@ def generar_codigo(request, intercambio_id: int):
     if not it:
         return Response({"detail": "Intercambio no encontrado"}, status=404)
 
-    user_id = int(request.data.get("user_id") or 0)
+    user_id = int(usuario_id(request, request.data.get("user_id")) or 0)
     solicitante_id, ofreciente_id = _roles(it)
 
     if user_id != ofreciente_id:
@@ -1878,10 +2386,15 @@ def generar_codigo(request, intercambio_id: int):
 
     # En tu BD el código se guarda en claro (columna 'codigo') + expiración y usado_en
     expira = timezone.now() + timezone.timedelta(days=30)
-    obj, _ = IntercambioCodigo.objects.update_or_create(
-        id_intercambio=it,
-        defaults={"codigo": raw, "expira_en": expira, "usado_en": None}
-    )
+    with transaction.atomic():
+        obj, _ = IntercambioCodigo.objects.update_or_create(
+            id_intercambio=it,
+            defaults={"codigo": raw, "expira_en": expira, "usado_en": None}
+        )
+        # el solicitante es quien debe ingresarlo
+        notificaciones.notificar([notificaciones.evento(
+            solicitante_id, "codigo", intercambio_id, it.id_solicitud.id_libro_deseado_id,
+        )])
 
     # Para pruebas lo devolvemos; en prod muéstralo solo al ofreciente (UI).
     return Response({"ok": True, "codigo": raw, "expira_en": expira})
@@ -1930,8 +2443,14 @@ def completar_intercambio(request, intercambio_id: int):
     ctrl.save(update_fields=["usado_en"])
 
     try:
-        with connection.cursor() as cur:
+        with transaction.atomic(), connection.cursor() as cur:
             cur.callproc("sp_marcar_intercambio_completado", [intercambio_id, fecha])
+            recalcular(libros_de_intercambios(Intercambio.objects.filter(pk=intercambio_id)))
+            notificaciones.notificar([notificaciones.evento(
+                it.id_solicitud.id_usuario_receptor_id, "intercambio_completado",
+                intercambio_id, it.id_solicitud.id_libro_deseado_id,
+            )])
+        actividad.registrar(request, user_id, "intercambio_completado", intercambio_id)
         return Response({"ok": True})
     except Exception as e:
         ctrl.usado_en = None
@@ -1942,7 +2461,7 @@ def completar_intercambio(request, intercambio_id: int):
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def cancelar_solicitud(request, solicitud_id):
-    user_id = int(request.data.get("user_id") or 0)
+    user_id = int(usuario_id(request, request.data.get("user_id")) or 0)
     try:
         s = SolicitudIntercambio.objects.select_related("id_usuario_solicitante").get(pk=solicitud_id)
     except SolicitudIntercambio.DoesNotExist:
@@ -1956,12 +2475,13 @@ def cancelar_solicitud(request, solicitud_id):
 
     s.estado = SOLICITUD_ESTADO["CANCELADA"]
     s.save(update_fields=["estado"])
+    actividad.registrar(request, user_id, "solicitud_cancelada", solicitud_id)
     return Response({"ok": True, "estado": s.estado})
 
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def cancelar_intercambio(request, intercambio_id: int):
-    user_id = int(request.data.get("user_id") or 0)
+    user_id = int(usuario_id(request, request.data.get("user_id")) or 0)
     it = (Intercambio.objects
           .select_related("id_solicitud")
           .filter(pk=intercambio_id).first())
@@ -1982,7 +2502,9 @@ def cancelar_intercambio(request, intercambio_id: int):
         si = it.id_solicitud
         si.estado = SOLICITUD_ESTADO["CANCELADA"]
         si.save(update_fields=["estado"])
+        recalcular([si.id_libro_deseado_id, it.id_libro_ofrecido_aceptado_id])
 
+    actividad.registrar(request, user_id, "intercambio_cancelado", intercambio_id)
     return Response({"ok": True, "estado_intercambio": it.estado_intercambio, "estado_solicitud": it.id_solicitud.estado})
 
 